@@ -0,0 +1,245 @@
+import json
+import threading
+from collections import deque
+from datetime import datetime
+
+from cache import LRUCache
+from metrics import Counter
+
+ALERT_EVENTS = Counter("alert_events_total", "Alert state changes", ("state",))
+
+# Keys that select a rule's condition, and whether it fires above or below its threshold
+RULE_KINDS = {"above": "above", "below": "below", "rise": "above", "fall": "below"}
+
+
+class Rule:
+    """One alert rule.
+
+    ``above``/``below`` compare the field's value with ``threshold``;
+    ``rise``/``fall`` compare its change over the last ``per_s`` seconds.
+    The condition must hold for ``for_s`` seconds before the alert fires
+    (debounce), and the alert resolves only once the value is back past
+    ``clear`` (hysteresis; defaults to the threshold).
+    """
+
+    __slots__ = ("index", "name", "topic", "field", "kind", "threshold", "clear", "for_s", "window_s", "above")
+
+    def __init__(self, index, name, topic, field, kind, threshold, clear=None, for_s=0.0, per_s=60.0):
+        if kind not in RULE_KINDS:
+            raise ValueError(f"unknown alert rule kind {kind!r}")
+        self.index = index
+        self.name = name
+        self.topic = topic
+        self.field = field
+        self.kind = kind
+        self.above = RULE_KINDS[kind] == "above"
+        # A fall is a change below the negated threshold
+        sign = -1 if kind == "fall" else 1
+        self.threshold = sign * float(threshold)
+        self.clear = self.threshold if clear is None else sign * float(clear)
+        self.for_s = float(for_s)
+        self.window_s = float(per_s) if kind in ("rise", "fall") else None
+
+    def active(self, value):
+        return value > self.threshold if self.above else value < self.threshold
+
+    def cleared(self, value):
+        return value < self.clear if self.above else value > self.clear
+
+
+def parse_rules(spec):
+    """Parse a JSON list of rule objects, e.g.
+
+    ``[{"name": "hot", "topic": "sensors/+/dht", "field": "temperature", "above": 35, "for_s": 30, "clear": 34}]``
+
+    Each rule has exactly one of ``above``, ``below``, ``rise`` or ``fall``;
+    rate rules take ``per_s`` (default 60).
+    """
+    rules = []
+    for index, item in enumerate(json.loads(spec) if spec.strip() else []):
+        kinds = [kind for kind in RULE_KINDS if kind in item]
+        if len(kinds) != 1:
+            raise ValueError(f"alert rule {index} needs exactly one of {', '.join(RULE_KINDS)}")
+        kind = kinds[0]
+        rules.append(
+            Rule(
+                index,
+                item.get("name", f"rule-{index}"),
+                item.get("topic", "#"),
+                item["field"],
+                kind,
+                item[kind],
+                clear=item.get("clear"),
+                for_s=item.get("for_s", 0),
+                per_s=item.get("per_s", 60),
+            )
+        )
+    return rules
+
+
+class _Node:
+    __slots__ = ("children", "rules", "tail_rules")
+
+    def __init__(self):
+        self.children = {}
+        self.rules = []
+        # Rules whose pattern ends in "#" at this level
+        self.tail_rules = []
+
+
+class _State:
+    """Debounce, hysteresis and rate window for one rule on one device."""
+
+    __slots__ = ("pending_since", "firing", "samples")
+
+    def __init__(self, rule):
+        self.pending_since = None
+        self.firing = None
+        self.samples = deque() if rule.window_s is not None else None
+
+    def change(self, window_s, timestamp, value):
+        """Change over the last ``window_s`` seconds, or None until the window has filled."""
+        samples = self.samples
+        samples.append((timestamp, value))
+        # Keep one sample at or before the window start as the baseline
+        while len(samples) > 1 and samples[1][0] <= timestamp - window_s:
+            samples.popleft()
+        then, baseline = samples[0]
+        if then > timestamp - window_s:
+            return None
+        return value - baseline
+
+
+class AlertEngine:
+    """Evaluate alert rules incrementally, one message at a time.
+
+    Rules are indexed in a trie of MQTT topic levels (``+`` and ``#``
+    wildcards allowed) and each topic's matching rules are cached grouped by
+    field, so a message only touches the rules for its topic and the fields
+    it carries, however many rules there are. State is kept per rule and
+    device. ``evaluate`` is meant for the single ingest thread; the read
+    methods may be called from any thread.
+    """
+
+    def __init__(self, rules=(), history=100, topic_cache_size=4096):
+        self.rules = list(rules)
+        self.version = 0
+        self._root = _Node()
+        for rule in self.rules:
+            node = self._root
+            for level in rule.topic.split("/"):
+                if level == "#":
+                    node.tail_rules.append(rule)
+                    break
+                node = node.children.setdefault(level, _Node())
+            else:
+                node.rules.append(rule)
+        self._by_topic = LRUCache(topic_cache_size, name="alert_topics")
+        self._states = {}
+        self._firing = {}
+        self._recent = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def rules_for(self, topic):
+        """Return ``{field: [rules]}`` for the rules whose pattern matches ``topic``."""
+        fields = self._by_topic.get(topic)
+        if fields is None:
+            fields = {}
+            for rule in self._match(self._root, topic.split("/"), 0, []):
+                fields.setdefault(rule.field, []).append(rule)
+            self._by_topic.put(topic, fields)
+        return fields
+
+    def _match(self, node, levels, depth, found):
+        found.extend(node.tail_rules)
+        if depth == len(levels):
+            found.extend(node.rules)
+            return found
+        for key in (levels[depth], "+"):
+            child = node.children.get(key)
+            if child is not None:
+                self._match(child, levels, depth + 1, found)
+        return found
+
+    def evaluate(self, topic, device_id, payload, timestamp):
+        """Apply one decoded message and return the alert events it caused."""
+        fields = self.rules_for(topic)
+        if not fields:
+            return []
+        events = []
+        for field, rules in fields.items():
+            value = payload.get(field)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            for rule in rules:
+                event = self._update(rule, device_id or topic, topic, value, timestamp)
+                if event is not None:
+                    events.append(event)
+        return events
+
+    def _update(self, rule, device_id, topic, value, timestamp):
+        key = (rule.index, device_id)
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _State(rule)
+        if rule.window_s is not None:
+            value = state.change(rule.window_s, timestamp, value)
+            if value is None:
+                return None
+
+        if state.firing is None:
+            if not rule.active(value):
+                state.pending_since = None
+                return None
+            if state.pending_since is None:
+                state.pending_since = timestamp
+            if timestamp - state.pending_since < rule.for_s:
+                return None
+            event = self._event(rule, device_id, topic, value, timestamp, "firing")
+            state.firing = event
+            with self._lock:
+                self._firing[key] = event
+                self._record(event)
+            return event
+
+        if not rule.cleared(value):
+            return None
+        event = self._event(rule, device_id, topic, value, timestamp, "resolved")
+        event["since"] = state.firing["timestamp"]
+        state.firing = None
+        state.pending_since = None
+        with self._lock:
+            self._firing.pop(key, None)
+            self._record(event)
+        return event
+
+    def _event(self, rule, device_id, topic, value, timestamp, state):
+        return {
+            "rule": rule.name,
+            "kind": rule.kind,
+            "device": device_id,
+            "topic": topic,
+            "field": rule.field,
+            "state": state,
+            "value": abs(value) if rule.kind == "fall" else value,
+            "threshold": abs(rule.threshold) if rule.kind == "fall" else rule.threshold,
+            "timestamp": timestamp,
+            "time": datetime.fromtimestamp(timestamp).strftime("%H:%M:%S"),
+        }
+
+    def _record(self, event):
+        self._recent.append(event)
+        self.version += 1
+        ALERT_EVENTS.labels(event["state"]).inc()
+
+    def firing(self):
+        """Return the alerts currently firing, oldest first."""
+        with self._lock:
+            return sorted(self._firing.values(), key=lambda event: event["timestamp"])
+
+    def recent(self, limit=None):
+        """Return the most recent alert events, newest first."""
+        with self._lock:
+            events = list(self._recent)
+        events.reverse()
+        return events if limit is None else events[:limit]
@@ -1,25 +1,116 @@
 import json
 import os
+import time
+from datetime import datetime
 
 import dash
-from dash import Input, Output, callback, dcc, html
+import numpy as np
+from flask import Flask, Response, abort, g, request, stream_with_context
+from dash import ALL, Input, Output, Patch, State, callback, dcc, html, no_update
 from dotenv import load_dotenv
 
-from mqtt_client import get_recent_messages, publish_message, start_mqtt_connection
+from cache import LRUCache
+from export import FORMATS as EXPORT_FORMATS
+from export import stream_export
+from logging_config import configure_logging
+from metrics import CONTENT_TYPE, DELAY_BUCKETS, REGISTRY, SIZE_BUCKETS, Histogram
+from mqtt_client import (
+    MAX_DATA_POINTS,
+    READING_FIELDS,
+    REJECT_SAMPLES,
+    STATS_WINDOWS,
+    broadcaster,
+    format_clock,
+    get_alerts,
+    get_command_status,
+    get_devices,
+    get_message_cursor,
+    get_message_page,
+    get_message_topics,
+    get_message_version,
+    get_messages_since,
+    get_payload_text,
+    get_readings_since,
+    get_recent_messages,
+    get_rejected,
+    get_stats,
+    iter_readings,
+    send_command,
+    start_mqtt_connection,
+)
+from ring_buffer import NS_PER_S
+from rolling_stats import parse_counts
 
 # Load environment variables from .env file
 load_dotenv()
+configure_logging()
 
 # Initialize MQTT connection
 mqtt_client = start_mqtt_connection()
 
-# Initialize Dash app
-app = dash.Dash(__name__, assets_folder="assets")
+# Compress callback and API responses (gzip, or brotli where the browser accepts it)
+COMPRESS_RESPONSES = os.getenv("COMPRESS_RESPONSES", "True").lower() in ("true", "1", "yes")
+# Compact feed: cards carry class names styled in assets/style.css instead of inline styles
+FEED_COMPACT = os.getenv("FEED_COMPACT", "True").lower() in ("true", "1", "yes")
+# Serialized feed responses kept for reuse by other tabs at the same log version
+FEED_CACHE_SIZE = int(os.getenv("FEED_CACHE_SIZE", "64"))
+
+
+class _CompressedFeedCache:
+    """flask-compress cache backend that only keeps compressed feed responses.
+
+    Keys are ``"<algorithm>;<feed cache key>"``; responses without a feed
+    cache key come through as ``"<algorithm>;"`` and are not cached.
+    """
+
+    def __init__(self):
+        self._cache = LRUCache(FEED_CACHE_SIZE * 2, name="feed_compressed")
+
+    def get(self, key):
+        if key.endswith(";"):
+            return None
+        return self._cache.get(key)
+
+    def set(self, key, value):
+        if not key.endswith(";"):
+            self._cache.put(key, value)
+
+
+def _compressed_feed_key(_request):
+    return repr(g.feed_key) if "feed_key" in g else ""
+
+
+# Initialize Dash app. flask-compress reads its settings when Dash installs it,
+# so the server is configured before Dash is created
+server = Flask(__name__)
+server.config.update(
+    COMPRESS_ALGORITHM=["br", "gzip"],
+    COMPRESS_CACHE_BACKEND=_CompressedFeedCache,
+    COMPRESS_CACHE_KEY=_compressed_feed_key,
+)
+app = dash.Dash(__name__, server=server, assets_folder="assets", compress=COMPRESS_RESPONSES)
 app.title = os.getenv("TITLE", "IoT Message Viewer")
 
 UPDATE_INTERVAL_MS = int(os.getenv("UPDATE_INTERVAL_MS", "3000"))
 MQTT_TOPIC_DHT = os.getenv("MQTT_TOPIC_DHT", "sic/dibimbing/weresick/fadil/pub/dht")
 MQTT_TOPIC_LED = os.getenv("MQTT_TOPIC_LED", "sic/dibimbing/weresick/fadil/pub/led")
+# Push mode streams new messages over Server-Sent Events instead of polling
+PUSH_MODE = os.getenv("PUSH_MODE", "False").lower() in ("true", "1", "yes")
+PUSH_KEEPALIVE_S = float(os.getenv("PUSH_KEEPALIVE_S", "15"))
+# Most often a tab refreshes the feed and charts on push events, however fast messages arrive
+PUSH_MIN_INTERVAL_MS = int(os.getenv("PUSH_MIN_INTERVAL_MS", "250"))
+# How often the LED status is refreshed while a command waits for its acknowledgement
+COMMAND_POLL_MS = int(os.getenv("COMMAND_POLL_MS", "250"))
+# Alert events listed under the firing alerts
+ALERT_PANEL_LIMIT = int(os.getenv("ALERT_PANEL_LIMIT", "10"))
+# Rows fetched per request by the message history list, and the most one request may ask for
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "100"))
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", "500"))
+# Live charts: selectable windows (points kept per trace), the window from which traces
+# are drawn with WebGL, and how many devices are charted until the viewer picks some
+CHART_WINDOWS = parse_counts(os.getenv("CHART_WINDOWS", "300,3000,30000"))
+CHART_WEBGL_POINTS = int(os.getenv("CHART_WEBGL_POINTS", "2000"))
+CHART_DEVICES = int(os.getenv("CHART_DEVICES", "4"))
 
 # App layout focusing on incoming MQTT messages
 app.layout = html.Div(
@@ -126,10 +217,73 @@ app.layout = html.Div(
                 "backgroundColor": "#0f172a",
             },
         ),
+        # Firing alerts and recent alert events
+        html.Div(id="alert-panel", className="alert-panel"),
+        dcc.Store(id="alert-version"),
+        # Rolling statistics of the default device over a chosen number of readings
+        html.Div(
+            [
+                html.Div(
+                    [
+                        html.H3("📈 Statistik", className="stats-heading"),
+                        dcc.RadioItems(
+                            id="stats-window",
+                            options=[{"label": f"{window} pembacaan", "value": window} for window in STATS_WINDOWS],
+                            value=MAX_DATA_POINTS,
+                            inline=True,
+                            className="stats-windows",
+                        ),
+                    ],
+                    className="stats-header",
+                ),
+                html.Div(id="stats-table"),
+            ],
+            className="stats-panel",
+        ),
+        # Live charts per device, extended in place with only the new readings
+        html.Div(
+            [
+                html.Div(
+                    [
+                        html.H3("📉 Grafik Langsung", className="stats-heading"),
+                        dcc.Dropdown(
+                            id="chart-devices", multi=True, placeholder="Pilih perangkat", className="chart-devices"
+                        ),
+                        dcc.RadioItems(
+                            id="chart-window",
+                            options=[{"label": f"{window} titik", "value": window} for window in CHART_WINDOWS],
+                            value=CHART_WINDOWS[0],
+                            inline=True,
+                            className="stats-windows",
+                        ),
+                    ],
+                    className="stats-header chart-header",
+                ),
+                html.Div(id="chart-grid", className="chart-grid"),
+                # Bumped whenever the charts are laid out again, so their cursors start over
+                dcc.Store(id="chart-reset", data=0),
+                dcc.Store(id="chart-cursors"),
+            ],
+            className="stats-panel",
+        ),
         dcc.Interval(
             id="interval-component",
             interval=UPDATE_INTERVAL_MS,
             n_intervals=0,
+            disabled=PUSH_MODE,
+        ),
+        # Alerts, statistics and the device list poll at the same pace in push mode too
+        dcc.Interval(id="panel-interval", interval=UPDATE_INTERVAL_MS, n_intervals=0),
+        dcc.Store(id="feed-cursor"),
+        # Enabled only while an LED command is queued or in flight
+        dcc.Interval(id="command-poll", interval=COMMAND_POLL_MS, disabled=True),
+        # Clicked by assets/push.js, at most every PUSH_MIN_INTERVAL_MS, when the event stream reports new
+        # messages; only the feed and the charts follow it
+        html.Button(
+            id="push-signal",
+            n_clicks=0,
+            style={"display": "none"},
+            **({"data-stream": "/stream", "data-min-interval": str(PUSH_MIN_INTERVAL_MS)} if PUSH_MODE else {}),
         ),
         html.Div(
             [
@@ -137,10 +291,7 @@ app.layout = html.Div(
                     id="message-feed",
                     children=html.Div(
                         "Belum ada pesan MQTT yang diterima.",
-                        style={
-                            "padding": "1rem",
-                            "color": "#94a3b8",
-                        },
+                        className="feed-empty",
                     ),
                     style={
                         "display": "flex",
@@ -155,6 +306,30 @@ app.layout = html.Div(
                 "minHeight": "calc(100vh - 250px)",
             },
         ),
+        # Every retained message, paged in by assets/history.js as it scrolls into view
+        html.Div(
+            [
+                html.H3(
+                    "📜 Riwayat Pesan",
+                    style={
+                        "margin": "0 0 1rem 0",
+                        "color": "#f1f5f9",
+                        "fontSize": "1.1rem",
+                        "fontWeight": "600",
+                        "borderBottom": "2px solid #64748b",
+                        "paddingBottom": "0.5rem",
+                    },
+                ),
+                html.Div(
+                    id="message-history",
+                    **{"data-source": "/api/messages", "data-page-size": str(HISTORY_PAGE_SIZE)},
+                ),
+            ],
+            style={
+                "padding": "0 2rem 2rem 2rem",
+                "backgroundColor": "#0f172a",
+            },
+        ),
     ],
     style={
         "fontFamily": "'Segoe UI', 'Roboto', 'Oxygen', 'Ubuntu', 'Cantarell', 'Helvetica Neue', sans-serif",
@@ -165,238 +340,646 @@ app.layout = html.Div(
 )
 
 
-@callback(Output("message-feed", "children"), Input("interval-component", "n_intervals"))
-def update_message_feed(_):
-    """Refresh message feed with the latest MQTT payloads."""
-    messages = get_recent_messages()
+FEED_LIMIT = 50
+FEED_SECTIONS = (
+    ("dht", "📊 DHT11 Temperature & Humidity", "#06b6d4", "Belum ada data DHT"),
+    ("led", "💡 LED Control Messages", "#f97316", "Belum ada pesan LED"),
+)
 
-    if not messages:
-        return html.Div(
-            "Belum ada pesan MQTT yang diterima.",
-            style={
-                "padding": "1rem",
-                "color": "#94a3b8",
-            },
+
+def _feed_section(message):
+    """Return the feed section a message belongs to, or None."""
+    topic = message.get("topic", "").lower()
+    if "dht" in topic:
+        return "dht"
+    if "led" in topic:
+        return "led"
+    return None
+
+
+def _render_message_card(message, name, accent):
+    """Build the card for a single MQTT message."""
+    topic = message.get("topic", "unknown")
+    payload_text = get_payload_text(message)
+
+    if FEED_COMPACT:
+        # One element per card; the header is drawn from data-meta by the stylesheet
+        return html.Pre(
+            payload_text,
+            className=f"feed-card feed-{name}",
+            **{"data-meta": f"{format_clock(message['timestamp'])} · {topic}"},
         )
 
-    display_messages = list(reversed(messages[-50:]))
-    
-    # Separate messages by topic
-    dht_messages = [m for m in display_messages if "dht" in m.get("topic", "").lower()]
-    led_messages = [m for m in display_messages if "led" in m.get("topic", "").lower()]
-    
-    cards = []
-    
-    # DHT Section
-    if dht_messages or led_messages:  # Show section headers if any messages exist
-        cards.append(
+    return html.Div(
+        [
+            html.Div(
+                [
+                    html.Span(
+                        format_clock(message["timestamp"]),
+                        style={
+                            "fontWeight": "600",
+                            "color": "#f1f5f9",
+                        },
+                    ),
+                    html.Span(
+                        f" · {topic}",
+                        style={
+                            "color": "#94a3b8",
+                            "marginLeft": "0.25rem",
+                        },
+                    ),
+                ]
+            ),
+            html.Pre(
+                payload_text,
+                style={
+                    "backgroundColor": "#1e293b",
+                    "padding": "0.75rem",
+                    "borderRadius": "0.5rem",
+                    "margin": "0.5rem 0 0 0",
+                    "whiteSpace": "pre-wrap",
+                    "wordBreak": "break-word",
+                    "fontSize": "0.9rem",
+                },
+            ),
+        ],
+        style={
+            "backgroundColor": "#1e293b",
+            "border": f"2px solid {accent}",
+            "borderRadius": "0.75rem",
+            "padding": "1rem",
+        },
+    )
+
+
+def _render_feed(messages):
+    """Render the full feed and return it with the new client-side cursor.
+
+    The feed is a flat list of ``[header, cards, header, cards]`` so that
+    delta updates can address each section's cards by index.
+    """
+    cursor = {"seq": messages[-1]["seq"] if messages else get_message_cursor()}
+
+    if not messages:
+        cursor.update({name: [] for name, *_ in FEED_SECTIONS})
+        return html.Div("Belum ada pesan MQTT yang diterima.", className="feed-empty"), cursor
+
+    display_messages = list(reversed(messages[-FEED_LIMIT:]))
+    children = []
+
+    for index, (name, title, accent, empty_text) in enumerate(FEED_SECTIONS):
+        section_messages = [m for m in display_messages if _feed_section(m) == name]
+        cursor[name] = [m["seq"] for m in section_messages]
+        cards = [_render_message_card(m, name, accent) for m in section_messages]
+
+        if FEED_COMPACT:
+            children.append(html.H3(title, className=f"feed-heading feed-{name}"))
+            children.append(
+                html.Div(cards or html.Div(empty_text, className="feed-empty"), className="feed-cards")
+            )
+            continue
+
+        children.append(
             html.Div(
                 [
                     html.H3(
-                        "📊 DHT11 Temperature & Humidity",
+                        title,
                         style={
-                            "margin": "0 0 1rem 0",
+                            "margin": "0 0 1rem 0" if index == 0 else "1.5rem 0 1rem 0",
                             "color": "#f1f5f9",
                             "fontSize": "1.1rem",
                             "fontWeight": "600",
-                            "borderBottom": "2px solid #06b6d4",
+                            "borderBottom": f"2px solid {accent}",
                             "paddingBottom": "0.5rem",
                         },
                     ),
                 ],
-                style={
-                    "marginTop": "0.5rem" if not cards else "1.5rem",
-                },
+                style={"marginTop": "0.5rem"} if index == 0 else None,
             )
         )
-    
-    if dht_messages:
-        for message in dht_messages:
-            payload = message.get("payload")
-            topic = message.get("topic", "unknown")
-
-            if isinstance(payload, dict):
-                payload_text = json.dumps(payload, indent=2, ensure_ascii=False)
-            else:
-                payload_text = str(payload)
-
-            cards.append(
-                html.Div(
-                    [
-                        html.Div(
-                            [
-                                html.Span(
-                                    message.get("timestamp", "--:--:--"),
-                                    style={
-                                        "fontWeight": "600",
-                                        "color": "#f1f5f9",
-                                    },
-                                ),
-                                html.Span(
-                                    f" · {topic}",
-                                    style={
-                                        "color": "#94a3b8",
-                                        "marginLeft": "0.25rem",
-                                    },
-                                ),
-                            ]
-                        ),
-                        html.Pre(
-                            payload_text,
-                            style={
-                                "backgroundColor": "#1e293b",
-                                "padding": "0.75rem",
-                                "borderRadius": "0.5rem",
-                                "margin": "0.5rem 0 0 0",
-                                "whiteSpace": "pre-wrap",
-                                "wordBreak": "break-word",
-                                "fontSize": "0.9rem",
-                            },
-                        ),
-                    ],
-                    style={
-                        "backgroundColor": "#1e293b",
-                        "border": "2px solid #06b6d4",
-                        "borderRadius": "0.75rem",
-                        "padding": "1rem",
-                    },
-                )
-            )
-    else:
-        cards.append(
-            html.Div(
-                "Belum ada data DHT",
+
+        if not cards:
+            cards = html.Div(
+                empty_text,
                 style={
                     "padding": "1rem",
                     "color": "#64748b",
                     "fontSize": "0.9rem",
                 },
             )
-        )
-    
-    # LED Section
-    cards.append(
-        html.Div(
-            [
-                html.H3(
-                    "💡 LED Control Messages",
-                    style={
-                        "margin": "1.5rem 0 1rem 0",
-                        "color": "#f1f5f9",
-                        "fontSize": "1.1rem",
-                        "fontWeight": "600",
-                        "borderBottom": "2px solid #f97316",
-                        "paddingBottom": "0.5rem",
-                    },
-                ),
-            ],
-        )
-    )
-    
-    if led_messages:
-        for message in led_messages:
-            payload = message.get("payload")
-            topic = message.get("topic", "unknown")
-
-            if isinstance(payload, dict):
-                payload_text = json.dumps(payload, indent=2, ensure_ascii=False)
-            else:
-                payload_text = str(payload)
-
-            cards.append(
-                html.Div(
-                    [
-                        html.Div(
-                            [
-                                html.Span(
-                                    message.get("timestamp", "--:--:--"),
-                                    style={
-                                        "fontWeight": "600",
-                                        "color": "#f1f5f9",
-                                    },
-                                ),
-                                html.Span(
-                                    f" · {topic}",
-                                    style={
-                                        "color": "#94a3b8",
-                                        "marginLeft": "0.25rem",
-                                    },
-                                ),
-                            ]
-                        ),
-                        html.Pre(
-                            payload_text,
-                            style={
-                                "backgroundColor": "#1e293b",
-                                "padding": "0.75rem",
-                                "borderRadius": "0.5rem",
-                                "margin": "0.5rem 0 0 0",
-                                "whiteSpace": "pre-wrap",
-                                "wordBreak": "break-word",
-                                "fontSize": "0.9rem",
-                            },
-                        ),
-                    ],
-                    style={
-                        "backgroundColor": "#1e293b",
-                        "border": "2px solid #f97316",
-                        "borderRadius": "0.75rem",
-                        "padding": "1rem",
-                    },
-                )
-            )
-    else:
-        cards.append(
+        children.append(
             html.Div(
-                "Belum ada pesan LED",
+                cards,
                 style={
-                    "padding": "1rem",
-                    "color": "#64748b",
-                    "fontSize": "0.9rem",
+                    "display": "flex",
+                    "flexDirection": "column",
+                    "gap": "0.75rem",
                 },
             )
         )
 
-    return cards
+    return children, cursor
+
+
+def _render_latest_feed():
+    """Full render of the newest ``FEED_LIMIT`` messages."""
+    return _render_feed(get_recent_messages(FEED_LIMIT))
+
+
+@callback(
+    [Output("message-feed", "children"), Output("feed-cursor", "data")],
+    [Input("interval-component", "n_intervals"), Input("push-signal", "n_clicks")],
+    State("feed-cursor", "data"),
+)
+def update_message_feed(_, __, cursor):
+    """Send only the MQTT messages received since the client's cursor.
+
+    Falls back to a full render on first load, after a server restart, when
+    the client fell too far behind, or when a section becomes (non-)empty.
+    """
+    latest_seq = get_message_cursor()
+
+    if not cursor or latest_seq < cursor["seq"] or latest_seq - cursor["seq"] >= FEED_LIMIT:
+        return _render_latest_feed()
+
+    if latest_seq == cursor["seq"]:
+        return no_update, no_update
+
+    new_messages = get_messages_since(cursor["seq"])
+    if not new_messages:
+        return no_update, no_update
+
+    now = time.time_ns()
+    RENDER_LATENCY_SECONDS.observe_many([(now - message["timestamp"]) / NS_PER_S for message in new_messages])
+    # Messages may have arrived since the cursor check; the fetched batch is authoritative
+    latest_seq = new_messages[-1]["seq"]
+    floor = latest_seq - FEED_LIMIT
+    patch = Patch()
+    new_cursor = {"seq": latest_seq}
+
+    for index, (name, _title, accent, _empty) in enumerate(FEED_SECTIONS):
+        shown = cursor[name]
+        added = [m for m in new_messages if _feed_section(m) == name]
+        kept = [seq for seq in shown if seq > floor]
+
+        if bool(shown) != bool(kept or added):
+            return _render_latest_feed()
+
+        cards = patch[2 * index + 1]["props"]["children"]
+        for message in added:
+            cards.prepend(_render_message_card(message, name, accent))
+        # Drop cards that scrolled out of the window, last index first
+        for position in range(len(shown) + len(added) - 1, len(kept) + len(added) - 1, -1):
+            del cards[position]
+
+        new_cursor[name] = [m["seq"] for m in reversed(added)] + kept
+
+    return patch, new_cursor
+
+
+def _describe_alert(event):
+    condition = {"above": ">", "below": "<", "rise": "naik >", "fall": "turun >"}[event["kind"]]
+    return f"{event['device']} · {event['field']} {event['value']:g} ({condition} {event['threshold']:g})"
+
+
+def _render_alerts(alerts):
+    """Build the alert panel: firing alerts first, then the latest state changes."""
+    if not alerts["rules"]:
+        return []
+    firing = [
+        html.Div(
+            [html.Span(event["rule"], className="alert-rule"), f"{event['time']} · {_describe_alert(event)}"],
+            className="alert-item alert-firing",
+        )
+        for event in alerts["firing"]
+    ] or [html.Div("✓ Tidak ada alert aktif", className="alert-item alert-resolved")]
+    recent = [
+        html.Div(
+            f"{event['time']} · {'🚨' if event['state'] == 'firing' else '✓'} {event['rule']} · {_describe_alert(event)}",
+            className=f"alert-event alert-{event['state']}",
+        )
+        for event in alerts["recent"]
+    ]
+    return [html.H3("🚨 Alerts", className="alert-heading"), *firing, *recent]
+
+
+@callback(
+    [Output("alert-panel", "children"), Output("alert-version", "data")],
+    Input("panel-interval", "n_intervals"),
+    State("alert-version", "data"),
+)
+def update_alerts(_, version):
+    """Re-render the alert panel only when an alert changed state."""
+    alerts = get_alerts(ALERT_PANEL_LIMIT)
+    if alerts["version"] == version:
+        return no_update, no_update
+    return _render_alerts(alerts), alerts["version"]
+
+
+STATS_FIELDS = (("temperature", "🌡️ Suhu (°C)"), ("humidity", "💧 Kelembapan (%)"))
+
+
+def _format_stat(value):
+    return "–" if value is None else f"{value:.1f}"
 
 
 @callback(
-    [Output("led-status", "children"), Output("led-status", "style")],
-    [Input("btn-led-on", "n_clicks"), Input("btn-led-off", "n_clicks")],
+    Output("stats-table", "children"),
+    [Input("panel-interval", "n_intervals"), Input("stats-window", "value")],
+)
+def update_stats(_, window):
+    """Show rolling statistics; they are maintained at ingest, so this is cheap for any window."""
+    stats = get_stats(window)
+    if not stats["fields"] or not stats["fields"]["temperature"]["count"]:
+        return html.Div("Belum ada data sensor.", className="feed-empty")
+    spans = list(stats["fields"]["temperature"]["ema"])
+    header = ["", "Min", "Max", "Rata-rata", "σ", *(f"EMA {span}" for span in spans), "n"]
+    rows = []
+    for field, label in STATS_FIELDS:
+        summary = stats["fields"][field]
+        cells = [summary["min"], summary["max"], summary["mean"], summary["stddev"], *summary["ema"].values()]
+        rows.append(
+            html.Tr([html.Th(label), *(html.Td(_format_stat(value)) for value in cells), html.Td(summary["count"])])
+        )
+    return html.Table([html.Thead(html.Tr([html.Th(text) for text in header])), html.Tbody(rows)], className="stats-table")
+
+
+CHART_TRACES = (
+    ("temperature", "🌡️ Suhu (°C)", "#f97316", "y"),
+    ("humidity", "💧 Kelembapan (%)", "#06b6d4", "y2"),
 )
-def control_led(on_clicks, off_clicks):
-    """Handle LED control button clicks."""
-    if on_clicks + off_clicks == 0:
-        return ("--", {"marginLeft": "1rem", "color": "#94a3b8", "fontSize": "0.9rem"})
-
-    # Determine which button was clicked last
-    ctx = dash.callback_context
-    if not ctx.triggered:
-        return ("--", {"marginLeft": "1rem", "color": "#94a3b8", "fontSize": "0.9rem"})
-
-    button_id = ctx.triggered[0]["prop_id"].split(".")[0]
-
-    if button_id == "btn-led-on":
-        message = json.dumps({"action": "on", "status": True})
-        status_text = "✓ Mengirim: ON"
-        status_color = "#10b981"
-    else:
-        message = json.dumps({"action": "off", "status": False})
-        status_text = "✓ Mengirim: OFF"
-        status_color = "#ef4444"
-
-    # Publish to LED topic
-    publish_message(MQTT_TOPIC_LED, message)
-
-    return (
-        status_text,
-        {
-            "marginLeft": "1rem",
-            "color": status_color,
-            "fontSize": "0.9rem",
-            "fontWeight": "600",
+
+
+def _chart_figure(device_id, window):
+    """Empty figure for one device; readings only ever reach it through extendData."""
+    trace_type = "scattergl" if window >= CHART_WEBGL_POINTS else "scatter"
+    return {
+        "data": [
+            {
+                "type": trace_type,
+                "mode": "lines",
+                "name": label,
+                "x": [],
+                "y": [],
+                "yaxis": axis,
+                "line": {"color": color, "width": 1.5},
+            }
+            for _field, label, color, axis in CHART_TRACES
+        ],
+        "layout": {
+            "title": {"text": device_id, "font": {"size": 14}},
+            "height": 280,
+            "margin": {"l": 48, "r": 48, "t": 36, "b": 32},
+            "paper_bgcolor": "#1e293b",
+            "plot_bgcolor": "#1e293b",
+            "font": {"color": "#cbd5e1"},
+            "showlegend": False,
+            "xaxis": {"type": "date", "gridcolor": "#334155"},
+            "yaxis": {"title": {"text": "°C"}, "color": "#f97316", "gridcolor": "#334155"},
+            "yaxis2": {
+                "title": {"text": "%"},
+                "color": "#06b6d4",
+                "overlaying": "y",
+                "side": "right",
+                "showgrid": False,
+            },
+            # Keeps the viewer's zoom while points are appended
+            "uirevision": device_id,
         },
+    }
+
+
+def _utc_offset_ms(timestamp_ms):
+    """The local UTC offset in effect at ``timestamp_ms``, in milliseconds."""
+    return int(datetime.fromtimestamp(timestamp_ms / 1000).astimezone().utcoffset().total_seconds() * 1000)
+
+
+def _chart_times(timestamps):
+    """Epoch-nanosecond timestamps as epoch milliseconds shifted to local time.
+
+    Plotly draws numbers on a date axis as UTC wall-clock time, so the shift
+    makes the charts agree with the feed's local times. Each point gets the
+    offset in effect at its own time, so a window across a daylight-saving
+    change stays right; when both ends of a window shorter than a day share
+    an offset, no change can lie between them and one offset serves all.
+    """
+    times = timestamps // (NS_PER_S // 1000)
+    first = _utc_offset_ms(int(times[0]))
+    if first == _utc_offset_ms(int(times[-1])) and times[-1] - times[0] < 86_400_000:
+        return (times + first).tolist()
+    return [time_ms + _utc_offset_ms(time_ms) for time_ms in times.tolist()]
+
+
+@callback(
+    [Output("chart-devices", "options"), Output("chart-devices", "value")],
+    Input("panel-interval", "n_intervals"),
+    [State("chart-devices", "options"), State("chart-devices", "value")],
+)
+def update_chart_devices(_, options, selected):
+    """Offer every known device; the first CHART_DEVICES are charted until the viewer picks."""
+    devices = [device["device_id"] for device in get_devices()]
+    if devices == options:
+        return no_update, no_update
+    return devices, devices[:CHART_DEVICES] if selected is None and devices else no_update
+
+
+@callback(
+    [Output("chart-grid", "children"), Output("chart-reset", "data")],
+    [Input("chart-devices", "value"), Input("chart-window", "value")],
+    State("chart-reset", "data"),
+)
+def render_charts(devices, window, generation):
+    """Lay out one empty chart per selected device; update_charts fills them."""
+    generation = (generation or 0) + 1
+    if not devices:
+        return html.Div("Belum ada perangkat yang dipilih.", className="feed-empty"), generation
+    charts = [
+        dcc.Graph(
+            id={"type": "live-chart", "device": device_id},
+            figure=_chart_figure(device_id, window),
+            config={"displaylogo": False},
+            className="chart",
+        )
+        for device_id in devices
+    ]
+    return charts, generation
+
+
+@callback(
+    [Output({"type": "live-chart", "device": ALL}, "extendData"), Output("chart-cursors", "data")],
+    [Input("interval-component", "n_intervals"), Input("push-signal", "n_clicks"), Input("chart-reset", "data")],
+    [
+        State({"type": "live-chart", "device": ALL}, "id"),
+        State("chart-window", "value"),
+        State("chart-cursors", "data"),
+    ],
+)
+def update_charts(_, __, generation, charts, window, cursors):
+    """Append the readings each chart has not seen yet through extendData.
+
+    Only new points are sent, at most ``window`` per chart, and the browser
+    drops the oldest beyond ``window`` (extendData's maxPoints), so no figure
+    is ever rebuilt. Cursors are the last timestamp sent, kept as strings
+    because epoch nanoseconds do not survive JavaScript numbers.
+    """
+    if not cursors or cursors["generation"] != generation:
+        cursors = {"generation": generation, "devices": {}}
+    positions = cursors["devices"]
+    updates = []
+    for chart in charts:
+        device_id = chart["device"]
+        cursor = positions.get(device_id)
+        readings = get_readings_since(device_id, None if cursor is None else int(cursor), window)
+        timestamps = readings["timestamps"]
+        if not len(timestamps):
+            updates.append(no_update)
+            continue
+        positions[device_id] = str(int(timestamps[-1]))
+        times = _chart_times(timestamps)
+        values = [np.round(readings[field].astype(np.float64), 2).tolist() for field, *_ in CHART_TRACES]
+        updates.append([{"x": [times] * len(values), "y": values}, list(range(len(values))), window])
+    if all(update is no_update for update in updates):
+        return updates, no_update
+    return updates, cursors
+
+
+CALLBACK_SECONDS = Histogram(
+    "dash_callback_seconds", "Server time spent on Dash callback requests", ("output",)
+)
+RENDER_LATENCY_SECONDS = Histogram(
+    "dashboard_render_latency_seconds",
+    "Time from on_message until a feed update first sends the message to a browser",
+    buckets=DELAY_BUCKETS,
+)
+CALLBACK_RESPONSE_BYTES = Histogram(
+    "dash_callback_response_bytes", "Size of Dash callback responses", ("output",), buckets=SIZE_BUCKETS
+)
+
+
+@app.server.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+def _callback_body():
+    """The Dash callback request's JSON body, parsed once per request."""
+    if "callback_body" not in g:
+        g.callback_body = request.get_json(silent=True) or {}
+    return g.callback_body
+
+
+@app.server.after_request
+def _observe_callback(response):
+    """Record render time and response size for each Dash callback (e.g. the message feed)."""
+    if request.path.endswith("/_dash-update-component") and "request_started" in g:
+        output = _callback_body().get("output", "unknown")
+        CALLBACK_SECONDS.labels(output).observe(time.perf_counter() - g.request_started)
+        size = response.calculate_content_length()
+        if size is not None:
+            CALLBACK_RESPONSE_BYTES.labels(output).observe(size)
+    return response
+
+
+FEED_OUTPUT = "..message-feed.children...feed-cursor.data.."
+feed_cache = LRUCache(FEED_CACHE_SIZE, name="feed")
+
+
+def _feed_cursor_key(state):
+    """A hashable copy of the feed cursor in a callback's ``state``, built without serializing it again."""
+    cursor = state[0].get("value") if state else None
+    if not isinstance(cursor, dict):
+        return None
+    return (cursor.get("seq"),) + tuple(tuple(cursor.get(name) or ()) for name, *_ in FEED_SECTIONS)
+
+
+@app.server.before_request
+def _serve_cached_feed():
+    """Answer a feed poll from the cache if another tab already rendered it.
+
+    The feed callback's response depends only on the message log and the
+    client's cursor, so the serialized response is cached under
+    ``(log version, cursor)``. Tabs that are in sync share one render per
+    new message, however many of them are open.
+    """
+    if not request.path.endswith("/_dash-update-component"):
+        return None
+    body = _callback_body()
+    if body.get("output") != FEED_OUTPUT:
+        return None
+    key = (get_message_version(), _feed_cursor_key(body.get("state")))
+    # Also keys the compressed copies, so cache hits are not compressed again per tab
+    g.feed_key = key
+    cached = feed_cache.get(key)
+    if cached is not None:
+        status, data = cached
+        return Response(data, status=status, mimetype="application/json")
+    # Rendering may see messages newer than the key; that response is still valid for this cursor
+    g.feed_cache_key = key
+    return None
+
+
+@app.server.after_request
+def _store_feed_response(response):
+    if "feed_cache_key" in g and response.status_code in (200, 204):
+        feed_cache.put(g.feed_cache_key, (response.status_code, response.get_data()))
+    return response
+
+
+@app.server.route("/metrics")
+def metrics():
+    """Prometheus text exposition of ingest, lock, buffer and callback metrics."""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+def _int_arg(name, default=None, minimum=0, maximum=None):
+    value = request.args.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        abort(400)
+    if value < minimum or (maximum is not None and value > maximum):
+        abort(400)
+    return value
+
+
+@app.server.route("/api/messages")
+def message_page():
+    """One page of the message log, newest first: ``?offset=&limit=&topic=&until=``."""
+    page = get_message_page(
+        offset=_int_arg("offset", 0),
+        limit=_int_arg("limit", HISTORY_PAGE_SIZE, maximum=HISTORY_PAGE_MAX),
+        topic=request.args.get("topic") or None,
+        until=_int_arg("until"),
     )
+    return Response(json.dumps(page, ensure_ascii=False, default=str), content_type="application/json")
+
+
+def _time_arg(name):
+    """Parse an epoch-seconds or ISO 8601 query parameter (naive times are local)."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        abort(400)
+
+
+@app.server.route("/export")
+def export_readings():
+    """Stream readings: ``?format=csv|ndjson|parquet&device=a,b&start=&end=``.
+
+    Rows are read and encoded one chunk at a time, so memory use is constant
+    and the device locks are only held while each chunk is copied.
+    """
+    export_format = request.args.get("format", "csv").lower()
+    devices = [device for value in request.args.getlist("device") for device in value.split(",") if device]
+    try:
+        body = stream_export(
+            export_format,
+            iter_readings(devices or None, start=_time_arg("start"), end=_time_arg("end")),
+            READING_FIELDS,
+        )
+    except ValueError as e:
+        return Response(f"{e}\n", status=400, mimetype="text/plain")
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="readings.{extension}"'},
+    )
+
+
+@app.server.route("/api/messages/topics")
+def message_topics():
+    """Retained message count per topic, for the history list's topic filter."""
+    return Response(json.dumps(get_message_topics(), ensure_ascii=False), content_type="application/json")
+
+
+@app.server.route("/api/rejected")
+def rejected_messages():
+    """Rejected sensor message counts by reason and the newest kept samples: ``?limit=``."""
+    rejected = get_rejected(_int_arg("limit", 20, maximum=max(REJECT_SAMPLES, 1)))
+    return Response(json.dumps(rejected, ensure_ascii=False), content_type="application/json")
+
+
+@app.server.route("/stream")
+def stream_messages():
+    """Server-Sent Events stream of "tick" events when new MQTT messages arrive (push mode only)."""
+    if not PUSH_MODE:
+        abort(404)
+
+    subscriber = broadcaster.subscribe()
+
+    def events():
+        try:
+            yield "retry: 2000\n\n"
+            while not subscriber.closed:
+                frames = subscriber.get(timeout=PUSH_KEEPALIVE_S)
+                yield "".join(frames) if frames else ": keepalive\n\n"
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+LED_STATUS_STYLE = {"marginLeft": "1rem", "color": "#94a3b8", "fontSize": "0.9rem"}
+
+
+def _led_action(payload):
+    """Return "ON"/"OFF" for an LED command payload, or None if it is not one."""
+    try:
+        return "ON" if json.loads(payload).get("status") else "OFF"
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+@callback(
+    [
+        Output("led-status", "children"),
+        Output("led-status", "style"),
+        Output("command-poll", "disabled"),
+    ],
+    [
+        Input("btn-led-on", "n_clicks"),
+        Input("btn-led-off", "n_clicks"),
+        Input("command-poll", "n_intervals"),
+    ],
+)
+def control_led(on_clicks, off_clicks, _):
+    """Queue LED commands on click and show the state the broker acknowledged."""
+    button_id = dash.callback_context.triggered_id
+    if button_id in ("btn-led-on", "btn-led-off") and on_clicks + off_clicks:
+        turn_on = button_id == "btn-led-on"
+        message = json.dumps({"action": "on" if turn_on else "off", "status": turn_on})
+        # Only queued here; the dispatcher thread talks to the broker
+        if not send_command(MQTT_TOPIC_LED, message):
+            return "✗ Antrian penuh", {**LED_STATUS_STYLE, "color": "#ef4444", "fontWeight": "600"}, True
+
+    status = get_command_status(MQTT_TOPIC_LED)
+    requested = _led_action(status["requested"])
+    acknowledged = _led_action(status["acknowledged"])
+
+    if status["state"] in ("queued", "in_flight"):
+        return f"⏳ Mengirim: {requested}", {**LED_STATUS_STYLE, "fontWeight": "600"}, False
+    if status["state"] == "failed":
+        return f"✗ Gagal: {requested}", {**LED_STATUS_STYLE, "color": "#ef4444", "fontWeight": "600"}, True
+    if acknowledged is None:
+        return "--", LED_STATUS_STYLE, True
+
+    latency = f" ({status['latency_s'] * 1000:.0f} ms)" if status["latency_s"] is not None else ""
+    color = "#10b981" if acknowledged == "ON" else "#ef4444"
+    return f"✓ LED: {acknowledged}{latency}", {**LED_STATUS_STYLE, "color": color, "fontWeight": "600"}, True
 
 
 if __name__ == "__main__":
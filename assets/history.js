@@ -0,0 +1,211 @@
+// Message history: a virtualized list over the whole message log. Only the
+// rows in view are in the DOM, and pages are fetched from the JSON API as
+// they scroll into view. Pages are anchored to the newest message at the
+// time the list was (re)loaded so offsets do not shift as messages arrive.
+(function () {
+    var ROW_HEIGHT = 32;
+    var OVERSCAN = 10;
+    var REFRESH_MS = 5000;
+
+    function element(tag, className, text) {
+        var node = document.createElement(tag);
+        if (className) {
+            node.className = className;
+        }
+        if (text !== undefined) {
+            node.textContent = text;
+        }
+        return node;
+    }
+
+    function clockText(timestamp) {
+        // Receive times are epoch nanoseconds; a Date only needs milliseconds
+        return new Date(timestamp / 1e6).toLocaleTimeString([], { hour12: false });
+    }
+
+    function payloadText(payload) {
+        return typeof payload === "string" ? payload : JSON.stringify(payload);
+    }
+
+    function History(container) {
+        this.source = container.getAttribute("data-source");
+        this.pageSize = parseInt(container.getAttribute("data-page-size"), 10) || 100;
+        this.topic = "";
+        this.until = null;
+        this.total = 0;
+        this.pages = {};
+        this.generation = 0;
+
+        this.select = element("select", "history-topic");
+        this.count = element("span", "history-count");
+        this.latest = element("button", "history-latest", "↻ Terbaru");
+        var toolbar = element("div", "history-toolbar");
+        toolbar.appendChild(this.select);
+        toolbar.appendChild(this.count);
+        toolbar.appendChild(this.latest);
+
+        this.viewport = element("div", "history-viewport");
+        this.spacer = element("div", "history-spacer");
+        this.rows = element("div", "history-rows");
+        this.spacer.appendChild(this.rows);
+        this.viewport.appendChild(this.spacer);
+
+        container.appendChild(toolbar);
+        container.appendChild(this.viewport);
+
+        var self = this;
+        this.select.onchange = function () {
+            self.topic = self.select.value;
+            self.reload();
+        };
+        this.latest.onclick = function () {
+            self.reload();
+        };
+        this.viewport.onscroll = function () {
+            self.render();
+        };
+        window.setInterval(function () {
+            if (!document.hidden) {
+                self.checkForNew();
+            }
+        }, REFRESH_MS);
+
+        this.loadTopics();
+        this.reload();
+    }
+
+    History.prototype.url = function (offset, limit, anchored) {
+        var url = this.source + "?offset=" + offset + "&limit=" + limit;
+        if (anchored && this.until !== null) {
+            url += "&until=" + this.until;
+        }
+        if (this.topic) {
+            url += "&topic=" + encodeURIComponent(this.topic);
+        }
+        return url;
+    };
+
+    History.prototype.loadTopics = function () {
+        var self = this;
+        fetch(this.source + "/topics")
+            .then(function (response) {
+                return response.json();
+            })
+            .then(function (topics) {
+                var selected = self.select.value || self.topic;
+                self.select.textContent = "";
+                self.select.appendChild(element("option", null, "Semua topik"));
+                self.select.firstChild.value = "";
+                Object.keys(topics)
+                    .sort()
+                    .forEach(function (topic) {
+                        var option = element("option", null, topic + " (" + topics[topic] + ")");
+                        option.value = topic;
+                        self.select.appendChild(option);
+                    });
+                self.select.value = selected;
+            });
+    };
+
+    History.prototype.reload = function () {
+        this.generation += 1;
+        this.until = null;
+        this.pages = {};
+        this.pending = {};
+        this.viewport.scrollTop = 0;
+        this.latest.textContent = "↻ Terbaru";
+        this.fetchPage(0);
+    };
+
+    History.prototype.fetchPage = function (index) {
+        var self = this;
+        var generation = this.generation;
+        this.pending[index] = true;
+        fetch(this.url(index * this.pageSize, this.pageSize, true))
+            .then(function (response) {
+                return response.json();
+            })
+            .then(function (page) {
+                if (generation !== self.generation) {
+                    return;
+                }
+                delete self.pending[index];
+                self.until = page.until;
+                // Eviction of the oldest messages only ever shrinks the total
+                self.total = page.total;
+                self.pages[index] = page.messages;
+                self.render();
+            })
+            .catch(function () {
+                delete self.pending[index];
+            });
+    };
+
+    History.prototype.checkForNew = function () {
+        var self = this;
+        var generation = this.generation;
+        fetch(this.url(0, 0, false))
+            .then(function (response) {
+                return response.json();
+            })
+            .then(function (page) {
+                if (generation !== self.generation || self.until === null || page.until <= self.until) {
+                    return;
+                }
+                self.loadTopics();
+                if (self.viewport.scrollTop === 0) {
+                    // Follow the live end of the log while the user is at the top
+                    self.reload();
+                } else {
+                    self.latest.textContent = "↻ Terbaru (" + Math.max(0, page.total - self.total) + " baru)";
+                }
+            });
+    };
+
+    History.prototype.render = function () {
+        this.spacer.style.height = this.total * ROW_HEIGHT + "px";
+        this.count.textContent = this.total + " pesan";
+
+        var top = this.viewport.scrollTop;
+        var first = Math.max(0, Math.floor(top / ROW_HEIGHT) - OVERSCAN);
+        var last = Math.min(this.total, Math.ceil((top + this.viewport.clientHeight) / ROW_HEIGHT) + OVERSCAN);
+
+        this.rows.style.transform = "translateY(" + first * ROW_HEIGHT + "px)";
+        this.rows.textContent = "";
+        for (var position = first; position < last; position++) {
+            var index = Math.floor(position / this.pageSize);
+            var page = this.pages[index];
+            if (page === undefined) {
+                if (!this.pending[index]) {
+                    this.fetchPage(index);
+                }
+                this.rows.appendChild(element("div", "history-row history-row-loading", "…"));
+                continue;
+            }
+            var message = page[position % this.pageSize];
+            if (message === undefined) {
+                this.rows.appendChild(element("div", "history-row history-row-loading", "—"));
+                continue;
+            }
+            var row = element("div", "history-row");
+            row.appendChild(element("span", "history-time", clockText(message.timestamp)));
+            row.appendChild(element("span", "history-topic-name", message.topic));
+            var text = payloadText(message.payload);
+            var payload = element("span", "history-payload", text);
+            row.title = text;
+            row.appendChild(payload);
+            this.rows.appendChild(row);
+        }
+    };
+
+    var waitForContainer = window.setInterval(function () {
+        var container = document.getElementById("message-history");
+        if (!container) {
+            return;
+        }
+        window.clearInterval(waitForContainer);
+        if (window.fetch) {
+            new History(container);
+        }
+    }, 100);
+})();
@@ -0,0 +1,46 @@
+// Push mode: listen to the server's event stream and trigger a feed refresh
+// when a "tick" says new messages arrived; the ticks carry no message data. Only active when the hidden #push-signal button
+// carries a data-stream URL (PUSH_MODE=true).
+(function () {
+    var scheduled = false;
+    var lastClick = 0;
+
+    function refresh(button, minInterval) {
+        // Coalesce bursts of events into one callback per minInterval ms
+        if (scheduled) {
+            return;
+        }
+        scheduled = true;
+        var wait = Math.max(0, lastClick + minInterval - Date.now());
+        window.setTimeout(function () {
+            window.requestAnimationFrame(function () {
+                scheduled = false;
+                lastClick = Date.now();
+                button.click();
+            });
+        }, wait);
+    }
+
+    function connect(button) {
+        var minInterval = parseInt(button.getAttribute("data-min-interval"), 10) || 0;
+        var source = new EventSource(button.getAttribute("data-stream"));
+        source.addEventListener("tick", function () {
+            refresh(button, minInterval);
+        });
+        // Resynchronise after (re)connecting in case events were missed
+        source.onopen = function () {
+            refresh(button, minInterval);
+        };
+    }
+
+    var waitForButton = window.setInterval(function () {
+        var button = document.getElementById("push-signal");
+        if (!button) {
+            return;
+        }
+        window.clearInterval(waitForButton);
+        if (button.getAttribute("data-stream") && window.EventSource) {
+            connect(button);
+        }
+    }, 100);
+})();
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import paho.mqtt.client as mqtt
+
+from connection import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncConnection(ConnectionManager):
+    """ConnectionManager whose socket I/O runs on an asyncio event loop.
+
+    Uses paho's external event loop hooks: the socket is registered with
+    ``add_reader``/``add_writer`` and keepalives are driven by ``loop_misc``,
+    so a connection costs no thread of its own. Only the TCP connect, which
+    paho performs with a blocking call, is handed to ``connector``.
+    Reconnect policy, offline buffering and metrics are inherited.
+    """
+
+    def attach(self, loop):
+        """Route the client's socket events to ``loop``. Call from the loop's thread."""
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        self._closed = None
+        self._registered = None
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def _on_loop(self, callback, *args):
+        # paho calls the socket hooks from whichever thread is using the client
+        if threading.get_ident() == self._loop_thread:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._on_loop(self._watch, sock)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._on_loop(self._unwatch, sock, self._closed)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self._watch_write, sock, True)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self._watch_write, sock, False)
+
+    def _forget(self, fd):
+        # Once a socket is closed epoll forgets it on its own, and asyncio's
+        # bookkeeping may fail to catch up. Selectors drop the key either way.
+        for remove in (self._loop.remove_writer, self._loop.remove_reader):
+            try:
+                remove(fd)
+            except OSError:
+                pass
+
+    def _watch(self, sock):
+        # The socket may already be closed if this was deferred from another thread
+        if self.client.socket() is not sock or sock.fileno() == -1:
+            return
+        fd = sock.fileno()
+        # A previous socket may have left a stale registration under the same number
+        self._forget(fd)
+        self._registered = (sock, fd)
+        self._loop.add_reader(fd, self.client.loop_read)
+
+    def _watch_write(self, sock, writable):
+        if self._registered is None or self._registered[0] is not sock:
+            return
+        fd = self._registered[1]
+        if writable:
+            self._loop.add_writer(fd, self.client.loop_write)
+        else:
+            self._loop.remove_writer(fd)
+
+    def _unwatch(self, sock, closed):
+        if self._registered is not None and self._registered[0] is sock:
+            self._forget(self._registered[1])
+            self._registered = None
+        if closed is not None and not closed.done():
+            closed.set_result(None)
+
+    async def run(self, stopping, connector=None):
+        """Keep the connection up until the ``stopping`` future is done."""
+        while not stopping.done():
+            attempt_started = time.monotonic()
+            self._closed = self._loop.create_future()
+            try:
+                await self._loop.run_in_executor(connector, self.client.connect, self.host, self.port, self.keepalive)
+            except (OSError, ValueError) as e:
+                await asyncio.wait([stopping], timeout=self._failed(e))
+                continue
+
+            rc = mqtt.MQTT_ERR_SUCCESS
+            while rc == mqtt.MQTT_ERR_SUCCESS and not self._closed.done():
+                await asyncio.wait([self._closed, stopping], timeout=1.0, return_when=asyncio.FIRST_COMPLETED)
+                if stopping.done():
+                    self.client.disconnect()
+                    # Give the DISCONNECT packet a moment to go out
+                    await asyncio.wait([self._closed], timeout=1.0)
+                    return
+                rc = self.client.loop_misc()
+
+            await asyncio.wait([stopping], timeout=self._session_ended(attempt_started, rc))
+
+
+class AsyncIngestEngine:
+    """Multiplex many broker connections on one asyncio event loop.
+
+    All connections share a single thread running the loop. Received
+    messages go through each client's ``on_message`` exactly as with the
+    threaded clients, so storage, metrics and push are unchanged. Up to
+    ``connect_workers`` connection attempts run at once on a small pool,
+    which sits idle while everything is connected.
+    """
+
+    def __init__(self, connections, connect_workers=4):
+        self.connections = list(connections)
+        self.connect_workers = connect_workers
+        self._loop = None
+        self._stopping = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._thread_main, name="mqtt-asyncio", daemon=True)
+            self._thread.start()
+            self._ready.wait()
+
+    def stop(self, timeout=5.0):
+        """Disconnect every client and stop the event loop."""
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._request_stop)
+        self._thread.join(timeout)
+
+    def _request_stop(self):
+        if not self._stopping.done():
+            self._stopping.set_result(None)
+
+    def _thread_main(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+    async def _main(self):
+        self._stopping = self._loop.create_future()
+        connector = ThreadPoolExecutor(self.connect_workers, thread_name_prefix="mqtt-connect")
+        for connection in self.connections:
+            connection.attach(self._loop)
+        tasks = [asyncio.create_task(connection.run(self._stopping, connector)) for connection in self.connections]
+        self._ready.set()
+        logger.info("✓ Asyncio ingest engine running %d broker connections", len(tasks))
+        try:
+            for result in await asyncio.gather(*tasks, return_exceptions=True):
+                if isinstance(result, Exception):
+                    logger.error("✗ Broker connection task failed: %r", result)
+        finally:
+            connector.shutdown(wait=False)
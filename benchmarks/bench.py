@@ -0,0 +1,395 @@
+"""Offline benchmarks for the ingest, query and render hot paths.
+
+Drives mqtt_client.on_message with synthetic paho MQTTMessage objects and
+times the read APIs and the feed callback as MAX_DATA_POINTS grows. No
+broker is needed. Results are written as JSON so runs from different
+versions can be compared:
+
+    python benchmarks/bench.py --output before.json
+    python benchmarks/bench.py --output after.json --compare before.json
+"""
+import argparse
+import gc
+import gzip
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Reader mode never opens a broker connection when app.py is imported; a
+# private shared-memory name keeps it from following a real ingest process
+os.environ["INGEST_MODE"] = "reader"
+os.environ["SHM_NAME"] = f"iot-dashboard-bench-{os.getpid()}"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["TSDB_DIR"] = ""
+os.environ["MQTT_DEVICE_TOPICS"] = "bench/+/dht"
+
+import brotli  # noqa: E402
+import numpy as np  # noqa: E402
+import plotly  # noqa: E402
+from dash import no_update  # noqa: E402
+from paho.mqtt.client import MQTTMessage  # noqa: E402
+
+import app  # noqa: E402
+import mqtt_client  # noqa: E402
+from device_store import DeviceStore  # noqa: E402
+from message_log import MessageLog  # noqa: E402
+from ring_buffer import NS_PER_S  # noqa: E402
+
+PAYLOAD_SHAPES = ("dht", "wide", "text", "mixed")
+
+
+def make_payload(shape, index):
+    """Return a synthetic payload of the given shape as bytes."""
+    if shape == "mixed":
+        shape = PAYLOAD_SHAPES[index % 3]
+    if shape == "dht":
+        return json.dumps({"temperature": 20 + index % 15, "humidity": 40 + index % 50}).encode()
+    if shape == "wide":
+        payload = {"temperature": 20 + index % 15, "humidity": 40 + index % 50}
+        payload.update({f"field_{n}": n * index for n in range(32)})
+        return json.dumps(payload).encode()
+    return f"status {index} ok".encode()
+
+
+def make_messages(count, shape, devices):
+    messages = []
+    for index in range(count):
+        message = MQTTMessage(topic=f"bench/node-{index % devices}/dht".encode())
+        message.payload = make_payload(shape, index)
+        message.qos = 1
+        messages.append(message)
+    return messages
+
+
+def reset_stores(max_points):
+    """Swap in empty stores sized for ``max_points``."""
+    # The whole-buffer statistics window follows MAX_DATA_POINTS
+    mqtt_client.STATS_ROLLING_WINDOWS = tuple(
+        window for window in mqtt_client.STATS_ROLLING_WINDOWS if window != max_points
+    )
+    mqtt_client.MAX_DATA_POINTS = max_points
+    mqtt_client.STATS_WINDOWS = tuple(sorted(mqtt_client.STATS_ROLLING_WINDOWS + (max_points,)))
+    mqtt_client.device_store = DeviceStore(
+        max_points,
+        fields=mqtt_client.device_store.fields,
+        rollup_levels=mqtt_client.ROLLUP_LEVELS,
+        stats_windows=mqtt_client.STATS_ROLLING_WINDOWS,
+        ema_spans=mqtt_client.STATS_EMA_SPANS,
+    )
+    with mqtt_client.data_lock:
+        mqtt_client.message_log = MessageLog(max_points)
+        mqtt_client.message_seq = 0
+    gc.collect()
+
+
+def percentile(samples, q):
+    return float(np.percentile(samples, q)) if len(samples) else 0.0
+
+
+def bench_ingest(count, shape, rate, devices, max_points):
+    """Measure throughput, callback latency and memory growth for ``count`` messages."""
+    reset_stores(max_points)
+    messages = make_messages(count, shape, devices)
+    interval = 1.0 / rate if rate else 0.0
+    latencies = np.empty(count, dtype=np.int64)
+
+    start = time.perf_counter()
+    next_send = start
+    for index, message in enumerate(messages):
+        if interval:
+            next_send += interval
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        t0 = time.perf_counter_ns()
+        mqtt_client.on_message(None, None, message)
+        latencies[index] = time.perf_counter_ns() - t0
+    callbacks_done = time.perf_counter()
+    mqtt_client.ingest_worker.wait_idle()
+    elapsed = time.perf_counter() - start
+
+    # Memory is measured in a separate, traced pass so it does not skew timings
+    reset_stores(max_points)
+    tracemalloc.start()
+    for message in messages:
+        mqtt_client.on_message(None, None, message)
+    mqtt_client.ingest_worker.wait_idle()
+    growth, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "messages": count,
+        "payload": shape,
+        "target_rate": rate,
+        "devices": devices,
+        "max_data_points": max_points,
+        "msgs_per_s": count / elapsed,
+        "callback_msgs_per_s": count / (callbacks_done - start),
+        "callback_p50_us": percentile(latencies, 50) / 1000,
+        "callback_p99_us": percentile(latencies, 99) / 1000,
+        "memory_growth_bytes": growth,
+        "memory_peak_bytes": peak,
+        "sensor_buffer_bytes": mqtt_client.get_buffer_footprint(),
+        "message_log_len": len(mqtt_client.message_log),
+    }
+
+
+def fill(max_points, devices=1):
+    """Fill the stores to capacity without going through the ingest path."""
+    reset_stores(max_points)
+    now = int(time.time())
+    seconds = np.arange(now - max_points, now, dtype=np.int64)
+    for device in range(devices):
+        device_id = mqtt_client.DEFAULT_DEVICE_ID if device == 0 else f"node-{device}"
+        shard = mqtt_client.device_store.shard(device_id)
+        shard.buffer.extend(seconds * NS_PER_S, temperature=20 + seconds % 15, humidity=40 + seconds % 50)
+    mqtt_client.message_log.extend(
+        {
+            "seq": seq,
+            "timestamp": now * NS_PER_S,
+            "topic": "bench/node-0/dht" if seq % 2 else "bench/led",
+            "device": "node-0",
+            "payload": {"temperature": 25, "humidity": 60},
+        }
+        for seq in range(1, max_points + 1)
+    )
+    mqtt_client.message_seq = max_points
+
+
+def timed(function, repeat):
+    """Return (best, median) wall time in microseconds over ``repeat`` calls."""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter_ns()
+        result = function()
+        samples.append(time.perf_counter_ns() - t0)
+    return min(samples) / 1000, float(np.median(samples)) / 1000, result
+
+
+def response_bytes(output):
+    if output is no_update:
+        return 0
+    return len(json.dumps(output, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def bench_queries(max_points, repeat):
+    fill(max_points)
+    results = {"max_data_points": max_points}
+
+    for name, function in (
+        ("get_sensor_data", mqtt_client.get_sensor_data),
+        ("get_latest_reading", mqtt_client.get_latest_reading),
+        ("get_recent_messages", mqtt_client.get_recent_messages),
+        ("get_recent_messages_50", lambda: mqtt_client.get_recent_messages(50)),
+        ("get_message_page_deep", lambda: mqtt_client.get_message_page(max_points // 2, 100)),
+        ("get_message_page_topic", lambda: mqtt_client.get_message_page(max_points // 4, 100, topic="bench/led")),
+        ("get_series", lambda: mqtt_client.get_series(mqtt_client.DEFAULT_DEVICE_ID, width=1000)),
+        ("get_stats", mqtt_client.get_stats),
+    ):
+        best, median, _ = timed(function, repeat)
+        results[f"{name}_best_us"] = best
+        results[f"{name}_median_us"] = median
+
+    best, median, output = timed(lambda: app.update_message_feed(0, 0, None), repeat)
+    feed, cursor = output
+    results.update(
+        update_message_feed_full_best_us=best,
+        update_message_feed_full_median_us=median,
+        update_message_feed_full_bytes=response_bytes(feed),
+    )
+
+    best, median, output = timed(lambda: app.update_message_feed(1, 0, cursor), repeat)
+    results.update(
+        update_message_feed_idle_best_us=best,
+        update_message_feed_idle_median_us=median,
+        update_message_feed_idle_bytes=response_bytes(output[0]),
+    )
+
+    state = {"cursor": cursor}
+
+    def one_new_message():
+        mqtt_client.ingest_message("bench/node-0/dht", make_payload("dht", 0))
+        output = app.update_message_feed(2, 0, state["cursor"])
+        state["cursor"] = output[1]
+        return output
+
+    best, median, output = timed(one_new_message, repeat)
+    results.update(
+        update_message_feed_delta_best_us=best,
+        update_message_feed_delta_median_us=median,
+        update_message_feed_delta_bytes=response_bytes(output[0]),
+    )
+    return results
+
+
+def feed_request(cursor):
+    """Body of the Dash request a tab sends to poll the message feed."""
+    return {
+        "output": app.FEED_OUTPUT,
+        "outputs": [{"id": "message-feed", "property": "children"}, {"id": "feed-cursor", "property": "data"}],
+        "inputs": [
+            {"id": "interval-component", "property": "n_intervals", "value": 1},
+            {"id": "push-signal", "property": "n_clicks", "value": 0},
+        ],
+        "state": [{"id": "feed-cursor", "property": "data", "value": cursor}],
+        "changedPropIds": ["interval-component.n_intervals"],
+    }
+
+
+def bench_feed_bytes(max_points):
+    """Bytes on the wire for a full feed render and a one-message delta, per rendering mode and encoding."""
+    fill(max_points)
+    client = app.app.server.test_client()
+    results = {"max_data_points": max_points}
+    compact = app.FEED_COMPACT
+    try:
+        for mode, app.FEED_COMPACT in (("inline", False), ("compact", True)):
+            for encoding in ("identity", "gzip", "br"):
+                # A new message changes the log version, so nothing is served from the caches
+                mqtt_client.ingest_message("bench/node-0/dht", make_payload("dht", 0))
+                headers = {"Accept-Encoding": encoding}
+                full = client.post("/_dash-update-component", json=feed_request(None), headers=headers)
+                cursor = json.loads(full.get_data() if encoding == "identity" else decompress(full))
+                mqtt_client.ingest_message("bench/node-0/dht", make_payload("dht", 0))
+                delta = client.post(
+                    "/_dash-update-component",
+                    json=feed_request(cursor["response"]["feed-cursor"]["data"]),
+                    headers=headers,
+                )
+                results[f"feed_full_{mode}_{encoding}_bytes"] = len(full.get_data())
+                results[f"feed_delta_{mode}_{encoding}_bytes"] = len(delta.get_data())
+    finally:
+        app.FEED_COMPACT = compact
+    return results
+
+
+def decompress(response):
+    encoding = response.headers.get("Content-Encoding")
+    if encoding == "gzip":
+        return gzip.decompress(response.get_data())
+    if encoding == "br":
+        return brotli.decompress(response.get_data())
+    return response.get_data()
+
+
+def bench_viewers(max_points, viewers, rounds):
+    """Time one feed poll per open tab after each new message, through the HTTP layer.
+
+    With the shared feed cache only the first tab renders; the rest reuse
+    its serialized response, so the round cost should grow slowly with
+    ``viewers``.
+    """
+    fill(max_points)
+    client = app.app.server.test_client()
+    client.get("/")
+    cursors = [None] * viewers
+
+    def poll(index):
+        response = client.post("/_dash-update-component", json=feed_request(cursors[index]))
+        if response.status_code == 200:
+            cursors[index] = response.get_json()["response"]["feed-cursor"]["data"]
+
+    for index in range(viewers):
+        poll(index)
+
+    def one_round():
+        mqtt_client.ingest_message("bench/node-0/dht", make_payload("dht", 0))
+        for index in range(viewers):
+            poll(index)
+
+    best, median, _ = timed(one_round, rounds)
+    return {
+        "max_data_points": max_points,
+        "viewers": viewers,
+        "feed_round_best_us": best,
+        "feed_round_median_us": median,
+        "feed_round_per_viewer_us": median / viewers,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path, tolerance):
+    """Print metrics that regressed by more than ``tolerance`` versus a previous run."""
+    with open(baseline_path) as handle:
+        baseline = json.load(handle)
+
+    regressions = []
+    for section in ("ingest", "queries", "viewers"):
+        for old, new in zip(baseline.get(section, []), current.get(section, [])):
+            for key, new_value in new.items():
+                old_value = old.get(key)
+                if not isinstance(new_value, (int, float)) or not isinstance(old_value, (int, float)) or not old_value:
+                    continue
+                change = (new_value - old_value) / old_value
+                # Throughput should go up; times, sizes and memory should go down
+                worse = -change if key.endswith("per_s") else change
+                if key.endswith(("_us", "_bytes", "per_s")) and worse > tolerance:
+                    regressions.append(f"{section}[{new.get('max_data_points')}].{key}: {old_value:.4g} -> {new_value:.4g}")
+
+    for line in regressions:
+        print(f"✗ regression {line}", file=sys.stderr)
+    return not regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=50_000, help="messages per ingest run")
+    parser.add_argument("--rates", default="0", help="comma-separated target msgs/s (0 = as fast as possible)")
+    parser.add_argument("--payloads", default="dht,mixed", help=f"comma-separated shapes from {PAYLOAD_SHAPES}")
+    parser.add_argument("--devices", type=int, default=10, help="distinct device topics in the ingest run")
+    parser.add_argument("--ingest-max-points", type=int, default=100_000, help="MAX_DATA_POINTS for ingest runs")
+    parser.add_argument("--sizes", default="100,1000,10000,100000,1000000", help="MAX_DATA_POINTS values for query runs")
+    parser.add_argument("--repeat", type=int, default=20, help="calls per timed query")
+    parser.add_argument("--viewers", default="1,10,50", help="comma-separated numbers of tabs polling the feed")
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    parser.add_argument("--compare", help="previous results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown for --compare")
+    args = parser.parse_args()
+
+    sizes = [int(float(size)) for size in args.sizes.split(",")]
+    results = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "ingest": [],
+        "queries": [],
+        "viewers": [],
+        "feed_bytes": bench_feed_bytes(min(sizes)),
+    }
+
+    for shape in args.payloads.split(","):
+        for rate in (float(rate) for rate in args.rates.split(",")):
+            results["ingest"].append(bench_ingest(args.messages, shape, rate, args.devices, args.ingest_max_points))
+    for size in sizes:
+        results["queries"].append(bench_queries(size, args.repeat))
+    for viewers in (int(count) for count in args.viewers.split(",")):
+        results["viewers"].append(bench_viewers(min(sizes), viewers, args.repeat))
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import queue
+import threading
+from collections import deque
+
+CLIENT_BUFFER_SIZE = 256
+MAX_CLIENT_DROPS = 1024
+
+
+class Subscriber:
+    """Bounded per-client buffer of pre-encoded events.
+
+    When the client falls behind, the oldest events are dropped. A client
+    that has dropped more than ``max_drops`` events is closed so it can
+    reconnect and resynchronise instead of receiving a gappy stream.
+    """
+
+    def __init__(self, maxsize=CLIENT_BUFFER_SIZE, max_drops=MAX_CLIENT_DROPS):
+        self._events = deque(maxlen=maxsize)
+        self._ready = threading.Condition()
+        self.max_drops = max_drops
+        self.dropped = 0
+        self.closed = False
+
+    def offer(self, frames):
+        """Queue frames without blocking, dropping the oldest on overflow."""
+        with self._ready:
+            if self.closed:
+                return
+            overflow = len(self._events) + len(frames) - self._events.maxlen
+            if overflow > 0:
+                self.dropped += overflow
+                if self.dropped > self.max_drops:
+                    self.closed = True
+            self._events.extend(frames)
+            self._ready.notify()
+
+    def get(self, timeout=None):
+        """Wait for events and return all buffered ones (empty list on timeout)."""
+        with self._ready:
+            if not self._events and not self.closed:
+                self._ready.wait(timeout)
+            frames = list(self._events)
+            self._events.clear()
+            return frames
+
+    def close(self):
+        with self._ready:
+            self.closed = True
+            self._ready.notify()
+
+
+class Broadcaster:
+    """Tell all connected push clients that new messages were ingested.
+
+    The ingest path only puts the newest message of each batch on one
+    unbounded inbox queue. A dispatcher thread drains it and hands a single
+    small "tick" event, carrying the newest sequence number, to every
+    subscriber's bounded buffer. Clients fetch the messages themselves
+    through the feed callback, so message bodies are never serialized here.
+    """
+
+    def __init__(self, client_buffer=CLIENT_BUFFER_SIZE, max_client_drops=MAX_CLIENT_DROPS):
+        self.client_buffer = client_buffer
+        self.max_client_drops = max_client_drops
+        self._inbox = queue.SimpleQueue()
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish(self, message):
+        """Announce that the log holds messages up to ``message``. Cheap no-op when nobody is listening."""
+        if self._subscribers:
+            self._inbox.put(message)
+
+    def subscribe(self):
+        """Register a new client and return its Subscriber."""
+        subscriber = Subscriber(self.client_buffer, self.max_client_drops)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="broadcaster", daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.close()
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    @staticmethod
+    def encode(message):
+        """Encode the tick for the log reaching ``message`` as one SSE frame."""
+        seq = message.get("seq", "")
+        return f"event: tick\nid: {seq}\ndata: {seq}\n\n"
+
+    def _run(self):
+        while True:
+            batch = [self._inbox.get()]
+            try:
+                while len(batch) < self.client_buffer:
+                    batch.append(self._inbox.get_nowait())
+            except queue.Empty:
+                pass
+
+            # One tick covers everything drained; clients only need to know the log moved
+            frames = [self.encode(batch[-1])]
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for subscriber in subscribers:
+                subscriber.offer(frames)
+                if subscriber.closed:
+                    self.unsubscribe(subscriber)
@@ -0,0 +1,46 @@
+import threading
+from collections import OrderedDict
+
+from metrics import Counter
+
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by cache and result", ("cache", "result"))
+
+
+class LRUCache:
+    """Thread-safe mapping bounded to ``maxsize`` entries, evicting the least recently used."""
+
+    def __init__(self, maxsize, name="cache"):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = CACHE_LOOKUPS.labels(name, "hit")
+        self._misses = CACHE_LOOKUPS.labels(name, "miss")
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                self._misses.inc()
+                return default
+            self._hits.inc()
+            return self._data[key]
+
+    def put(self, key, value):
+        self.update(((key, value),))
+
+    def update(self, items):
+        """Insert several ``(key, value)`` pairs under one lock acquisition."""
+        with self._lock:
+            for key, value in items:
+                self._data[key] = value
+                self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
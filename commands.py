@@ -0,0 +1,268 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+COMMANDS = Counter("mqtt_commands_total", "Outbound commands by outcome", ("outcome",))
+COMMAND_ACK_SECONDS = Histogram(
+    "mqtt_command_ack_seconds", "Time from sending a command until it was acknowledged"
+)
+
+# Message IDs acknowledged before the dispatcher recorded them (PUBACK racing publish())
+EARLY_ACK_LIMIT = 256
+
+# Returned by the publish function when a command is held until the broker connection is back
+BUFFERED = "buffered"
+
+
+class _Command:
+    __slots__ = ("payload", "qos", "submitted_at", "sent_at", "mid", "buffered")
+
+    def __init__(self, payload, qos):
+        self.payload = payload
+        self.qos = qos
+        self.submitted_at = time.time()
+        self.sent_at = None
+        self.mid = None
+        self.buffered = False
+
+
+class _TopicState:
+    __slots__ = ("pending", "in_flight", "requested", "acknowledged", "acked_at", "latency_s", "error", "outcome")
+
+    def __init__(self):
+        self.pending = None
+        self.in_flight = None
+        self.requested = None
+        self.acknowledged = None
+        self.acked_at = None
+        self.latency_s = None
+        self.error = None
+        self.outcome = None
+
+
+class CommandDispatcher:
+    """Send commands from a background thread, keeping only the newest per topic.
+
+    ``submit`` never touches the network: it replaces any command for the
+    same topic that has not been sent yet and returns at once. Each topic has
+    at most one command in flight. The next one goes out once the broker
+    acknowledges it (``acknowledge(mid)`` from paho's ``on_publish``) or after
+    ``ack_timeout_s``. ``publish(topic, payload, qos)`` returns the message ID
+    to wait for. When ``confirm_by_echo`` is set, the dispatcher instead waits
+    for the command to come back on its own subscription (``observe``), which
+    is how reader processes without a broker connection confirm delivery.
+
+    ``publish`` returns ``BUFFERED`` for a command held while the broker is
+    unreachable. It then shows as "queued", with no deadline, until
+    ``delivered(topic)`` reports that it went out.
+    """
+
+    def __init__(self, publish, max_pending=64, ack_timeout_s=10.0, confirm_by_echo=False):
+        self.publish = publish
+        self.max_pending = max_pending
+        self.ack_timeout_s = ack_timeout_s
+        self.confirm_by_echo = confirm_by_echo
+        self._topics = {}
+        self._ready = OrderedDict()
+        self._by_mid = {}
+        self._early_acks = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="command-dispatcher", daemon=True)
+                self._thread.start()
+
+    @property
+    def pending(self):
+        """Number of topics with a command waiting to be sent."""
+        return len(self._ready)
+
+    def submit(self, topic, payload, qos=0):
+        """Queue ``payload`` for ``topic``, superseding any unsent command. Returns False if the queue is full."""
+        with self._cond:
+            state = self._topics.get(topic)
+            if state is None:
+                state = self._topics[topic] = _TopicState()
+            if state.pending is not None:
+                COMMANDS.labels("superseded").inc()
+            elif state.in_flight is None and len(self._ready) >= self.max_pending:
+                COMMANDS.labels("rejected").inc()
+                return False
+
+            state.pending = _Command(payload, qos)
+            state.requested = payload
+            state.error = None
+            if state.in_flight is None:
+                self._ready[topic] = True
+            COMMANDS.labels("submitted").inc()
+            self._cond.notify()
+
+        if self._thread is None:
+            self.start()
+        return True
+
+    def acknowledge(self, mid):
+        """Mark the command sent with message ID ``mid`` as delivered. Safe to call from any thread."""
+        with self._cond:
+            topic = self._by_mid.pop(mid, None)
+            if topic is None:
+                self._early_acks[mid] = time.time()
+                while len(self._early_acks) > EARLY_ACK_LIMIT:
+                    self._early_acks.popitem(last=False)
+                return
+            self._settle(topic, time.time())
+
+    def delivered(self, topic, sent=True):
+        """Settle the buffered command of ``topic`` once it was sent, or fail it if the buffer dropped it.
+
+        Safe to call from any thread.
+        """
+        with self._cond:
+            state = self._topics.get(topic)
+            if state is None or state.in_flight is None or not state.in_flight.buffered:
+                return
+            if sent:
+                self._settle(topic, time.time())
+            else:
+                self._fail(topic, "dropped while offline")
+                self._cond.notify()
+
+    def watches(self, topic):
+        """Return whether ``observe`` would act on messages seen on ``topic``."""
+        return self.confirm_by_echo and topic in self._topics
+
+    def observe(self, topic, payload):
+        """Record a message seen on ``topic``; in echo mode it confirms the topic's state."""
+        if not self.confirm_by_echo or topic not in self._topics:
+            return
+        if isinstance(payload, (bytes, bytearray, memoryview)):
+            payload = bytes(payload).decode(errors="replace")
+        with self._cond:
+            state = self._topics[topic]
+            if state.in_flight is not None:
+                self._settle(topic, time.time(), payload)
+            else:
+                # Another process sent it; still the state the broker now holds
+                state.acknowledged = payload
+                state.acked_at = time.time()
+
+    def status(self, topic):
+        """Return a snapshot of the command state for ``topic`` without blocking on I/O.
+
+        ``state`` is "idle", "queued", "in_flight", "acked" or "failed".
+        ``acknowledged`` is the last payload the broker confirmed.
+        """
+        with self._cond:
+            state = self._topics.get(topic)
+            if state is None:
+                return {"topic": topic, "state": "idle", "requested": None, "acknowledged": None,
+                        "acked_at": None, "latency_s": None, "error": None}
+            if state.pending is not None or (state.in_flight is not None and state.in_flight.buffered):
+                current = "queued"
+            elif state.in_flight is not None:
+                current = "in_flight"
+            else:
+                current = state.outcome or "idle"
+            return {
+                "topic": topic,
+                "state": current,
+                "requested": state.requested,
+                "acknowledged": state.acknowledged,
+                "acked_at": state.acked_at,
+                "latency_s": state.latency_s,
+                "error": state.error,
+            }
+
+    def _settle(self, topic, now, payload=None):
+        """Record the in-flight command of ``topic`` as acknowledged. Caller holds the lock."""
+        state = self._topics[topic]
+        command = state.in_flight
+        if command is None:
+            return
+        state.in_flight = None
+        state.acknowledged = command.payload if payload is None else payload
+        state.acked_at = now
+        state.latency_s = now - command.sent_at
+        state.outcome = "acked"
+        COMMANDS.labels("acked").inc()
+        COMMAND_ACK_SECONDS.observe(state.latency_s)
+        if state.pending is not None:
+            self._ready[topic] = True
+        self._cond.notify()
+
+    def _fail(self, topic, error):
+        """Give up on the in-flight command of ``topic``. Caller holds the lock."""
+        state = self._topics[topic]
+        state.in_flight = None
+        state.outcome = "failed"
+        state.error = error
+        COMMANDS.labels("failed").inc()
+        if state.pending is not None:
+            self._ready[topic] = True
+
+    def _expire(self, now):
+        """Fail in-flight commands past their deadline and return the next deadline (or None)."""
+        next_deadline = None
+        for mid, topic in list(self._by_mid.items()):
+            command = self._topics[topic].in_flight
+            deadline = command.sent_at + self.ack_timeout_s
+            if deadline <= now:
+                del self._by_mid[mid]
+                self._fail(topic, "not acknowledged")
+                logger.warning("✗ Command to %s was not acknowledged within %.1fs", topic, self.ack_timeout_s)
+            elif next_deadline is None or deadline < next_deadline:
+                next_deadline = deadline
+        for topic, state in self._topics.items():
+            command = state.in_flight
+            if command is not None and command.mid is None and command.sent_at is not None and not command.buffered:
+                deadline = command.sent_at + self.ack_timeout_s
+                if deadline <= now:
+                    self._fail(topic, "not confirmed")
+                elif next_deadline is None or deadline < next_deadline:
+                    next_deadline = deadline
+        return next_deadline
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.time()
+                    next_deadline = self._expire(now)
+                    if self._ready:
+                        break
+                    self._cond.wait(None if next_deadline is None else next_deadline - now)
+                topic, _ = self._ready.popitem(last=False)
+                state = self._topics[topic]
+                command, state.pending = state.pending, None
+                command.sent_at = now
+                state.in_flight = command
+
+            try:
+                mid = self.publish(topic, command.payload, command.qos)
+            except Exception as e:
+                with self._cond:
+                    self._fail(topic, str(e))
+                logger.error("✗ Failed to send command to %s: %s", topic, e)
+                continue
+
+            with self._cond:
+                if mid is BUFFERED and state.in_flight is command:
+                    command.buffered = True
+                    continue
+                if mid is None or state.in_flight is not command:
+                    # Echo mode waits for observe(); a command that already timed out is dropped
+                    continue
+                command.mid = mid
+                acked_at = self._early_acks.pop(mid, None)
+                if acked_at is not None:
+                    self._settle(topic, acked_at)
+                else:
+                    self._by_mid[mid] = topic
@@ -0,0 +1,167 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+import paho.mqtt.client as mqtt
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+CONNECT_ATTEMPTS = Counter("mqtt_connect_attempts_total", "Broker connection attempts by result", ("result",))
+RECONNECT_SECONDS = Histogram(
+    "mqtt_reconnect_seconds",
+    "Time from losing the broker connection until the next CONNACK",
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 900),
+)
+OFFLINE_PUBLISHES = Counter(
+    "mqtt_offline_publishes_total", "QoS 0 publishes made while disconnected", ("result",)
+)
+
+
+class ConnectionManager:
+    """Keep a paho client connected, reconnecting with jittered exponential backoff.
+
+    Runs the client's network loop on its own thread instead of
+    ``loop_start()``, so a broker that is down at start-up is retried like
+    any later outage. The delay before attempt ``n`` is drawn uniformly from
+    ``[min_backoff_s, min(max_backoff_s, min_backoff_s * 2**n)]`` so that
+    many dashboards do not reconnect in lockstep.
+
+    Publishes made while offline are kept up to ``offline_buffer`` messages.
+    paho itself holds QoS > 0 messages (bounded with
+    ``max_queued_messages_set``) and resends them after the CONNACK; QoS 0
+    messages, which paho would drop, are kept here and flushed from
+    ``handle_connect``. When the buffer is full the oldest message is dropped.
+    ``on_flushed(topic, sent)``, if set, is called for each buffered message
+    once it has been handed to paho, or dropped from a full buffer.
+    """
+
+    def __init__(self, client, host, port, keepalive=60, min_backoff_s=0.5, max_backoff_s=30.0, offline_buffer=1000):
+        self.client = client
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.min_backoff_s = min_backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.name = f"{host}:{port}"
+        self.connected = False
+        self.connected_at = None
+        self.attempts = 0
+        self.disconnected_at = time.monotonic()
+        self._offline = deque(maxlen=offline_buffer)
+        self._offline_lock = threading.Lock()
+        self.on_flushed = None
+        self._stop = threading.Event()
+        self._thread = None
+        client.max_queued_messages_set(offline_buffer)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="mqtt-connection", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Disconnect cleanly and stop the network thread."""
+        self._stop.set()
+        self.client.disconnect()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def offline_pending(self):
+        """Number of QoS 0 publishes waiting for the connection."""
+        return len(self._offline)
+
+    def backoff(self, attempt):
+        """Return the jittered delay in seconds before reconnect attempt ``attempt``."""
+        ceiling = min(self.max_backoff_s, self.min_backoff_s * 2 ** min(attempt, 32))
+        return random.uniform(self.min_backoff_s, ceiling)
+
+    def publish(self, topic, payload, qos=0):
+        """Publish, or buffer a QoS 0 message while offline. Returns paho's MQTTMessageInfo, or None if buffered."""
+        if qos == 0 and not self.connected:
+            dropped = None
+            with self._offline_lock:
+                # handle_connect drains the buffer under this lock, so a reconnect cannot strand the message
+                buffered = not self.connected
+                if buffered:
+                    if len(self._offline) == self._offline.maxlen:
+                        OFFLINE_PUBLISHES.labels("dropped").inc()
+                        dropped = self._offline[0][0]
+                    self._offline.append((topic, payload))
+            if buffered:
+                OFFLINE_PUBLISHES.labels("buffered").inc()
+                if dropped is not None and self.on_flushed is not None:
+                    self.on_flushed(dropped, False)
+                return None
+        return self.client.publish(topic, payload, qos=qos)
+
+    def handle_connect(self, rc):
+        """Call from ``on_connect``: records the reconnect and flushes buffered publishes."""
+        if rc != 0:
+            return
+        RECONNECT_SECONDS.observe(time.monotonic() - self.disconnected_at)
+        CONNECT_ATTEMPTS.labels("success").inc()
+        self.attempts = 0
+        self.connected_at = time.monotonic()
+
+        with self._offline_lock:
+            self.connected = True
+            buffered = list(self._offline)
+            self._offline.clear()
+        for topic, payload in buffered:
+            self.client.publish(topic, payload, qos=0)
+            if self.on_flushed is not None:
+                self.on_flushed(topic, True)
+        if buffered:
+            OFFLINE_PUBLISHES.labels("flushed").inc(len(buffered))
+            logger.info("✓ Flushed %d publishes buffered while offline to %s", len(buffered), self.name)
+
+    def handle_disconnect(self, rc):
+        """Call from ``on_disconnect``."""
+        with self._offline_lock:
+            if self.connected:
+                self.connected = False
+                self.disconnected_at = time.monotonic()
+
+    def _run(self):
+        while not self._stop.is_set():
+            attempt_started = time.monotonic()
+            try:
+                self.client.connect(self.host, self.port, keepalive=self.keepalive)
+            except (OSError, ValueError) as e:
+                self._stop.wait(self._failed(e))
+                continue
+
+            rc = mqtt.MQTT_ERR_SUCCESS
+            while rc == mqtt.MQTT_ERR_SUCCESS and not self._stop.is_set():
+                rc = self.client.loop(timeout=1.0)
+
+            if not self._stop.is_set():
+                self._stop.wait(self._session_ended(attempt_started, rc))
+
+    def _session_ended(self, attempt_started, rc):
+        """Return how long to wait before reconnecting once the network loop has stopped."""
+        # on_disconnect may already have run; the CONNACK time tells whether this session was up
+        if self.connected_at is not None and self.connected_at >= attempt_started:
+            uptime = time.monotonic() - self.connected_at
+            self.handle_disconnect(rc)
+            # Reconnect at once after a real outage, but do not spin if the broker keeps kicking us
+            if uptime >= self.max_backoff_s:
+                return 0
+            return self._failed(f"connection dropped after {uptime:.1f}s")
+        # The socket opened but the broker refused or dropped us before CONNACK
+        return self._failed(mqtt.error_string(rc))
+
+    def _failed(self, error):
+        """Count a failed attempt and return the backoff delay before the next one."""
+        CONNECT_ATTEMPTS.labels("failure").inc()
+        self.attempts += 1
+        delay = self.backoff(self.attempts)
+        logger.warning(
+            "✗ MQTT connection to %s failed (attempt %d: %s); retrying in %.1fs", self.name, self.attempts, error, delay
+        )
+        return delay
@@ -0,0 +1,157 @@
+import threading
+import time
+
+import numpy as np
+
+from ring_buffer import DEFAULT_FIELDS, NS_PER_S, RingBuffer
+from rolling_stats import DeviceStats
+from rollups import DEFAULT_LEVELS, DeviceRollups
+
+# Fewest readings per device for which DeviceStore applies a batch with numpy
+BULK_MIN_ROWS = 32
+
+
+def extract_device_id(pattern, topic, default=None):
+    """Match ``topic`` against an MQTT subscription ``pattern`` and return the device ID.
+
+    The device ID is the level matched by the first ``+`` wildcard, or the
+    remaining levels matched by ``#``. Patterns without wildcards yield
+    ``default`` on an exact match. Returns None when the topic does not match.
+    """
+    pattern_levels = pattern.split("/")
+    topic_levels = topic.split("/")
+    device_id = None
+
+    for index, level in enumerate(pattern_levels):
+        if level == "#":
+            rest = "/".join(topic_levels[index:])
+            if device_id is None and rest:
+                device_id = rest
+            return device_id if device_id is not None else default
+        if index >= len(topic_levels):
+            return None
+        if level == "+":
+            if device_id is None:
+                device_id = topic_levels[index]
+        elif level != topic_levels[index]:
+            return None
+
+    if len(topic_levels) != len(pattern_levels):
+        return None
+    return device_id if device_id is not None else default
+
+
+class DeviceShard:
+    """Readings buffer, rollups, rolling statistics and lock for a single device."""
+
+    __slots__ = ("device_id", "buffer", "rollups", "stats", "lock", "last_seen")
+
+    def __init__(
+        self, device_id, capacity, fields=DEFAULT_FIELDS, rollup_levels=DEFAULT_LEVELS, stats_windows=None, ema_spans=()
+    ):
+        self.device_id = device_id
+        self.buffer = RingBuffer(capacity, fields=fields)
+        self.rollups = DeviceRollups(rollup_levels, fields=fields, time_unit=NS_PER_S)
+        self.stats = DeviceStats(stats_windows, ema_spans, fields=fields) if stats_windows is not None else None
+        self.lock = threading.Lock()
+        self.last_seen = None
+
+
+class DeviceStore:
+    """Per-device sharded reading storage.
+
+    Timestamps are int64 epoch nanoseconds. Each device owns its buffer and
+    lock, so writes for one device never contend with readers of another. The registry lock is only taken the
+    first time a device is seen.
+    """
+
+    def __init__(self, capacity, fields=DEFAULT_FIELDS, rollup_levels=DEFAULT_LEVELS, stats_windows=None, ema_spans=()):
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self.rollup_levels = tuple(rollup_levels)
+        # None keeps no statistics; an empty tuple still tracks EMAs and the latest value
+        self.stats_windows = None if stats_windows is None else tuple(stats_windows)
+        self.ema_spans = tuple(ema_spans)
+        self._shards = {}
+        self._registry_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._shards)
+
+    def get(self, device_id):
+        """Return the shard for ``device_id`` or None if it has not been seen."""
+        return self._shards.get(device_id)
+
+    def shard(self, device_id):
+        """Return the shard for ``device_id``, creating it on first use."""
+        shard = self._shards.get(device_id)
+        if shard is None:
+            with self._registry_lock:
+                shard = self._shards.get(device_id)
+                if shard is None:
+                    shard = DeviceShard(
+                        device_id, self.capacity, self.fields, self.rollup_levels, self.stats_windows, self.ema_spans
+                    )
+                    self._shards[device_id] = shard
+        return shard
+
+    def append(self, device_id, timestamp, **values):
+        """Append a reading to a device's buffer, rollups and statistics under that device's lock."""
+        shard = self.shard(device_id)
+        with shard.lock:
+            shard.buffer.append(timestamp, **values)
+            shard.rollups.add(timestamp, **values)
+            if shard.stats is not None:
+                shard.stats.add(**values)
+            shard.last_seen = time.time()
+
+    def extend(self, device_id, rows):
+        """Append ``(timestamp, values)`` rows for one device under a single lock acquisition."""
+        count = len(rows)
+        self.extend_columns(
+            device_id,
+            np.fromiter((timestamp for timestamp, _values in rows), dtype=np.int64, count=count),
+            **{
+                name: np.fromiter((values.get(name, np.nan) for _timestamp, values in rows), dtype=np.float64, count=count)
+                for name in self.fields
+            },
+        )
+
+    def extend_columns(self, device_id, timestamps, **columns):
+        """Append readings given as columns (sequences of equal length, oldest first) for one device.
+
+        Runs of at least ``BULK_MIN_ROWS`` readings are converted to numpy
+        once and applied to the buffer, rollups and statistics in bulk; numpy's
+        fixed cost per call makes shorter runs cheaper to apply row by row.
+        Either way the device's lock is taken once.
+        """
+        shard = self.shard(device_id)
+        if len(timestamps) < BULK_MIN_ROWS:
+            names = tuple(columns)
+            with shard.lock:
+                for timestamp, *values in zip(timestamps, *columns.values()):
+                    values = dict(zip(names, values))
+                    shard.buffer.append(timestamp, **values)
+                    shard.rollups.add(timestamp, **values)
+                    if shard.stats is not None:
+                        shard.stats.add(**values)
+                shard.last_seen = time.time()
+            return
+
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        columns = {name: np.asarray(values, dtype=np.float64) for name, values in columns.items()}
+        with shard.lock:
+            shard.buffer.extend(timestamps, **columns)
+            shard.rollups.extend(timestamps, **columns)
+            if shard.stats is not None:
+                shard.stats.extend(**columns)
+            shard.last_seen = time.time()
+
+    def shards(self):
+        """Return a snapshot list of all shards."""
+        return list(self._shards.values())
+
+    @property
+    def nbytes(self):
+        """Combined memory footprint of all device buffers in bytes."""
+        return sum(shard.buffer.nbytes for shard in self.shards())
@@ -0,0 +1,114 @@
+import pandas as pd
+
+from metrics import Counter
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_ROWS = Counter("export_rows_total", "Readings streamed by /export", ("format",))
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def _frames(chunks, fields):
+    """Turn ``(device_id, columns)`` chunks into DataFrames with a fixed column order."""
+    for device_id, columns in chunks:
+        frame = pd.DataFrame(
+            {
+                "device_id": device_id,
+                "timestamp": pd.to_datetime(columns["timestamps"], unit="ns", utc=True),
+                **{name: columns[name] for name in fields},
+            }
+        )
+        if len(frame):
+            yield frame
+
+
+def _csv(frames, fields):
+    header = True
+    for frame in frames:
+        yield frame.to_csv(index=False, header=header, date_format="%Y-%m-%dT%H:%M:%S.%fZ").encode()
+        header = False
+    if header:
+        yield (",".join(("device_id", "timestamp", *fields)) + "\n").encode()
+
+
+def _ndjson(frames):
+    for frame in frames:
+        # pandas ends every line, including the last, with a newline
+        yield frame.to_json(orient="records", lines=True, date_format="iso", date_unit="us").encode()
+
+
+class _Sink:
+    """Write-only file object whose contents are taken out after every row group."""
+
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _parquet(frames, fields):
+    sink = _Sink()
+    schema = pyarrow.schema(
+        [("device_id", pyarrow.string()), ("timestamp", pyarrow.timestamp("ns", tz="UTC"))]
+        + [(name, pyarrow.float32()) for name in fields]
+    )
+    with pyarrow.parquet.ParquetWriter(sink, schema) as writer:
+        for frame in frames:
+            # One row group per chunk, sent as soon as it is written
+            writer.write_table(pyarrow.Table.from_pandas(frame, schema=schema, preserve_index=False))
+            yield sink.take()
+    yield sink.take()
+
+
+def stream_export(export_format, chunks, fields):
+    """Yield ``chunks`` of ``(device_id, columns)`` encoded as CSV, NDJSON or Parquet bytes.
+
+    Only one chunk is held at a time, so memory use does not depend on the
+    size of the export. Parquet needs pyarrow.
+    """
+    if export_format not in FORMATS:
+        raise ValueError(f"unknown export format {export_format!r}")
+    if export_format == "parquet" and pyarrow is None:
+        raise ValueError("Parquet export needs pyarrow (pip install pyarrow)")
+    rows = EXPORT_ROWS.labels(export_format)
+
+    def counted():
+        for frame in _frames(chunks, fields):
+            rows.inc(len(frame))
+            yield frame
+
+    if export_format == "csv":
+        return _csv(counted(), fields)
+    if export_format == "ndjson":
+        return _ndjson(counted())
+    return _parquet(counted(), fields)
@@ -0,0 +1,28 @@
+"""Gunicorn hooks for INGEST_MODE=shared.
+
+In shared mode the master starts one ingest process (ingest.py) that owns
+the MQTT connection, and every worker runs in reader mode, following the
+shared-memory message log instead of connecting to the broker itself.
+Other modes leave Gunicorn's behaviour unchanged.
+"""
+import os
+import subprocess
+import sys
+
+_ingest_process = None
+
+
+def on_starting(server):
+    global _ingest_process
+    if os.getenv("INGEST_MODE", "embedded").lower() != "shared":
+        return
+    _ingest_process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(__file__), "ingest.py")])
+    # Workers are forked after this hook and inherit the reader mode
+    os.environ["INGEST_MODE"] = "reader"
+    server.log.info("Started ingest process %s", _ingest_process.pid)
+
+
+def on_exit(server):
+    if _ingest_process is not None and _ingest_process.poll() is None:
+        _ingest_process.terminate()
+        _ingest_process.wait(timeout=10)
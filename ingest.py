@@ -0,0 +1,42 @@
+"""Dedicated MQTT ingest process.
+
+Owns the only broker connection and publishes every received message into
+the shared-memory log that web workers running with INGEST_MODE=reader
+follow. Started automatically by gunicorn.conf.py when INGEST_MODE=shared,
+or run by hand with ``python ingest.py``.
+"""
+import logging
+import os
+import signal
+import threading
+
+os.environ["INGEST_MODE"] = "ingest"
+
+import mqtt_client  # noqa: E402
+from logging_config import configure_logging  # noqa: E402
+
+logger = logging.getLogger("ingest")
+
+
+def main():
+    configure_logging()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    mqtt_client.start_mqtt_connection()
+    stop.wait()
+
+    logger.info("✓ Stopping ingest process")
+    mqtt_client.stop_mqtt_connection()
+    mqtt_client.ingest_worker.wait_idle(timeout=5)
+    if mqtt_client.history_store is not None:
+        mqtt_client.history_store.close()
+    if mqtt_client.shared_log is not None:
+        mqtt_client.shared_log.close()
+    if os.path.exists(mqtt_client.INGEST_COMMAND_SOCKET):
+        os.remove(mqtt_client.INGEST_COMMAND_SOCKET)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import logging
+import os
+import threading
+import time
+
+
+class RateLimitFilter(logging.Filter):
+    """Token-bucket rate limit per log call site.
+
+    Records are keyed by logger, level and message template, so a flood of
+    identical per-message lines is thinned to ``rate`` per second while
+    unrelated messages are unaffected. The next record let through reports
+    how many were suppressed.
+    """
+
+    def __init__(self, rate=5.0, burst=20):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, suppressed = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, suppressed + 1)
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+
+        if suppressed:
+            record.msg = f"{record.msg} (+{suppressed} similar suppressed)"
+        return True
+
+
+def configure_logging():
+    """Log to stderr at LOG_LEVEL with per-call-site rate limiting (LOG_RATE_PER_S, LOG_BURST)."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    handler.addFilter(
+        RateLimitFilter(
+            rate=float(os.getenv("LOG_RATE_PER_S", 5)),
+            burst=int(os.getenv("LOG_BURST", 20)),
+        )
+    )
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
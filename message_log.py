@@ -0,0 +1,166 @@
+class _Run:
+    """Append-only list that drops items from the front in amortized O(1).
+
+    Dropped slots are reclaimed in bulk once they make up half the list,
+    so positional access stays a plain list index.
+    """
+
+    __slots__ = ("items", "head")
+
+    def __init__(self):
+        self.items = []
+        self.head = 0
+
+    def __len__(self):
+        return len(self.items) - self.head
+
+    def __getitem__(self, index):
+        return self.items[self.head + index]
+
+    def append(self, item):
+        self.items.append(item)
+
+    def popleft(self):
+        item = self.items[self.head]
+        self.items[self.head] = None
+        self.head += 1
+        self._compact()
+        return item
+
+    def drop(self, count):
+        """Drop the first ``count`` items and return them."""
+        head = self.head
+        dropped = self.items[head:head + count]
+        self.items[head:head + count] = [None] * len(dropped)
+        self.head = head + len(dropped)
+        self._compact()
+        return dropped
+
+    def _compact(self):
+        if self.head >= 1024 and self.head * 2 >= len(self.items):
+            del self.items[:self.head]
+            self.head = 0
+
+    def slice(self, start, stop):
+        return self.items[self.head + start:self.head + stop]
+
+    def bisect_seq(self, seq):
+        """Number of leading items whose ``seq`` is <= ``seq`` (items are seq-ordered)."""
+        low, high = 0, len(self)
+        items, head = self.items, self.head
+        while low < high:
+            middle = (low + high) // 2
+            if items[head + middle]["seq"] <= seq:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+class MessageLog:
+    """Bounded, seq-ordered log of message dicts with per-topic indexes.
+
+    A drop-in for the ``deque(maxlen=...)`` it replaces (``append``,
+    ``extend``, ``clear``, ``len``, iteration, ``maxlen``), plus reads that
+    cost O(log n + k) for k returned messages: the newest ``tail(k)``,
+    everything ``since(seq)``, and ``page`` for offset/limit browsing of the
+    whole log or of one topic. Messages must be appended in increasing
+    ``seq`` order. Not thread-safe; callers hold their own lock.
+    """
+
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self._all = _Run()
+        self._topics = {}
+
+    def __len__(self):
+        return len(self._all)
+
+    def __iter__(self):
+        return iter(self._all.slice(0, len(self._all)))
+
+    def __reversed__(self):
+        return reversed(self._all.slice(0, len(self._all)))
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self._all)
+        if not 0 <= index < len(self._all):
+            raise IndexError("message log index out of range")
+        return self._all[index]
+
+    def append(self, message):
+        if len(self._all) >= self.maxlen:
+            oldest = self._all.popleft()
+            # The oldest message overall is also the oldest of its topic
+            run = self._topics[oldest["topic"]]
+            run.popleft()
+            if not len(run):
+                del self._topics[oldest["topic"]]
+        self._all.append(message)
+        run = self._topics.get(message["topic"])
+        if run is None:
+            run = self._topics[message["topic"]] = _Run()
+        run.append(message)
+
+    def extend(self, messages):
+        """Append many messages, evicting the overflow in one pass per topic."""
+        messages = list(messages)
+        if len(messages) >= self.maxlen:
+            # Nothing already logged would survive
+            self.clear()
+            messages = messages[-self.maxlen:]
+        runs = self._topics
+        for message in messages:
+            run = runs.get(message["topic"])
+            if run is None:
+                run = runs[message["topic"]] = _Run()
+            run.append(message)
+        self._all.items.extend(messages)
+        overflow = len(self._all) - self.maxlen
+        if overflow <= 0:
+            return
+        evicted = {}
+        for message in self._all.drop(overflow):
+            evicted[message["topic"]] = evicted.get(message["topic"], 0) + 1
+        for topic, count in evicted.items():
+            run = runs[topic]
+            run.drop(count)
+            if not len(run):
+                del runs[topic]
+
+    def clear(self):
+        self._all = _Run()
+        self._topics = {}
+
+    def topics(self):
+        """Return ``{topic: retained message count}``."""
+        return {topic: len(run) for topic, run in self._topics.items()}
+
+    def tail(self, count):
+        """Return the newest ``count`` messages, oldest first."""
+        size = len(self._all)
+        return self._all.slice(max(0, size - count), size)
+
+    def since(self, seq):
+        """Return messages with a sequence number greater than ``seq``, oldest first."""
+        size = len(self._all)
+        return self._all.slice(self._all.bisect_seq(seq), size)
+
+    def page(self, offset=0, limit=50, topic=None, until=None):
+        """Return ``(total, messages)`` for one page, newest first.
+
+        ``offset`` counts back from the newest message with ``seq <= until``
+        (from the newest message overall if ``until`` is None), so pages stay
+        stable while new messages arrive. ``total`` is the number of such
+        messages, optionally restricted to ``topic``.
+        """
+        run = self._all if topic is None else self._topics.get(topic)
+        if run is None:
+            return 0, []
+        end = len(run) if until is None else run.bisect_seq(until)
+        stop = max(0, end - offset)
+        start = max(0, stop - limit)
+        messages = run.slice(start, stop)
+        messages.reverse()
+        return end, messages
@@ -0,0 +1,175 @@
+import bisect
+import math
+
+# Seconds, from 1 µs to 10 s
+LATENCY_BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+# Seconds, from 1 ms to 5 min, for delays that span processes and networks
+DELAY_BUCKETS = (1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+# Bytes, from 256 B to 16 MiB
+SIZE_BUCKETS = tuple(2 ** power for power in range(8, 25, 2))
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values):
+        """Return the child for one label combination, creating it on first use."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    """Monotonic counter.
+
+    Increments are plain attribute updates without a lock. They are meant
+    for the ingest worker and callbacks, where an occasional lost increment
+    under heavy cross-thread contention is an acceptable price for zero
+    locking overhead.
+    """
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def collect(self):
+        for values, child in list(self._children.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def observe_many(self, values):
+        counts, bounds, bisect_left = self.counts, self.bounds, bisect.bisect_left
+        for value in values:
+            counts[bisect_left(bounds, value)] += 1
+        self.sum += sum(values)
+        self.count += len(values)
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram; observing costs one bisect and three additions."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def observe_many(self, values):
+        """Observe a sequence of values in one call."""
+        self.labels().observe_many(values)
+
+    def collect(self):
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), list(child.counts)):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(child.sum)}"
+            yield f"{self.name}_count{labels} {child.count}"
+
+
+class Gauge(_Metric):
+    """Gauge whose samples are computed at scrape time.
+
+    ``callback`` returns an iterable of ``(label_values, value)`` pairs, so
+    nothing is done on the hot path to keep it current.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback, labelnames=(), registry=None):
+        self.callback = callback
+        super().__init__(name, documentation, labelnames, registry)
+
+    def collect(self):
+        for values, value in self.callback():
+            yield f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name!r} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.header())
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -1,16 +1,48 @@
 import json
+import logging
+import math
 import os
+import socket
 import threading
-from collections import deque
+import time
 from datetime import datetime
-from urllib.parse import urlparse
+from urllib.parse import unquote, urlparse
 
+import numpy as np
 import paho.mqtt.client as mqtt
 from dotenv import load_dotenv
 
+from alerts import AlertEngine, parse_rules
+from broadcast import Broadcaster
+from cache import LRUCache
+from async_ingest import AsyncConnection, AsyncIngestEngine
+from commands import BUFFERED, CommandDispatcher
+from connection import ConnectionManager
+from device_store import DeviceStore, extract_device_id
+from message_log import MessageLog
+from metrics import DELAY_BUCKETS, Counter, Gauge, Histogram
+from pipeline import BatchWorker
+from recording import Recorder
+from replicas import ReplicaSync, share_subscription
+from ring_buffer import NS_PER_S
+from rolling_stats import parse_counts
+from rollups import lttb, parse_levels
+from shm_log import SharedMessageLog, decode_record, encode_record
+from tsdb import SegmentStore
+from validation import DuplicateFilter, ReadingSchema, RejectSampler, parse_limits
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Configuration
 MQTT_BROKER = os.getenv("MQTT_BROKER", "broker.emqx.io")
 MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))
@@ -22,18 +54,201 @@ MAX_DATA_POINTS = int(os.getenv("MAX_DATA_POINTS", 100))
 MQTT_USERNAME = os.getenv("USERNAME")
 MQTT_PASSWORD = os.getenv("PASSWORD")
 MQTT_CLIENT_ID = os.getenv("CLIENT_ID", "iot-dashboard-dht11")
+# A persistent session lets the broker keep QoS 1 messages for us while we reconnect
+MQTT_CLEAN_SESSION = os.getenv("MQTT_CLEAN_SESSION", "False").lower() in ("true", "1", "yes")
+MQTT_RECONNECT_MIN_S = float(os.getenv("MQTT_RECONNECT_MIN_S", 0.5))
+MQTT_RECONNECT_MAX_S = float(os.getenv("MQTT_RECONNECT_MAX_S", 30))
+# Publishes kept while disconnected (QoS 0 here, QoS > 0 in paho's queue)
+MQTT_OFFLINE_BUFFER = int(os.getenv("MQTT_OFFLINE_BUFFER", 1000))
+# Comma-separated subscriptions carrying sensor readings, e.g. "site/+/dht".
+# The level matched by the first wildcard is used as the device ID.
+MQTT_DEVICE_TOPICS = [
+    topic.strip()
+    for topic in os.getenv("MQTT_DEVICE_TOPICS", MQTT_TOPIC_DHT).split(",")
+    if topic.strip()
+]
+DEFAULT_DEVICE_ID = os.getenv("DEFAULT_DEVICE_ID", "default")
+# Durable history; leave TSDB_DIR empty to keep readings in memory only
+TSDB_DIR = os.getenv("TSDB_DIR", "")
+TSDB_SEGMENT_RECORDS = int(os.getenv("TSDB_SEGMENT_RECORDS", 1_000_000))
+TSDB_RETENTION_DAYS = float(os.getenv("TSDB_RETENTION_DAYS", 0))
+TSDB_FLUSH_INTERVAL_MS = int(os.getenv("TSDB_FLUSH_INTERVAL_MS", 500))
+# Rollup levels as "resolution_s:buckets", finest first
+ROLLUP_LEVELS = parse_levels(os.getenv("ROLLUP_LEVELS", "1:3600,60:10080,3600:8760"))
+# Rolling statistics windows, in readings, maintained per device as readings arrive, and the spans
+# (in readings) of the moving averages. Statistics over the whole buffer (MAX_DATA_POINTS) are
+# computed from the buffer itself when asked for, so no window keeps a second copy of it.
+STATS_ROLLING_WINDOWS = tuple(
+    window for window in parse_counts(os.getenv("STATS_WINDOWS", "30,300")) if window != MAX_DATA_POINTS
+)
+STATS_WINDOWS = tuple(sorted(STATS_ROLLING_WINDOWS + (MAX_DATA_POINTS,)))
+STATS_EMA_SPANS = parse_counts(os.getenv("STATS_EMA_SPANS", "10,60"))
+# A series may hold up to this many points per pixel before LTTB reduces it to the width
+SERIES_POINTS_PER_PIXEL = int(os.getenv("SERIES_POINTS_PER_PIXEL", 4))
+# "embedded": every process runs its own MQTT client (default).
+# "ingest": this process owns the MQTT client and publishes into shared memory.
+# "reader": this process follows the shared log and never connects to the broker.
+INGEST_MODE = os.getenv("INGEST_MODE", "embedded").lower()
+SHM_NAME = os.getenv("SHM_NAME", "iot-dashboard-dht11")
+SHM_SLOTS = int(os.getenv("SHM_SLOTS", 65536))
+SHM_SLOT_SIZE = int(os.getenv("SHM_SLOT_SIZE", 1024))
+SHM_POLL_INTERVAL_MS = int(os.getenv("SHM_POLL_INTERVAL_MS", 10))
+INGEST_COMMAND_SOCKET = os.getenv("INGEST_COMMAND_SOCKET", "/tmp/iot-dashboard-dht11.sock")
+# Upper bound on messages decoded and stored per ingest worker batch
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 512))
+# Further brokers to ingest from, as comma-separated URLs. Append "?topics=a/+/dht|b/#"
+# to subscribe to other topics than MQTT_DEVICE_TOPICS on that broker.
+MQTT_EXTRA_BROKERS = [spec.strip() for spec in os.getenv("MQTT_EXTRA_BROKERS", "").split(",") if spec.strip()]
+# "thread": one network thread per broker; "asyncio": all brokers on one event loop
+INGEST_ENGINE = os.getenv("INGEST_ENGINE", "thread").lower()
+# Append every received raw message to this file, for replay.py; empty disables recording
+RECORD_FILE = os.getenv("RECORD_FILE", "")
+# Formatted payload text kept for the messages most recently shown in the feed
+PAYLOAD_TEXT_CACHE_SIZE = int(os.getenv("PAYLOAD_TEXT_CACHE_SIZE", 256))
+# Topics whose resolved device ID is remembered
+DEVICE_ID_CACHE_SIZE = int(os.getenv("DEVICE_ID_CACHE_SIZE", 4096))
+# Payload fields with the device's own send time (epoch s, ms, µs or ns) and message counter
+DEVICE_TIME_FIELD = os.getenv("DEVICE_TIME_FIELD", "ts")
+DEVICE_SEQ_FIELD = os.getenv("DEVICE_SEQ_FIELD", "seq")
+# Device times further than this from the receive time come from an unset or drifting clock
+DEVICE_CLOCK_SKEW_S = float(os.getenv("DEVICE_CLOCK_SKEW_S", 300))
+# Sensor readings must be numbers within these "field:min:max" limits, or the message is rejected
+READING_LIMITS = parse_limits(os.getenv("READING_LIMITS", "temperature:-40:80,humidity:0:100"))
+# Redelivered sensor messages are dropped when their device counter (or the hash of a payload
+# carrying a send time) was seen in the last DEDUP_WINDOW_S; DEDUP_CACHE_SIZE=0 disables this
+DEDUP_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", 65536))
+DEDUP_WINDOW_S = float(os.getenv("DEDUP_WINDOW_S", 120))
+# Rejected messages are counted; the first of every REJECT_SAMPLE_EVERY per reason is kept,
+# up to the newest REJECT_SAMPLES
+REJECT_SAMPLES = int(os.getenv("REJECT_SAMPLES", 50))
+REJECT_SAMPLE_EVERY = int(os.getenv("REJECT_SAMPLE_EVERY", 10))
+# Outbound commands: topics that may wait at once, and how long to wait for a PUBACK
+COMMAND_QUEUE_SIZE = int(os.getenv("COMMAND_QUEUE_SIZE", 64))
+COMMAND_ACK_TIMEOUT_S = float(os.getenv("COMMAND_ACK_TIMEOUT_S", 10))
+# Alert rules as a JSON list (see alerts.parse_rules), inline or from a file.
+# Alert state changes are published to ALERT_TOPIC; the newest ALERT_HISTORY are kept.
+ALERT_RULES = os.getenv("ALERT_RULES", "")
+ALERT_RULES_FILE = os.getenv("ALERT_RULES_FILE", "")
+ALERT_TOPIC = os.getenv("ALERT_TOPIC", "iot-dashboard/alerts")
+ALERT_HISTORY = int(os.getenv("ALERT_HISTORY", 100))
+# Readings copied per step of a streamed export
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", 10_000))
+# Replicas with the same MQTT_SHARE_GROUP split the sensor topics between them through
+# "$share/<group>/<topic>" subscriptions and exchange the messages they accepted on
+# REPLICA_TOPIC/<REPLICA_ID>, so every replica holds all devices, messages and alerts.
+# Leave MQTT_SHARE_GROUP empty to receive every message.
+MQTT_SHARE_GROUP = os.getenv("MQTT_SHARE_GROUP", "")
+REPLICA_ID = os.getenv("REPLICA_ID", "") or socket.gethostname()
+REPLICA_TOPIC = os.getenv("REPLICA_TOPIC", "iot-dashboard/replicas")
+# How often a replica sends its messages, and how long messages wait for the other replicas' to merge in
+REPLICA_SYNC_INTERVAL_MS = int(os.getenv("REPLICA_SYNC_INTERVAL_MS", 250))
+REPLICA_MERGE_DELAY_MS = int(os.getenv("REPLICA_MERGE_DELAY_MS", 1000))
+if MQTT_SHARE_GROUP:
+    # Every replica needs its own session on the broker
+    MQTT_CLIENT_ID = f"{MQTT_CLIENT_ID}-{REPLICA_ID}"
+    if not os.getenv("REPLICA_ID"):
+        # A host name changes when the container is recreated. A persistent session under it would
+        # stay in the group after the replica is gone and keep being handed messages nobody reads.
+        MQTT_CLEAN_SESSION = True
+
+READING_FIELDS = ("temperature", "humidity")
+
+# Global data storage: one buffer and lock per device, plus a shared message log
+device_store = DeviceStore(
+    MAX_DATA_POINTS,
+    fields=READING_FIELDS,
+    rollup_levels=ROLLUP_LEVELS,
+    stats_windows=STATS_ROLLING_WINDOWS,
+    ema_spans=STATS_EMA_SPANS,
+)
+
+message_log = MessageLog(MAX_DATA_POINTS)
 
-# Global data storage
-sensor_data = {
-    "temperature": deque(maxlen=MAX_DATA_POINTS),
-    "humidity": deque(maxlen=MAX_DATA_POINTS),
-    "timestamps": deque(maxlen=MAX_DATA_POINTS),
-}
+# Checks applied to sensor messages before anything is stored
+reading_schema = ReadingSchema(READING_FIELDS, READING_LIMITS)
+duplicate_filter = DuplicateFilter(DEDUP_CACHE_SIZE, DEDUP_WINDOW_S)
+reject_sampler = RejectSampler(REJECT_SAMPLES, REJECT_SAMPLE_EVERY)
 
-message_log = deque(maxlen=MAX_DATA_POINTS)
+
+def _load_alert_rules():
+    if ALERT_RULES_FILE:
+        with open(ALERT_RULES_FILE) as handle:
+            return parse_rules(handle.read())
+    return parse_rules(ALERT_RULES)
+
+
+# Every process evaluates the rules so that all dashboards agree; only
+# processes that talk to the broker publish the resulting events
+alert_engine = AlertEngine(_load_alert_rules(), history=ALERT_HISTORY)
+
+history_store = (
+    SegmentStore(
+        TSDB_DIR,
+        fields=device_store.fields,
+        segment_records=TSDB_SEGMENT_RECORDS,
+        retention_s=TSDB_RETENTION_DAYS * 86400 or None,
+        flush_interval_s=TSDB_FLUSH_INTERVAL_MS / 1000,
+        readonly=INGEST_MODE == "reader",
+    )
+    if TSDB_DIR
+    else None
+)
 
 data_lock = threading.Lock()
+payload_texts = LRUCache(PAYLOAD_TEXT_CACHE_SIZE, name="payload_text")
+# Bumped whenever the message log is reset, so (epoch, seq) never repeats
+message_epoch = 0
+message_seq = 0
+
+# Fan-out of new messages to Server-Sent Events clients (push mode)
+broadcaster = Broadcaster(
+    client_buffer=int(os.getenv("PUSH_CLIENT_BUFFER", 256)),
+    max_client_drops=int(os.getenv("PUSH_MAX_CLIENT_DROPS", 1024)),
+)
 mqtt_client = None
+connection = None
+connections = []
+ingest_engine = None
+shared_log = None
+# Readers never receive messages from a broker, so there is nothing for them to record
+recorder = Recorder(RECORD_FILE) if RECORD_FILE and INGEST_MODE != "reader" else None
+# Exchanges messages with the other replicas when MQTT_SHARE_GROUP is set, see _start_replica_sync
+replica_sync = None
+_replica_topics = f"{REPLICA_TOPIC}/"
+
+# Metrics exposed on /metrics
+MESSAGES_RECEIVED = Counter("mqtt_messages_received_total", "MQTT messages ingested", ("topic",))
+DECODE_FAILURES = Counter(
+    "mqtt_decode_failures_total",
+    "Payloads that were not valid JSON",
+    ("kind",),
+)
+PUBLISHES = Counter("mqtt_publish_total", "Publish attempts by result", ("result",))
+ON_MESSAGE_SECONDS = Histogram("mqtt_on_message_seconds", "Time spent in the paho on_message callback")
+SENSOR_LATENCY_SECONDS = Histogram(
+    "mqtt_sensor_latency_seconds",
+    "Time from the device's send time in the payload until on_message (device, network and broker)",
+    buckets=DELAY_BUCKETS,
+)
+DEVICE_SEQ_GAPS = Counter(
+    "mqtt_device_seq_gaps_total",
+    "Messages missing from a device's DEVICE_SEQ_FIELD counter, i.e. lost before reaching ingest",
+)
+DEVICE_TIMES_REJECTED = Counter(
+    "mqtt_device_times_rejected_total",
+    "Device send times ignored for being unreadable or further than DEVICE_CLOCK_SKEW_S from the receive time",
+)
+INGEST_LATENCY_SECONDS = Histogram(
+    "mqtt_ingest_latency_seconds",
+    "Time from on_message until the message is stored and visible to readers",
+)
+INGEST_BATCH_SIZE_HIST = Histogram(
+    "mqtt_ingest_batch_size",
+    "Messages applied per ingest batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024),
+)
+LOCK_WAIT_SECONDS = Histogram("data_lock_wait_seconds", "Time spent waiting for data_lock", ("operation",))
+LOCK_HOLD_SECONDS = Histogram("data_lock_hold_seconds", "Time data_lock was held", ("operation",))
 
 
 def _normalize_broker(broker: str) -> str:
@@ -44,150 +259,1047 @@ def _normalize_broker(broker: str) -> str:
     return broker
 
 
+def _parse_broker(spec):
+    """Parse an MQTT_EXTRA_BROKERS entry into connection settings."""
+    # Topics may contain "#" and "+", so they are split off before URL parsing
+    url, _, topics = spec.partition("?topics=")
+    parsed = urlparse(url if "://" in url else f"mqtt://{url}")
+    return {
+        "host": parsed.hostname,
+        "port": parsed.port or 1883,
+        "username": unquote(parsed.username) if parsed.username else None,
+        "password": unquote(parsed.password) if parsed.password else None,
+        "topics": [topic for topic in topics.split("|") if topic] or MQTT_DEVICE_TOPICS,
+        "primary": False,
+    }
+
+
+# The first broker carries LED commands; the others are ingest-only
+BROKERS = [
+    {
+        "host": _normalize_broker(MQTT_BROKER),
+        "port": MQTT_PORT,
+        "username": MQTT_USERNAME,
+        "password": MQTT_PASSWORD,
+        "topics": MQTT_DEVICE_TOPICS,
+        "primary": True,
+    }
+] + [_parse_broker(spec) for spec in MQTT_EXTRA_BROKERS]
+DEVICE_TOPIC_PATTERNS = list(dict.fromkeys(topic for broker in BROKERS for topic in broker["topics"]))
+
+
+def resolve_device_id(topic):
+    """Return the device ID for a sensor topic, or None for non-sensor topics."""
+    try:
+        return _device_ids[topic]
+    except KeyError:
+        pass
+    device_id = None
+    for pattern in DEVICE_TOPIC_PATTERNS:
+        device_id = extract_device_id(pattern, topic, default=DEFAULT_DEVICE_ID)
+        if device_id is not None:
+            break
+    if len(_device_ids) >= DEVICE_ID_CACHE_SIZE:
+        # Only the ingest and replica sync threads resolve topics, and single dict operations are atomic
+        _device_ids.clear()
+    _device_ids[topic] = device_id
+    return device_id
+
+
+_device_ids = {}
+
+
 def on_connect(client, userdata, flags, rc):
     """Callback when client connects to the broker."""
+    manager = userdata["connection"]
     if rc == 0:
-        print("✓ Connected to MQTT broker successfully")
-        # Subscribe to both DHT and LED topics
-        client.subscribe(MQTT_TOPIC_DHT, qos=MQTT_QOS)
-        print(f"✓ Subscribed to topic: {MQTT_TOPIC_DHT}")
-        client.subscribe(MQTT_TOPIC_LED, qos=MQTT_QOS)
-        print(f"✓ Subscribed to topic: {MQTT_TOPIC_LED}")
+        logger.info(
+            "✓ Connected to MQTT broker %s (session present: %s)", manager.name, bool(flags.get("session present"))
+        )
+        # Subscribe to every sensor topic pattern, and the LED topic on the primary broker.
+        # Replicas share the sensor topics and exchange their readings on the primary broker.
+        topics = [share_subscription(topic, MQTT_SHARE_GROUP) for topic in userdata["topics"]]
+        if userdata["primary"]:
+            topics.append(MQTT_TOPIC_LED)
+            if MQTT_SHARE_GROUP:
+                topics.append(f"{REPLICA_TOPIC}/+")
+        for topic in topics:
+            client.subscribe(topic, qos=MQTT_QOS)
+            logger.info("✓ Subscribed to topic: %s", topic)
     else:
-        print(f"✗ Connection failed with code {rc}")
+        logger.error("✗ Connection to %s failed with code %s", manager.name, rc)
+    manager.handle_connect(rc)
 
 
 def on_disconnect(client, userdata, rc):
     """Callback when client disconnects from the broker."""
+    manager = userdata["connection"]
     if rc != 0:
-        print(f"✗ Disconnected unexpectedly with code {rc}")
+        logger.warning("✗ Disconnected from %s unexpectedly with code %s", manager.name, rc)
     else:
-        print("✓ Disconnected from broker")
+        logger.info("✓ Disconnected from broker %s", manager.name)
+    manager.handle_disconnect(rc)
+
+
+def on_publish(client, userdata, mid):
+    """Callback when the broker acknowledges a publish (PUBACK for QoS 1)."""
+    command_dispatcher.acknowledge(mid)
 
 
 def on_message(client, userdata, msg):
-    """Callback when a message is received."""
-    try:
-        decoded_payload = msg.payload.decode(errors="replace")
+    """Callback when a message is received.
+
+    Runs on paho's network thread, so it only timestamps and enqueues the
+    raw bytes; decoding and storage happen in batches on the ingest worker.
+    The receive time is taken in epoch nanoseconds. With RECORD_FILE set the
+    raw message is queued for the recorder too.
+    """
+    started = time.perf_counter()
+    received_at = time.time_ns()
+    ingest_worker.submit((msg.topic, msg.payload, msg.qos, received_at, None))
+    # Replica state is derived from sensor messages, which are recorded where they arrive
+    if recorder is not None and not msg.topic.startswith(_replica_topics):
+        recorder.record(msg.topic, msg.payload, msg.qos, received_at)
+    ON_MESSAGE_SECONDS.observe(time.perf_counter() - started)
+
+
+def format_clock(timestamp):
+    """Format an epoch-nanosecond ``timestamp`` as local HH:MM:SS, reusing the last result within the same second."""
+    global _clock_cache
+    second = timestamp // NS_PER_S
+    if _clock_cache[0] != second:
+        _clock_cache = (second, datetime.fromtimestamp(second).strftime("%H:%M:%S"))
+    return _clock_cache[1]
+
+
+_clock_cache = (None, "")
+
+# Multiplier to nanoseconds for device times below each magnitude: seconds, ms, µs, then ns
+_DEVICE_TIME_UNITS = ((1e11, NS_PER_S), (1e14, 1_000_000), (1e17, 1_000), (math.inf, 1))
+
+
+def device_time_ns(value):
+    """Return a device send time given in epoch s, ms, µs or ns as epoch nanoseconds, or None.
+
+    The unit is told apart by magnitude, which is unambiguous for any date
+    after 1973. Only numbers are accepted.
+    """
+    if type(value) is not int and type(value) is not float:
+        return None
+    for limit, scale in _DEVICE_TIME_UNITS:
+        if value < limit:
+            return int(value * scale)
+    return None
+
+
+# Last DEVICE_SEQ_FIELD value seen per device; only the ingest thread touches it
+_device_seqs = {}
+
+
+def ingest_batch(records):
+    """Decode raw MQTT messages and apply them to the message log and device stores.
+
+    ``records`` is a list of ``(topic, payload_bytes, qos, received_at, seq)``
+    with ``received_at`` in epoch nanoseconds. ``seq`` is None for locally
+    received messages, or the shared log's sequence number, so every process
+    following that log numbers messages identically.
+
+    With MQTT_SHARE_GROUP set, the messages go through ``replica_sync``
+    first, see ``_share_batch``; the merged stream of every replica comes
+    back to ``_apply_batch`` on the sync thread.
+    """
+    if replica_sync is not None:
+        _share_batch(records)
+    else:
+        _apply_batch(records)
+
+
+def _share_batch(records):
+    """Replica mode: check this replica's share of the messages and pass the accepted ones to replica_sync.
+
+    Sensor messages that pass ``reading_schema`` are sent to every replica,
+    this one included. Other topics, which every replica subscribes to
+    itself, only wait in this replica's merge. Duplicates are caught in
+    ``_apply_batch``, on the merged stream, so a redelivery that lands on
+    another replica is caught too.
+    """
+    shared = []
+    held = []
+    own_state = f"{_replica_topics}{REPLICA_ID}"
+    for topic, raw_payload, qos, received_at, _seq in records:
+        if topic.startswith(_replica_topics):
+            replica_sync.receive(raw_payload, own=topic == own_state)
+            continue
+        if resolve_device_id(topic) is None:
+            held.append((topic, raw_payload, qos, received_at))
+            continue
         try:
-            payload = json.loads(decoded_payload)
-        except json.JSONDecodeError:
-            payload = decoded_payload
-
-        timestamp = datetime.now().strftime("%H:%M:%S")
-
-        with data_lock:
-            message_log.append(
-                {
-                    "timestamp": timestamp,
-                    "topic": msg.topic,
-                    "payload": payload,
-                }
-            )
+            payload = json_loads(raw_payload)
+        except ValueError:
+            DECODE_FAILURES.labels("json").inc()
+            _reject("json", topic, raw_payload, received_at)
+            continue
+        _values, reason = reading_schema.validate(payload)
+        if reason is not None:
+            _reject(reason, topic, raw_payload, received_at)
+            continue
+        shared.append((topic, raw_payload, qos, received_at))
+    if shared:
+        replica_sync.share(shared)
+    if held:
+        replica_sync.hold(held)
 
-            if isinstance(payload, dict):
-                sensor_data["temperature"].append(payload.get("temperature", 0))
-                sensor_data["humidity"].append(payload.get("humidity", 0))
-                sensor_data["timestamps"].append(timestamp)
 
-        if isinstance(payload, dict):
-            temp = payload.get("temperature")
-            humidity = payload.get("humidity")
-            print(f"✓ Data received - Temp: {temp}°C, Humidity: {humidity}%")
-        else:
-            print(f"✓ Message received: {payload}")
-    except Exception as e:
-        print(f"✗ Error processing message: {e}")
+def _apply_batch(records, own=None):
+    """Apply decoded messages to the message log, device stores, alerts and push clients.
+
+    The message log lock is taken once per batch and each device's lock
+    once per batch. Sensor messages whose reading fails ``reading_schema``,
+    or that ``duplicate_filter`` has seen before, are counted and sampled by
+    ``reject_sampler`` and not stored anywhere.
+
+    ``own`` tells, per record, whether this process received it from the
+    broker (None means all of them). Only those publish the alerts they
+    cause, so a replica group publishes each alert once.
+
+    Readings are stored at their receive time, which only moves forward, as
+    the buffers and rollups require. A device send time in the payload
+    (``DEVICE_TIME_FIELD``) feeds the sensor latency histogram instead, and
+    jumps in its ``DEVICE_SEQ_FIELD`` counter are counted as lost messages.
+    """
+    global message_seq
+    if shared_log is not None and shared_log.owner:
+        first = shared_log.extend(
+            [encode_record(topic, raw_payload, qos, received_at) for topic, raw_payload, qos, received_at, _ in records]
+        )
+        records = [
+            (topic, raw_payload, qos, received_at, seq)
+            for seq, (topic, raw_payload, qos, received_at, _) in enumerate(records, first)
+        ]
+
+    messages = []
+    received = []
+    owners = []
+    topic_counts = {}
+    # Readings are collected as columns per device, ready for the stores' bulk appends
+    readings = {}
+    sensor_delays = []
+    rejected_times = 0
+    seq_gaps = 0
+    max_skew = int(DEVICE_CLOCK_SKEW_S * NS_PER_S)
+    debug = logger.isEnabledFor(logging.DEBUG)
+    validate = reading_schema.validate
+    # Only this thread assigns sequence numbers; message_seq itself moves under the lock
+    next_seq = message_seq
+    for index, (topic, raw_payload, _qos, received_at, seq) in enumerate(records):
+        try:
+            payload = json_loads(raw_payload)
+            reason = None
+        except ValueError:
+            payload = raw_payload.decode(errors="replace")
+            reason = "json"
+            DECODE_FAILURES.labels("json").inc()
+        device_id = resolve_device_id(topic)
+        values = None
+        if device_id is not None:
+            if reason is None:
+                values, reason = validate(payload)
+            if reason is None and duplicate_filter.seen(
+                device_id, payload.get(DEVICE_SEQ_FIELD), DEVICE_TIME_FIELD in payload, raw_payload, received_at
+            ):
+                reason = "duplicate"
+            if reason is not None:
+                _reject(reason, topic, raw_payload, received_at)
+                continue
+        next_seq = next_seq + 1 if seq is None else seq
+        messages.append(
+            {
+                "seq": next_seq,
+                "timestamp": received_at,
+                "topic": topic,
+                "device": device_id,
+                "payload": payload,
+            }
+        )
+        received.append(received_at)
+        owners.append(own is None or own[index])
+        topic_counts[topic] = topic_counts.get(topic, 0) + 1
+
+        if values is None:
+            continue
+        sent_at = payload.get(DEVICE_TIME_FIELD)
+        if sent_at is not None:
+            sent_at = device_time_ns(sent_at)
+            if sent_at is None or abs(received_at - sent_at) > max_skew:
+                rejected_times += 1
+            else:
+                sensor_delays.append((received_at - sent_at) / NS_PER_S)
+        counter = payload.get(DEVICE_SEQ_FIELD)
+        if type(counter) is int:
+            last = _device_seqs.get(device_id)
+            if last is not None and counter > last + 1:
+                seq_gaps += counter - last - 1
+            # A lower counter means the device restarted
+            _device_seqs[device_id] = counter
+        temperature, humidity = values
+        columns = readings.get(device_id)
+        if columns is None:
+            columns = readings[device_id] = ([], [], [])
+        columns[0].append(received_at)
+        columns[1].append(temperature)
+        columns[2].append(humidity)
+        if debug:
+            logger.debug("✓ Data received - Temp: %s°C, Humidity: %s%%", temperature, humidity)
+
+    waiting = time.perf_counter()
+    with data_lock:
+        acquired = time.perf_counter()
+        message_log.extend(messages)
+        message_seq = next_seq
+    released = time.perf_counter()
+    LOCK_WAIT_SECONDS.labels("ingest").observe(acquired - waiting)
+    LOCK_HOLD_SECONDS.labels("ingest").observe(released - acquired)
+
+    for device_id, (timestamps, temperatures, humidities) in readings.items():
+        _store_readings(device_id, timestamps, {"temperature": temperatures, "humidity": humidities})
+
+    if alert_engine.rules:
+        for message, received_at, owner in zip(messages, received, owners):
+            if isinstance(message["payload"], dict):
+                for event in alert_engine.evaluate(
+                    message["topic"], message["device"], message["payload"], received_at / NS_PER_S
+                ):
+                    _announce_alert(event, publish=owner)
+
+    if broadcaster.subscriber_count and messages:
+        broadcaster.publish(messages[-1])
+    watched = {topic for topic in topic_counts if command_dispatcher.watches(topic)}
+    if watched:
+        for topic, raw_payload, *_ in records:
+            if topic in watched:
+                command_dispatcher.observe(topic, raw_payload)
+
+    now = time.time_ns()
+    for topic, count in topic_counts.items():
+        MESSAGES_RECEIVED.labels(topic).inc(count)
+    INGEST_LATENCY_SECONDS.observe_many([(now - received_at) / NS_PER_S for received_at in received])
+    if sensor_delays:
+        SENSOR_LATENCY_SECONDS.observe_many(sensor_delays)
+    if rejected_times:
+        DEVICE_TIMES_REJECTED.inc(rejected_times)
+    if seq_gaps:
+        DEVICE_SEQ_GAPS.inc(seq_gaps)
+    INGEST_BATCH_SIZE_HIST.observe(len(records))
+
+
+def _store_readings(device_id, timestamps, columns):
+    """Apply one device's readings, oldest first, to its store and to the durable history."""
+    device_store.extend_columns(device_id, timestamps, **columns)
+    if history_store is not None and not history_store.readonly:
+        names = tuple(columns)
+        for timestamp, *values in zip(timestamps, *columns.values()):
+            history_store.append(device_id, timestamp, **dict(zip(names, values)))
+
+
+def _publish_replica_state(payload):
+    """Send a state message to the other replicas (and, through the broker, to this one)."""
+    connection.publish(f"{REPLICA_TOPIC}/{REPLICA_ID}", payload, qos=MQTT_QOS)
+
+
+def _start_replica_sync():
+    """Start exchanging messages with the other replicas in MQTT_SHARE_GROUP.
+
+    Only a process connected to the broker takes part; in ingest mode it
+    writes the merged stream to the shared log, so readers follow it as is.
+    """
+    global replica_sync
+    if not MQTT_SHARE_GROUP or replica_sync is not None:
+        return
+    replica_sync = ReplicaSync(
+        _apply_batch,
+        publish=_publish_replica_state,
+        interval_s=REPLICA_SYNC_INTERVAL_MS / 1000,
+        delay_s=REPLICA_MERGE_DELAY_MS / 1000,
+    )
+    replica_sync.start()
+    logger.info("✓ Sharing subscriptions in group %s as replica %s", MQTT_SHARE_GROUP, REPLICA_ID)
+
+
+def _reject(reason, topic, raw_payload, received_at):
+    """Count a rejected sensor message, logging the ones reject_sampler keeps."""
+    sample = reject_sampler.reject(reason, topic, raw_payload, received_at)
+    if sample is not None:
+        logger.warning("✗ Rejected message on %s (%s): %s", topic, reason, sample["payload"])
+
+
+def _announce_alert(event, publish=True):
+    """Log an alert state change and, with ``publish`` and unless this is a reader, publish it to ALERT_TOPIC."""
+    if event["state"] == "firing":
+        logger.warning(
+            "✗ Alert %s firing on %s: %s %s (%s %s)",
+            event["rule"],
+            event["device"],
+            event["field"],
+            event["value"],
+            event["kind"],
+            event["threshold"],
+        )
+    else:
+        logger.info("✓ Alert %s resolved on %s", event["rule"], event["device"])
+    if publish and INGEST_MODE != "reader":
+        publish_message(ALERT_TOPIC, json.dumps(event))
+
+
+def format_payload(payload):
+    """Return the text shown for a message payload in the feed."""
+    if isinstance(payload, dict):
+        return json.dumps(payload, indent=2, ensure_ascii=False)
+    return str(payload)
+
+
+def get_payload_text(message):
+    """Return the feed text of a logged message, formatted once on first view rather than per viewer.
+
+    Formatting lazily keeps ingest cheap when messages arrive faster than
+    anyone can see them.
+    """
+    text = payload_texts.get(message["seq"])
+    if text is None:
+        text = format_payload(message.get("payload"))
+        payload_texts.put(message["seq"], text)
+    return text
+
+
+def ingest_message(topic, raw_payload, qos=0, received_at=None, seq=None):
+    """Synchronously ingest a single raw MQTT message received at ``received_at`` epoch nanoseconds."""
+    received_at = time.time_ns() if received_at is None else received_at
+    ingest_batch([(topic, raw_payload, qos, received_at, seq)])
+
+
+ingest_worker = BatchWorker(ingest_batch, max_batch=INGEST_BATCH_SIZE, name="mqtt-ingest")
+
+
+def _buffer_fill():
+    yield ("message_log",), len(message_log) / message_log.maxlen
+    for shard in device_store.shards():
+        yield (f"device:{shard.device_id}",), len(shard.buffer) / shard.buffer.capacity
+
+
+Gauge("buffer_fill_ratio", "Fill level of the message log and each device buffer", _buffer_fill, ("buffer",))
+Gauge("buffer_bytes", "Memory held by device reading buffers", lambda: [((), device_store.nbytes)])
+Gauge("ingest_queue_depth", "Messages waiting for the ingest worker", lambda: [((), ingest_worker.pending)])
+Gauge("command_queue_depth", "Topics with a command waiting to be sent", lambda: [((), command_dispatcher.pending)])
+Gauge(
+    "mqtt_connected",
+    "1 while the broker connection is up",
+    lambda: [((manager.name,), int(manager.connected)) for manager in connections],
+    ("broker",),
+)
+Gauge(
+    "mqtt_offline_buffer_depth",
+    "QoS 0 publishes waiting for the connection",
+    lambda: [((), connection.offline_pending if connection else 0)],
+)
+Gauge("alerts_firing", "Alerts currently firing", lambda: [((), len(alert_engine.firing()))])
+Gauge("push_subscribers", "Connected Server-Sent Events clients", lambda: [((), broadcaster.subscriber_count)])
 
 
 def on_subscribe(client, userdata, mid, granted_qos):
     """Callback when subscription is confirmed."""
-    print(f"✓ Subscription confirmed with QoS: {granted_qos}")
+    logger.info("✓ Subscription confirmed with QoS: %s", granted_qos)
 
 
 def on_unsubscribe(client, userdata, mid):
     """Callback when unsubscription is confirmed."""
-    print("✓ Unsubscribed from topic")
+    logger.info("✓ Unsubscribed from topic")
 
 
-def create_mqtt_client():
-    """Create and configure MQTT client."""
-    client = mqtt.Client(client_id=MQTT_CLIENT_ID)
+def create_mqtt_client(broker=None, client_id=MQTT_CLIENT_ID):
+    """Create and configure MQTT client for one entry of BROKERS (the primary by default)."""
+    broker = broker or BROKERS[0]
+    # paho requires a client ID to resume a persistent session
+    client = mqtt.Client(client_id=client_id, clean_session=MQTT_CLEAN_SESSION or not client_id)
 
-    if MQTT_USERNAME and MQTT_PASSWORD:
-        client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+    if broker["username"] and broker["password"]:
+        client.username_pw_set(broker["username"], broker["password"])
     
     client.on_connect = on_connect
     client.on_disconnect = on_disconnect
     client.on_message = on_message
+    # Message IDs are per client, so only the primary's acknowledgements reach the dispatcher
+    if broker["primary"]:
+        client.on_publish = on_publish
     client.on_subscribe = on_subscribe
     client.on_unsubscribe = on_unsubscribe
     
     return client
 
 
+def warm_from_history():
+    """Fill the in-memory device buffers, rollups and statistics from the tail of the durable store."""
+    if history_store is None:
+        return 0
+
+    # Enough readings for the buffer and for every rolling statistics window
+    count = max((MAX_DATA_POINTS,) + STATS_ROLLING_WINDOWS)
+    loaded = 0
+    for device_id in history_store.devices():
+        records = history_store.tail(device_id, count)
+        if not len(records):
+            continue
+        shard = device_store.shard(device_id)
+        columns = {name: records[name] for name in device_store.fields}
+        with shard.lock:
+            shard.buffer.extend(records["timestamp"], **columns)
+            shard.rollups.extend(records["timestamp"], **columns)
+            if shard.stats is not None:
+                shard.stats.extend(**columns)
+            shard.last_seen = int(records["timestamp"][-1]) / NS_PER_S
+        loaded += len(records)
+    logger.info("✓ Loaded %d readings from %s", loaded, TSDB_DIR)
+    return loaded
+
+
+def _follow_shared_log():
+    """Reader mode: replay the ingest process's shared log into the local stores."""
+    global shared_log, message_epoch
+    cursor = 0
+    generation = None
+    last_check = 0.0
+    poll_interval = SHM_POLL_INTERVAL_MS / 1000
+
+    while True:
+        now = time.monotonic()
+        if shared_log is None or now - last_check > 1.0:
+            last_check = now
+            # Re-attach if the ingest process has (re)created the log
+            try:
+                candidate = SharedMessageLog.attach(SHM_NAME)
+            except FileNotFoundError:
+                candidate = None
+            if candidate is not None and candidate.generation != generation:
+                if shared_log is not None:
+                    shared_log.close()
+                shared_log, generation, cursor = candidate, candidate.generation, 0
+                with data_lock:
+                    message_log.clear()
+                    message_epoch += 1
+                # Sequence numbers restart with the new log
+                payload_texts.clear()
+                logger.info("✓ Following shared message log %s", SHM_NAME)
+            elif candidate is not None:
+                candidate.close()
+
+        if shared_log is None:
+            time.sleep(1.0)
+            continue
+
+        records, cursor = shared_log.read_since(cursor, limit=INGEST_BATCH_SIZE)
+        if records:
+            batch = []
+            for seq, data in records:
+                topic, payload, qos, received_at = decode_record(data)
+                batch.append((topic, payload, qos, received_at, seq))
+            ingest_batch(batch)
+        else:
+            time.sleep(poll_interval)
+
+
+def _serve_publish_commands():
+    """Ingest mode: publish messages forwarded by reader processes."""
+    if os.path.exists(INGEST_COMMAND_SOCKET):
+        os.remove(INGEST_COMMAND_SOCKET)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    server.bind(INGEST_COMMAND_SOCKET)
+    while True:
+        data = server.recv(65536)
+        try:
+            command = json.loads(data)
+            send_command(command["topic"], command["payload"], command.get("qos"))
+        except (ValueError, KeyError) as e:
+            logger.warning("✗ Invalid publish command: %s", e)
+
+
+def start_local_ingest():
+    """Prepare this process to ingest messages: the shared log in ingest mode and the history store.
+
+    start_mqtt_connection calls this before connecting; the replayer calls
+    it on its own, since it feeds ingest_batch without a broker.
+    """
+    global shared_log
+    if INGEST_MODE == "ingest":
+        shared_log = SharedMessageLog.create(SHM_NAME, SHM_SLOTS, SHM_SLOT_SIZE)
+        logger.info("✓ Ingest mode: publishing to shared message log %s", SHM_NAME)
+
+    if history_store is not None:
+        warm_from_history()
+        history_store.start()
+    _start_replica_sync()
+
+
 def start_mqtt_connection():
-    """Start MQTT connection in a separate thread."""
-    global mqtt_client
-    client = create_mqtt_client()
-    broker_host = _normalize_broker(MQTT_BROKER)
-    
-    try:
-        print(f"🔗 Connecting to {broker_host}:{MQTT_PORT}...")
-        client.connect(broker_host, MQTT_PORT, keepalive=MQTT_KEEPALIVE)
-        client.loop_start()
-        print("✓ MQTT loop started")
-        mqtt_client = client
-        return client
-    except Exception as e:
-        print(f"✗ Failed to connect to MQTT broker: {e}")
+    """Connect to every broker in BROKERS; connections keep reconnecting in the background."""
+    global mqtt_client, connection, ingest_engine
+    if INGEST_MODE == "reader":
+        threading.Thread(target=_follow_shared_log, name="shared-log-reader", daemon=True).start()
+        logger.info("✓ Reader mode: following the ingest process")
         return None
 
+    start_local_ingest()
+    if INGEST_MODE == "ingest":
+        threading.Thread(target=_serve_publish_commands, name="publish-commands", daemon=True).start()
+    manager_class = AsyncConnection if INGEST_ENGINE == "asyncio" else ConnectionManager
+    for index, broker in enumerate(BROKERS):
+        # Distinct IDs so two entries for the same broker do not take over each other's session
+        client = create_mqtt_client(broker, MQTT_CLIENT_ID if index == 0 else f"{MQTT_CLIENT_ID}-{index}")
+        manager = manager_class(
+            client,
+            broker["host"],
+            broker["port"],
+            keepalive=MQTT_KEEPALIVE,
+            min_backoff_s=MQTT_RECONNECT_MIN_S,
+            max_backoff_s=MQTT_RECONNECT_MAX_S,
+            offline_buffer=MQTT_OFFLINE_BUFFER,
+        )
+        client.user_data_set({**broker, "connection": manager})
+        connections.append(manager)
+        logger.info("🔗 Connecting to %s...", manager.name)
 
-def get_sensor_data():
-    """Get current sensor data in a thread-safe manner."""
-    with data_lock:
-        return {
-            "temperature": list(sensor_data["temperature"]),
-            "humidity": list(sensor_data["humidity"]),
-            "timestamps": list(sensor_data["timestamps"]),
-        }
+    # Publishes made before the first CONNACK are buffered, so the client is usable at once
+    connection = connections[0]
+    connection.on_flushed = command_dispatcher.delivered
+    mqtt_client = connection.client
+    if INGEST_ENGINE == "asyncio":
+        ingest_engine = AsyncIngestEngine(connections)
+        ingest_engine.start()
+    else:
+        for manager in connections:
+            manager.start()
+    return mqtt_client
 
 
-def get_latest_reading():
-    """Get the latest sensor reading."""
-    with data_lock:
-        if sensor_data["temperature"]:
-            return {
-                "temperature": sensor_data["temperature"][-1],
-                "humidity": sensor_data["humidity"][-1],
-                "timestamp": sensor_data["timestamps"][-1],
+def stop_mqtt_connection():
+    """Disconnect from every broker and stop the network threads."""
+    if ingest_engine is not None:
+        ingest_engine.stop()
+    else:
+        for manager in connections:
+            manager.stop()
+
+
+def _ns(seconds):
+    """Convert optional epoch seconds, as the query functions take them, to epoch nanoseconds."""
+    return None if seconds is None else int(seconds * NS_PER_S)
+
+
+def _empty_series():
+    series = {"timestamps": np.empty(0, dtype=np.int64)}
+    for name in device_store.fields:
+        series[name] = np.empty(0, dtype=np.float32)
+    return series
+
+
+def get_device_data(device_id, window=None, start=None, end=None):
+    """Get one device's readings in a thread-safe manner.
+
+    Returns numpy array copies of the last ``window`` readings, or of the
+    readings received between the ``start`` and ``end`` epoch seconds.
+    Timestamps are int64 epoch nanoseconds.
+    """
+    shard = device_store.get(device_id)
+    if shard is None:
+        return _empty_series()
+
+    with shard.lock:
+        if start is not None or end is not None:
+            views = shard.buffer.between(_ns(start), _ns(end))
+        else:
+            views = shard.buffer.window(window)
+        return {name: view.copy() for name, view in views.items()}
+
+
+def get_readings_since(device_id, cursor=None, limit=None):
+    """Get copies of up to the newest ``limit`` readings received after ``cursor`` epoch nanoseconds.
+
+    Made for incremental consumers such as the live charts, which pass the
+    last timestamp they were given and receive only what is new. Without a
+    ``cursor``, the newest ``limit`` readings are read from the durable
+    history when there is one, since it reaches back further than the
+    in-memory buffer.
+    """
+    if cursor is None and limit and history_store is not None:
+        records = history_store.tail(device_id, limit)
+        if len(records):
+            series = {"timestamps": np.array(records["timestamp"])}
+            series.update((name, np.array(records[name])) for name in device_store.fields)
+            # Readings still queued for the history writer come from the buffer next time
+            return series
+
+    shard = device_store.get(device_id)
+    if shard is None:
+        return _empty_series()
+    with shard.lock:
+        views = shard.buffer.between(None if cursor is None else cursor + 1, None)
+        if limit:
+            views = {name: view[-limit:] for name, view in views.items()}
+        return {name: view.copy() for name, view in views.items()}
+
+
+def get_sensor_data(window=None, start=None, end=None):
+    """Get the default device's sensor data in a thread-safe manner."""
+    return get_device_data(DEFAULT_DEVICE_ID, window=window, start=start, end=end)
+
+
+def get_stats(window=None, device_id=None):
+    """Return rolling min/max/mean/stddev/EMAs of each field over the last ``window`` readings.
+
+    ``window`` must be one of ``STATS_WINDOWS`` (None for the whole buffer,
+    ``MAX_DATA_POINTS``). The rolling windows are maintained as readings
+    arrive, so they cost the same whatever their size; the whole buffer is
+    summarised from the device's ring buffer on each call. Returns
+    ``{"window", "device_id", "fields": {field: stats}}``.
+    """
+    window = MAX_DATA_POINTS if window is None else window
+    if window not in STATS_WINDOWS:
+        raise ValueError(f"no rolling statistics over {window} readings; choose one of {STATS_WINDOWS}")
+    device_id = DEFAULT_DEVICE_ID if device_id is None else device_id
+    shard = device_store.get(device_id)
+    if shard is None:
+        fields = {}
+    else:
+        with shard.lock:
+            if window in STATS_ROLLING_WINDOWS:
+                fields = shard.stats.summary(window)
+            else:
+                fields = shard.stats.summary(window, shard.buffer.window())
+    return {"window": window, "device_id": device_id, "fields": fields}
+
+
+def get_devices(active_within=None):
+    """List known devices, optionally only those seen in the last ``active_within`` seconds."""
+    cutoff = None if active_within is None else time.time() - active_within
+    devices = []
+    for shard in device_store.shards():
+        last_seen = shard.last_seen
+        if cutoff is not None and (last_seen is None or last_seen < cutoff):
+            continue
+        devices.append(
+            {
+                "device_id": shard.device_id,
+                "last_seen": last_seen,
+                "points": len(shard.buffer),
+            }
+        )
+    return sorted(devices, key=lambda device: device["device_id"])
+
+
+def get_history(device_id, start=None, end=None):
+    """Get a device's durable history between ``start`` and ``end`` epoch seconds.
+
+    Falls back to the in-memory buffer when persistence is disabled.
+    """
+    if history_store is None:
+        return get_device_data(device_id, start=start, end=end)
+
+    records = history_store.query(device_id, _ns(start), _ns(end))
+    series = {"timestamps": np.asarray(records["timestamp"])}
+    for name in device_store.fields:
+        series[name] = np.asarray(records[name])
+    return series
+
+
+def iter_readings(device_ids=None, start=None, end=None, chunk_rows=None):
+    """Yield ``(device_id, columns)`` chunks of readings received from ``start`` up to ``end`` epoch seconds.
+
+    Each chunk holds at most ``chunk_rows`` rows (``EXPORT_CHUNK_ROWS`` by
+    default) as numpy column copies, so a consumer needs constant memory
+    however much is read. Durable history is read from its memory-mapped
+    segments; the in-memory buffer is read one chunk per lock acquisition,
+    so ingest is never blocked for the length of the whole read.
+    ``device_ids`` defaults to every known device. Timestamps are int64
+    epoch nanoseconds.
+    """
+    chunk_rows = chunk_rows or EXPORT_CHUNK_ROWS
+    start, end = _ns(start), _ns(end)
+    if device_ids is None:
+        device_ids = history_store.devices() if history_store is not None else [d["device_id"] for d in get_devices()]
+
+    for device_id in device_ids:
+        if history_store is not None:
+            for records in history_store.iter_range(device_id, start, end):
+                for offset in range(0, len(records), chunk_rows):
+                    part = records[offset : offset + chunk_rows]
+                    columns = {"timestamps": np.array(part["timestamp"])}
+                    columns.update((name, np.array(part[name])) for name in device_store.fields)
+                    yield device_id, columns
+            continue
+
+        shard = device_store.get(device_id)
+        if shard is None:
+            continue
+        # Resume after the last timestamp sent, skipping the rows already sent with it
+        cursor, skip = start, 0
+        while True:
+            with shard.lock:
+                views = shard.buffer.between(cursor, end)
+                columns = {name: view[skip : skip + chunk_rows].copy() for name, view in views.items()}
+            stamps = columns["timestamps"]
+            if len(stamps):
+                yield device_id, columns
+            if len(stamps) < chunk_rows:
+                break
+            last = stamps[-1]
+            repeated = int(np.count_nonzero(stamps == last))
+            skip = skip + repeated if last == cursor else repeated
+            cursor = last
+
+
+def get_series(device_id, field="temperature", start=None, end=None, width=1000):
+    """Get a chart-ready series for ``field`` between ``start`` and ``end`` epoch seconds.
+
+    Picks the finest source that covers the span without exceeding
+    ``SERIES_POINTS_PER_PIXEL * width`` points: raw readings first, then
+    the 1 s / 1 min / 1 h rollups. The result is reduced to at most
+    ``width`` points with LTTB, so its size is bounded whatever the span.
+    Returns ``resolution`` (0 for raw) and ``timestamps``/``mean``/``min``/``max``
+    arrays, with timestamps in epoch nanoseconds.
+    """
+    end = time.time() if end is None else end
+    start = end - 3600 if start is None else start
+    start_ns, end_ns = _ns(start), _ns(end)
+    budget = SERIES_POINTS_PER_PIXEL * width
+    shard = device_store.get(device_id)
+    if shard is None:
+        empty = np.empty(0)
+        return {"resolution": 0, "timestamps": empty, "mean": empty, "min": empty, "max": empty}
+
+    with shard.lock:
+        buffer = shard.buffer
+        raw = buffer.between(start_ns, end_ns)
+        oldest = buffer.window(len(buffer))["timestamps"][:1]
+        covers = len(buffer) < buffer.capacity or (len(oldest) and oldest[0] <= start_ns)
+        if len(raw["timestamps"]) <= budget and covers:
+            values = raw[field].astype(np.float64)
+            series = {
+                "resolution": 0,
+                "timestamps": raw["timestamps"].copy(),
+                "mean": values,
+                "min": values,
+                "max": values,
             }
+        else:
+            levels = shard.rollups.levels
+            level = next(
+                (
+                    level
+                    for level in levels
+                    if (end - start) / level.resolution <= budget
+                    and (not level.full or level.oldest <= start_ns)
+                ),
+                levels[-1],
+            )
+            series = level.range(field, start_ns, end_ns)
+            series["resolution"] = level.resolution
+
+    keep = lttb(series["timestamps"], series["mean"], width)
+    if len(keep) < len(series["timestamps"]):
+        for name in ("timestamps", "mean", "min", "max"):
+            series[name] = series[name][keep]
+    series.pop("count", None)
+    return series
+
+
+def get_latest_reading(device_id=None):
+    """Get the latest sensor reading for a device (the default device if None)."""
+    shard = device_store.get(DEFAULT_DEVICE_ID if device_id is None else device_id)
+    latest = None
+    if shard is not None:
+        with shard.lock:
+            latest = shard.buffer.latest()
+    if latest is not None:
+        return {
+            "temperature": latest["temperature"],
+            "humidity": latest["humidity"],
+            "timestamp": format_clock(latest["timestamp"]),
+        }
     return {"temperature": 0, "humidity": 0, "timestamp": "N/A"}
 
 
+def get_buffer_footprint():
+    """Return the memory footprint of all device buffers in bytes."""
+    return device_store.nbytes
+
+
 def get_recent_messages(limit=None):
     """Return recent MQTT messages as a list of dicts."""
     with data_lock:
-        messages = list(message_log)
+        if limit is None:
+            return list(message_log)
+        return message_log.tail(limit)
+
+
+def get_message_cursor():
+    """Return the sequence number of the newest logged message (0 if none)."""
+    return message_seq
+
+
+def get_message_version():
+    """Return a key that changes whenever the message log changes."""
+    return message_epoch, message_seq
 
-    if limit is not None:
-        return messages[-limit:]
+
+def get_messages_since(cursor):
+    """Return logged messages with a sequence number greater than ``cursor``, oldest first.
+
+    Only walks the new tail of the log. If the log has wrapped past ``cursor``
+    the result starts at the oldest retained message.
+    """
+    waiting = time.perf_counter()
+    with data_lock:
+        acquired = time.perf_counter()
+        if message_seq <= cursor:
+            messages = []
+        else:
+            messages = message_log.since(cursor)
+    LOCK_WAIT_SECONDS.labels("read").observe(acquired - waiting)
+    LOCK_HOLD_SECONDS.labels("read").observe(time.perf_counter() - acquired)
     return messages
 
 
+def get_message_page(offset=0, limit=50, topic=None, until=None):
+    """Return one page of the message log, newest first, for browsing.
+
+    ``offset`` counts back from the newest message with ``seq <= until``;
+    clients pass the ``until`` of their first page so later pages do not
+    shift as messages arrive. ``topic`` restricts the page to one topic.
+    Returns ``{"total", "offset", "until", "messages"}``.
+    """
+    waiting = time.perf_counter()
+    with data_lock:
+        acquired = time.perf_counter()
+        if until is None:
+            until = message_seq
+        total, messages = message_log.page(offset, limit, topic=topic, until=until)
+    LOCK_WAIT_SECONDS.labels("read").observe(acquired - waiting)
+    LOCK_HOLD_SECONDS.labels("read").observe(time.perf_counter() - acquired)
+    return {"total": total, "offset": offset, "until": until, "messages": messages}
+
+
+def get_alerts(limit=20):
+    """Return the firing alerts and the newest alert events, with a version that changes with them."""
+    return {
+        "version": alert_engine.version,
+        "rules": len(alert_engine.rules),
+        "firing": alert_engine.firing(),
+        "recent": alert_engine.recent(limit),
+    }
+
+
+def get_rejected(limit=20):
+    """Return rejected sensor message counts by reason and the newest kept samples."""
+    return {"counts": reject_sampler.counts(), "samples": reject_sampler.samples(limit)}
+
+
+def get_message_topics():
+    """Return ``{topic: retained message count}`` for the message log."""
+    with data_lock:
+        return message_log.topics()
+
+
 def publish_message(topic, payload, qos=None):
     """Publish a message to MQTT topic."""
     global mqtt_client
+    if INGEST_MODE == "reader":
+        return _forward_publish(topic, payload, qos)
+
     if mqtt_client is None:
-        print("✗ MQTT client not connected")
+        PUBLISHES.labels("not_connected").inc()
+        logger.warning("✗ MQTT client not connected")
         return False
 
     try:
         qos_to_use = qos if qos is not None else MQTT_QOS
-        mqtt_client.publish(topic, payload, qos=qos_to_use)
-        print(f"✓ Published to {topic}: {payload}")
+        info = connection.publish(topic, payload, qos=qos_to_use)
+        if info is None or info.rc == mqtt.MQTT_ERR_NO_CONN:
+            PUBLISHES.labels("buffered").inc()
+            logger.info("✓ Buffered publish to %s until the broker is back", topic)
+            return True
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            raise ConnectionError(mqtt.error_string(info.rc))
+        PUBLISHES.labels("success").inc()
+        logger.info("✓ Published to %s: %s", topic, payload)
         return True
     except Exception as e:
-        print(f"✗ Failed to publish: {e}")
+        PUBLISHES.labels("failure").inc()
+        logger.error("✗ Failed to publish: %s", e)
+        return False
+
+
+def _forward_publish(topic, payload, qos=None):
+    """Reader mode: hand a publish to the ingest process over its command socket."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            sender.sendto(
+                json.dumps({"topic": topic, "payload": payload, "qos": qos}).encode(),
+                INGEST_COMMAND_SOCKET,
+            )
+        PUBLISHES.labels("forwarded").inc()
+        logger.info("✓ Forwarded publish to %s via ingest process", topic)
+        return True
+    except OSError as e:
+        PUBLISHES.labels("failure").inc()
+        logger.error("✗ Failed to forward publish: %s", e)
         return False
+
+
+def _publish_command(topic, payload, qos):
+    """Send one dispatcher command and return the message ID whose PUBACK confirms it.
+
+    Reader processes forward the command to the ingest process and return
+    None; the command is confirmed when it comes back on the subscription.
+    A QoS 0 command made while offline returns BUFFERED and is confirmed
+    when the connection flushes it.
+    """
+    if INGEST_MODE == "reader":
+        if not _forward_publish(topic, payload, qos):
+            raise ConnectionError("ingest process is not reachable")
+        return None
+
+    if mqtt_client is None:
+        PUBLISHES.labels("not_connected").inc()
+        raise ConnectionError("MQTT client not connected")
+
+    info = connection.publish(topic, payload, qos=qos)
+    if info is None:
+        # Buffered while offline; the primary connection reports it to the dispatcher once sent
+        PUBLISHES.labels("buffered").inc()
+        return BUFFERED
+    # While disconnected paho keeps QoS > 0 messages and sends them on reconnect
+    if info.rc != mqtt.MQTT_ERR_SUCCESS and not (info.rc == mqtt.MQTT_ERR_NO_CONN and qos > 0):
+        PUBLISHES.labels("failure").inc()
+        raise ConnectionError(mqtt.error_string(info.rc))
+    PUBLISHES.labels("success").inc()
+    logger.info("✓ Published command to %s: %s", topic, payload)
+    return info.mid
+
+
+command_dispatcher = CommandDispatcher(
+    _publish_command,
+    max_pending=COMMAND_QUEUE_SIZE,
+    ack_timeout_s=COMMAND_ACK_TIMEOUT_S,
+    confirm_by_echo=INGEST_MODE == "reader",
+)
+
+
+def send_command(topic, payload, qos=None):
+    """Queue a command without blocking; newer commands to the same topic replace unsent ones.
+
+    Returns False when the outbound queue is full. Use get_command_status to
+    follow it.
+    """
+    return command_dispatcher.submit(topic, payload, MQTT_QOS if qos is None else qos)
+
+
+def get_command_status(topic):
+    """Return the queued, in-flight and acknowledged command state for ``topic``."""
+    return command_dispatcher.status(topic)
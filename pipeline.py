@@ -0,0 +1,74 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWorker:
+    """Drain a queue on a background thread and hand items to ``handler`` in batches.
+
+    ``submit`` bumps a counter under a short lock and puts the item on a
+    ``SimpleQueue``, cheap enough for network callbacks and safe with
+    several producers. The worker blocks for the first item, then takes
+    whatever else is already queued (up to ``max_batch``), so batches grow
+    with load and latency stays low when idle.
+
+    The queue is unbounded: producers never block or drop, so a handler
+    that cannot keep up shows as a growing ``pending`` count and memory
+    use rather than as lost messages.
+    """
+
+    def __init__(self, handler, max_batch=512, name="batch-worker"):
+        self.handler = handler
+        self.max_batch = max_batch
+        self.name = name
+        self._queue = queue.SimpleQueue()
+        self.submitted = 0
+        self._submit_lock = threading.Lock()
+        self.processed = 0
+        self._idle = threading.Condition()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """Number of items submitted but not yet handled."""
+        return self.submitted - self.processed
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item):
+        # Counted before the put, so the worker can never handle an item that wait_idle does not wait for
+        with self._submit_lock:
+            self.submitted += 1
+        self._queue.put(item)
+        if self._thread is None:
+            self.start()
+
+    def wait_idle(self, timeout=None):
+        """Block until every submitted item has been handled. Returns False on timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self.processed >= self.submitted, timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.max_batch:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            try:
+                self.handler(batch)
+            except Exception:
+                logger.exception("✗ %s failed to handle a batch of %d items", self.name, len(batch))
+
+            with self._idle:
+                self.processed += len(batch)
+                self._idle.notify_all()
@@ -0,0 +1,107 @@
+import atexit
+import logging
+import mmap
+import os
+import struct
+
+from metrics import Counter
+from pipeline import BatchWorker
+from shm_log import RECORD, encode_record
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"IOTREC02"
+# Length of the encoded message that follows; the message is shm_log's record format
+LENGTH = struct.Struct("<I")
+# Recordings made before receive times were epoch nanoseconds stored float seconds
+MAGIC_V1 = b"IOTREC01"
+RECORD_V1 = struct.Struct("<dBH")
+
+RECORDED_MESSAGES = Counter("recorded_messages_total", "Raw MQTT messages appended to RECORD_FILE")
+
+
+class Recorder:
+    """Append raw MQTT messages to a recording file.
+
+    A recording is ``MAGIC`` followed by length-prefixed records of receive
+    time, QoS, topic and payload bytes exactly as they came off the wire.
+    ``record`` only queues the message, so it is safe to call from paho's
+    network thread; a background worker encodes each batch and appends it
+    with a single unbuffered write, so a crash loses at most that batch and
+    several processes can record into the same file. Opening an existing
+    recording appends to it.
+    """
+
+    def __init__(self, path, max_batch=4096):
+        self.path = path
+        self._file = open(path, "ab+", buffering=0)
+        self._file.seek(0)
+        magic = self._file.read(len(MAGIC))
+        if not magic:
+            self._file.write(MAGIC)
+        elif magic != MAGIC:
+            self._file.close()
+            if magic == MAGIC_V1:
+                raise ValueError(f"{path} is an older recording format; record into a new file")
+            raise ValueError(f"{path} is not a message recording")
+        self._worker = BatchWorker(self._write, max_batch=max_batch, name="recorder")
+        atexit.register(self.close)
+
+    def record(self, topic, payload, qos, received_at):
+        self._worker.submit((topic, payload, qos, received_at))
+
+    def _write(self, messages):
+        parts = []
+        for topic, payload, qos, received_at in messages:
+            data = encode_record(topic, payload, qos, received_at)
+            parts.append(LENGTH.pack(len(data)))
+            parts.append(data)
+        self._file.write(b"".join(parts))
+        RECORDED_MESSAGES.inc(len(messages))
+
+    def close(self):
+        """Write out queued messages and close the file."""
+        if self._file.closed:
+            return
+        self._worker.wait_idle(timeout=5)
+        self._file.close()
+
+
+def read_recording(path):
+    """Yield ``(topic, payload, qos, received_at)`` for every message in a recording, oldest first.
+
+    ``received_at`` is in epoch nanoseconds, also for older recordings that
+    stored seconds. The file is memory-mapped and decoded in place. A record
+    cut short by a crash while recording ends the replay with a warning.
+    """
+    with open(path, "rb") as handle:
+        if os.fstat(handle.fileno()).st_size <= len(MAGIC):
+            if handle.read(len(MAGIC)) not in (MAGIC, MAGIC_V1, b""):
+                raise ValueError(f"{path} is not a message recording")
+            return
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic = data[:len(MAGIC)]
+            if magic not in (MAGIC, MAGIC_V1):
+                raise ValueError(f"{path} is not a message recording")
+            record = RECORD if magic == MAGIC else RECORD_V1
+            legacy = magic == MAGIC_V1
+            unpack_length = LENGTH.unpack_from
+            unpack_record = record.unpack_from
+            header = LENGTH.size
+            fixed = record.size
+            position = len(MAGIC)
+            end = len(data)
+            while position < end:
+                start = position + header
+                if start <= end:
+                    (length,) = unpack_length(data, position)
+                    position = start + length
+                if start > end or position > end:
+                    logger.warning("✗ %s ends in a truncated record; stopping there", path)
+                    return
+                received_at, qos, topic_length = unpack_record(data, start)
+                if legacy:
+                    # Float seconds hold about a microsecond of precision at today's dates
+                    received_at = round(received_at * 1_000_000) * 1_000
+                topic_end = start + fixed + topic_length
+                yield data[start + fixed:topic_end].decode(errors="replace"), data[topic_end:position], qos, received_at
@@ -0,0 +1,140 @@
+"""Replay a message recording through the ingest path, without a broker.
+
+Record live traffic by running the dashboard or ingest.py with
+RECORD_FILE=traffic.rec, then:
+
+    python replay.py traffic.rec                # at the recorded pace
+    python replay.py traffic.rec --speed 10     # ten times faster
+    python replay.py traffic.rec --speed max    # as fast as ingest allows
+
+Messages are handed to mqtt_client.ingest_batch exactly as the ingest
+worker does with live ones, so the message log, device stores, alerts and
+history all see the replay. By default the replayer runs as the ingest
+process (INGEST_MODE=ingest), so dashboards started with INGEST_MODE=reader
+follow it live; stop ingest.py first, as both would own the shared log. Set
+INGEST_MODE=embedded to replay into this process only.
+
+Receive times keep their recorded spacing but are shifted so the recording
+starts now, unless --original-times is given.
+
+Duplicate suppression applies as it does live: a message the broker
+redelivered during recording is dropped again. The duplicate filter is
+cleared between --repeat passes, so each pass is stored in full.
+"""
+import argparse
+import logging
+import os
+import signal
+import threading
+import time
+
+os.environ.setdefault("INGEST_MODE", "ingest")
+# A replay is one source of messages with no broker to exchange replica state through
+os.environ["MQTT_SHARE_GROUP"] = ""
+
+import mqtt_client  # noqa: E402
+from logging_config import configure_logging  # noqa: E402
+from recording import read_recording  # noqa: E402
+from ring_buffer import NS_PER_S  # noqa: E402
+
+logger = logging.getLogger("replay")
+
+
+def replay(path, speed=1.0, batch_size=16384, repeat=1, original_times=False, stop=None):
+    """Feed a recording to ingest_batch and return the number of messages replayed.
+
+    ``speed`` scales the recorded gaps between messages (2 plays twice as
+    fast); None replays as fast as ingest allows. Messages that are due are
+    handed over in batches of up to ``batch_size``. Each of the ``repeat``
+    passes continues where the previous one's receive times ended.
+    """
+    stop = stop or threading.Event()
+    started = time.perf_counter()
+    replayed = 0
+    batch = []
+    first = start = last = None
+    offset = 0
+
+    def flush():
+        nonlocal batch, replayed
+        if batch:
+            mqtt_client.ingest_batch(batch)
+            replayed += len(batch)
+            batch = []
+
+    for _pass in range(repeat):
+        for topic, payload, qos, received_at in read_recording(path):
+            if first is None:
+                first = received_at
+                offset = 0 if original_times else time.time_ns() - received_at
+                start = received_at + offset
+            received_at += offset
+            if speed is not None:
+                ahead = (received_at - start) / NS_PER_S / speed - (time.perf_counter() - started)
+                if ahead > 0:
+                    # Hand over everything already due before waiting for the next message
+                    flush()
+                    if stop.wait(ahead):
+                        break
+            batch.append((topic, payload, qos, received_at, None))
+            last = received_at
+            if len(batch) >= batch_size:
+                flush()
+                if stop.is_set():
+                    break
+        if stop.is_set() or last is None:
+            break
+        # The next pass starts one second after this one ended and repeats every seq, so it must not
+        # be taken for a redelivery of the last one
+        offset = last + NS_PER_S - first
+        flush()
+        mqtt_client.duplicate_filter.clear()
+    flush()
+    return replayed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording", help="file written with RECORD_FILE")
+    parser.add_argument("--speed", default="1", help='1 for the recorded pace, N for N times faster, or "max"')
+    parser.add_argument("--batch", type=int, default=16384, help="most messages handed to ingest at once")
+    parser.add_argument("--repeat", type=int, default=1, help="play the recording this many times back to back")
+    parser.add_argument(
+        "--original-times", action="store_true", help="keep the recorded receive times instead of starting now"
+    )
+    args = parser.parse_args()
+    if args.speed == "max":
+        speed = None
+    else:
+        try:
+            speed = float(args.speed)
+        except ValueError:
+            speed = 0
+        if speed <= 0:
+            parser.error('--speed must be a positive number or "max"')
+    if mqtt_client.INGEST_MODE == "reader":
+        parser.error("replay feeds ingest itself; run it with INGEST_MODE=ingest or embedded")
+
+    configure_logging()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    mqtt_client.start_local_ingest()
+    logger.info("▶ Replaying %s at %s speed", args.recording, "max" if speed is None else f"{speed:g}x")
+    started = time.perf_counter()
+    try:
+        replayed = replay(args.recording, speed, args.batch, args.repeat, args.original_times, stop)
+    finally:
+        if mqtt_client.history_store is not None:
+            mqtt_client.history_store.close()
+        if mqtt_client.shared_log is not None:
+            mqtt_client.shared_log.close()
+    elapsed = time.perf_counter() - started
+    logger.info(
+        "✓ Replayed %d messages in %.2fs (%.0f msgs/s)", replayed, elapsed, replayed / elapsed if elapsed else 0
+    )
+
+
+if __name__ == "__main__":
+    main()
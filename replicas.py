@@ -0,0 +1,173 @@
+import logging
+import struct
+import threading
+import time
+
+from metrics import Counter
+from ring_buffer import NS_PER_S
+from shm_log import RECORD, decode_record, encode_record
+
+logger = logging.getLogger(__name__)
+
+# A state message is a run of messages, each a record length followed by a shared-log record
+# (receive time, QoS, topic and raw payload)
+LENGTH = struct.Struct("<I")
+
+REPLICA_MESSAGES = Counter("replica_messages_total", "Messages exchanged with other replicas", ("direction",))
+LATE_MESSAGES = Counter(
+    "replica_late_messages_total",
+    "Replica messages dropped because newer messages had already been applied",
+)
+INVALID_STATES = Counter("replica_invalid_states_total", "Replica state messages that could not be decoded")
+
+
+def share_subscription(topic, group):
+    """Return the MQTT shared subscription for ``topic`` in ``group``, or ``topic`` itself without a group."""
+    return f"$share/{group}/{topic}" if group else topic
+
+
+def encode_state(records, max_bytes):
+    """Pack ``(topic, payload, qos, received_at)`` records into state messages of about ``max_bytes`` each.
+
+    A message larger than ``max_bytes`` on its own is sent in a state
+    message of its own.
+    """
+    payloads = []
+    parts = []
+    size = 0
+    for topic, payload, qos, received_at in records:
+        record = encode_record(topic, payload, qos, received_at)
+        if parts and size + LENGTH.size + len(record) > max_bytes:
+            payloads.append(b"".join(parts))
+            parts = []
+            size = 0
+        parts.append(LENGTH.pack(len(record)))
+        parts.append(record)
+        size += LENGTH.size + len(record)
+    if parts:
+        payloads.append(b"".join(parts))
+    return payloads
+
+
+def decode_state(payload):
+    """Inverse of encode_state: return the list of ``(topic, payload, qos, received_at)`` records."""
+    records = []
+    position = 0
+    end = len(payload)
+    while position < end:
+        (length,) = LENGTH.unpack_from(payload, position)
+        position += LENGTH.size
+        if length < RECORD.size or position + length > end:
+            raise ValueError(f"truncated record of {length} bytes at offset {position}")
+        records.append(decode_record(bytes(payload[position:position + length])))
+        position += length
+    return records
+
+
+class ReplicaSync:
+    """Share the messages this replica accepted with the others and merge everyone's in time order.
+
+    With MQTT shared subscriptions each replica only receives its share of
+    the sensor messages. ``share`` collects the ones this replica accepted;
+    every ``interval_s`` they are sent to all replicas through ``publish``.
+    ``receive`` takes those state messages from every replica, this one
+    included, and ``hold`` adds messages only this replica should apply,
+    such as topics every replica subscribes to itself. Messages are handed
+    to ``apply(records, own)`` oldest first once they are ``delay_s`` old,
+    by which time the other replicas' messages from the same moment have
+    arrived. ``own`` tells, per record, whether this replica received it
+    from the broker. A message arriving after a newer one was applied is
+    dropped and counted, since the stores only move forward.
+
+    ``share``, ``hold`` and ``receive`` are called from the ingest thread;
+    ``flush`` runs on the sync thread, so ``apply`` always does.
+    """
+
+    def __init__(self, apply, publish=None, interval_s=0.25, delay_s=1.0, max_bytes=65536):
+        self.apply = apply
+        self.publish = publish
+        self.interval_s = interval_s
+        self.delay_ns = int(delay_s * NS_PER_S)
+        self.max_bytes = max_bytes
+        self._outbox = []
+        # (received_at, arrival, record, own); arrival keeps the sort stable for equal receive times
+        self._pending = []
+        self._arrivals = 0
+        # Newest receive time applied
+        self._applied = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def share(self, records):
+        """Queue ``(topic, payload, qos, received_at)`` records this replica accepted for the next state message."""
+        with self._lock:
+            self._outbox.extend(records)
+
+    def hold(self, records):
+        """Merge ``(topic, payload, qos, received_at)`` records into this replica's stream only."""
+        self._add(records, True)
+
+    def receive(self, payload, own=False):
+        """Take a state message from any replica; ``own`` marks the ones this replica sent."""
+        try:
+            records = decode_state(payload)
+        except (ValueError, struct.error) as e:
+            INVALID_STATES.inc()
+            logger.warning("✗ Invalid replica state: %s", e)
+            return
+        self._add(records, own)
+        REPLICA_MESSAGES.labels("received").inc(len(records))
+
+    def _add(self, records, own):
+        with self._lock:
+            for record in records:
+                self._pending.append((record[3], self._arrivals, record, own))
+                self._arrivals += 1
+
+    def flush(self, now=None):
+        """Send the queued messages, then apply every merged message that is due."""
+        with self._lock:
+            outbox, self._outbox = self._outbox, []
+        if outbox and self.publish is not None:
+            for payload in encode_state(outbox, self.max_bytes):
+                self.publish(payload)
+            REPLICA_MESSAGES.labels("sent").inc(len(outbox))
+
+        cutoff = (time.time_ns() if now is None else now) - self.delay_ns
+        with self._lock:
+            self._pending.sort()
+            due = 0
+            while due < len(self._pending) and self._pending[due][0] <= cutoff:
+                due += 1
+            ready, self._pending = self._pending[:due], self._pending[due:]
+        if not ready:
+            return
+        newest = self._applied
+        late = 0
+        if newest is not None:
+            while late < len(ready) and ready[late][0] < newest:
+                late += 1
+            if late:
+                LATE_MESSAGES.inc(late)
+                ready = ready[late:]
+        if ready:
+            self.apply([(*record, None) for _at, _n, record, _own in ready], [own for *_entry, own in ready])
+            self._applied = ready[-1][0]
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="replica-sync", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("✗ Replica sync failed")
@@ -0,0 +1,106 @@
+import numpy as np
+
+DEFAULT_FIELDS = ("temperature", "humidity")
+# Reading timestamps are int64 epoch nanoseconds
+NS_PER_S = 1_000_000_000
+
+
+class RingBuffer:
+    """Fixed-capacity columnar ring buffer backed by typed numpy arrays.
+
+    Readings are stored as float32 columns and timestamps as an int64 epoch
+    column. Every row is written twice, at ``i`` and ``i + capacity``, so the
+    most recent ``n`` rows always form one contiguous slice and can be handed
+    out as zero-copy views. A view of ``n`` rows stays valid for the next
+    ``capacity - n`` appends.
+
+    The buffer is not thread-safe; callers guard it with their own lock.
+    """
+
+    def __init__(self, capacity, fields=DEFAULT_FIELDS, field_dtype=np.float32, time_dtype=np.int64):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = int(capacity)
+        self.fields = tuple(fields)
+        self.timestamps = np.zeros(2 * self.capacity, dtype=time_dtype)
+        self._columns = {name: np.zeros(2 * self.capacity, dtype=field_dtype) for name in self.fields}
+        self._head = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        """Memory footprint of the backing arrays in bytes."""
+        return self.timestamps.nbytes + sum(column.nbytes for column in self._columns.values())
+
+    def append(self, timestamp, **values):
+        """Append one row in O(1). Missing fields are stored as NaN."""
+        head = self._head
+        mirror = head + self.capacity
+        self.timestamps[head] = self.timestamps[mirror] = timestamp
+        for name, column in self._columns.items():
+            column[head] = column[mirror] = values.get(name, np.nan)
+        self._head = (head + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+
+    def extend(self, timestamps, **columns):
+        """Append many rows at once. Only the last ``capacity`` rows are kept."""
+        timestamps = np.asarray(timestamps)
+        count = len(timestamps)
+        keep = min(count, self.capacity)
+        if not keep:
+            return
+        positions = (self._head + np.arange(keep)) % self.capacity
+        self.timestamps[positions] = self.timestamps[positions + self.capacity] = timestamps[count - keep:]
+        for name, column in self._columns.items():
+            values = columns.get(name)
+            values = np.nan if values is None else np.asarray(values)[count - keep:]
+            column[positions] = column[positions + self.capacity] = values
+        self._head = (self._head + keep) % self.capacity
+        self._size = min(self.capacity, self._size + keep)
+
+    def clear(self):
+        """Drop all rows without releasing the backing arrays."""
+        self._head = 0
+        self._size = 0
+
+    def _bounds(self, n=None):
+        n = self._size if n is None else max(0, min(int(n), self._size))
+        end = self._head + self.capacity
+        return end - n, end
+
+    def _view(self, start, stop):
+        result = {"timestamps": self.timestamps[start:stop]}
+        for name, column in self._columns.items():
+            result[name] = column[start:stop]
+        for array in result.values():
+            array.flags.writeable = False
+        return result
+
+    def window(self, n=None):
+        """Return read-only zero-copy views of the last ``n`` rows (all rows if None)."""
+        return self._view(*self._bounds(n))
+
+    def between(self, start=None, end=None):
+        """Return zero-copy views of rows with ``start <= timestamp < end``.
+
+        Relies on timestamps being appended in non-decreasing order.
+        """
+        lo, hi = self._bounds()
+        stamps = self.timestamps[lo:hi]
+        left = 0 if start is None else int(np.searchsorted(stamps, start, side="left"))
+        right = len(stamps) if end is None else int(np.searchsorted(stamps, end, side="left"))
+        return self._view(lo + left, lo + max(left, right))
+
+    def latest(self):
+        """Return the newest row as a dict of Python scalars, or None if empty."""
+        if not self._size:
+            return None
+        index = self._head + self.capacity - 1
+        row = {"timestamp": int(self.timestamps[index])}
+        for name, column in self._columns.items():
+            row[name] = float(column[index])
+        return row
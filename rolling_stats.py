@@ -0,0 +1,281 @@
+import math
+import operator
+from collections import deque
+
+import numpy as np
+
+from ring_buffer import DEFAULT_FIELDS
+
+
+def parse_counts(spec):
+    """Parse ``"60,600"`` into ``(60, 600)``, ignoring blanks."""
+    return tuple(sorted({int(item) for item in spec.split(",") if item.strip()}))
+
+
+def summarize(values):
+    """min/max/mean/stddev of the non-NaN ``values``, computed with numpy in one go."""
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    count = len(values)
+    if not count:
+        return {"count": 0, "min": None, "max": None, "mean": None, "stddev": None}
+    return {
+        "count": count,
+        "min": values.min().item(),
+        "max": values.max().item(),
+        "mean": values.mean().item(),
+        "stddev": values.std(ddof=1).item() if count > 1 else None,
+    }
+
+
+class SlidingWindow:
+    """min/max/mean/variance over the last ``size`` values, updated in O(1).
+
+    Min and max come from monotonic deques of ``(index, value)``: each value
+    is pushed and popped at most once, and the front is always the extreme
+    of the window. Mean and variance use Welford's update, extended to
+    replace the value that leaves the window. The window's values are kept
+    in a ring so the leaving value is known. ``extend`` applies a batch with
+    numpy: Chan's merge of the batch's mean and variance (and its inverse for
+    the values leaving), and only the batch's suffix extremes on the deques.
+    """
+
+    __slots__ = ("size", "count", "mean", "m2", "_values", "_index", "_minima", "_maxima")
+
+    def __init__(self, size):
+        if size <= 0:
+            raise ValueError("window size must be positive")
+        self.size = int(size)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self._values = [0.0] * self.size
+        self._index = 0
+        self._minima = deque()
+        self._maxima = deque()
+
+    def add(self, value):
+        index = self._index
+        size = self.size
+        slot = index % size
+        values = self._values
+        if self.count < size:
+            self.count = count = self.count + 1
+            delta = value - self.mean
+            self.mean += delta / count
+            self.m2 += delta * (value - self.mean)
+        else:
+            leaving = values[slot]
+            mean = self.mean
+            updated = mean + (value - leaving) / size
+            self.m2 += (value - leaving) * (value - updated + leaving - mean)
+            self.mean = updated
+        values[slot] = value
+        self._index = index + 1
+
+        expired = index - size
+        entry = (index, value)
+        minima = self._minima
+        while minima and minima[-1][1] >= value:
+            minima.pop()
+        minima.append(entry)
+        if minima[0][0] <= expired:
+            minima.popleft()
+        maxima = self._maxima
+        while maxima and maxima[-1][1] <= value:
+            maxima.pop()
+        maxima.append(entry)
+        if maxima[0][0] <= expired:
+            maxima.popleft()
+
+    def extend(self, values):
+        """Add a float64 array of values, oldest first."""
+        count = len(values)
+        if count < 2:
+            if count:
+                self.add(values[0].item())
+            return
+        index = self._index
+        size = self.size
+        indices = np.arange(index, index + count)
+
+        if count >= size:
+            tail = values[-size:]
+            self.count = size
+            self.mean = float(tail.mean())
+            self.m2 = float(np.square(tail - self.mean).sum())
+            self._store(index + count - size, tail.tolist())
+        else:
+            leaving = max(0, self.count + count - size)
+            if leaving:
+                # The oldest values sit in the last slots this batch overwrites
+                self._remove(np.array(self._load(index + count - leaving, leaving)))
+            self._merge(count, float(values.mean()), float(np.square(values - values.mean()).sum()))
+            self._store(index, values.tolist())
+        self._index = index + count
+
+        expired = index + count - 1 - size
+        if count >= size:
+            # Everything from before the batch has left the window
+            self._minima.clear()
+            self._maxima.clear()
+        for extremes, accumulate, better, beaten in (
+            (self._minima, np.minimum.accumulate, np.less, operator.ge),
+            (self._maxima, np.maximum.accumulate, np.greater, operator.le),
+        ):
+            # Only values beating everything after them in the batch can become extremes
+            suffix = accumulate(values[::-1])[::-1]
+            keep = np.empty(count, dtype=bool)
+            keep[-1] = True
+            better(values[:-1], suffix[1:], out=keep[:-1])
+            best = suffix[0].item()
+            while extremes and beaten(extremes[-1][1], best):
+                extremes.pop()
+            extremes.extend(zip(indices[keep].tolist(), values[keep].tolist()))
+            while extremes[0][0] <= expired:
+                extremes.popleft()
+
+    def _load(self, index, count):
+        start = index % self.size
+        end = start + count
+        if end <= self.size:
+            return self._values[start:end]
+        return self._values[start:] + self._values[:end - self.size]
+
+    def _store(self, index, items):
+        start = index % self.size
+        head = min(len(items), self.size - start)
+        self._values[start:start + head] = items[:head]
+        self._values[:len(items) - head] = items[head:]
+
+    def _merge(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def _remove(self, values):
+        count = len(values)
+        remaining = self.count - count
+        if remaining <= 0:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        mean = float(values.mean())
+        rest_mean = (self.count * self.mean - count * mean) / remaining
+        delta = rest_mean - mean
+        self.m2 -= float(np.square(values - mean).sum()) + delta * delta * count * remaining / self.count
+        self.mean = rest_mean
+        self.count = remaining
+
+    @property
+    def min(self):
+        return self._minima[0][1] if self._minima else None
+
+    @property
+    def max(self):
+        return self._maxima[0][1] if self._maxima else None
+
+    @property
+    def stddev(self):
+        """Sample standard deviation, or None with fewer than two values."""
+        if self.count < 2:
+            return None
+        # Replacing values can leave a tiny negative rounding residue
+        return math.sqrt(max(self.m2, 0.0) / (self.count - 1))
+
+
+class FieldStats:
+    """Sliding windows and exponential moving averages for one field."""
+
+    __slots__ = ("windows", "_window_list", "spans", "alphas", "emas", "latest")
+
+    def __init__(self, windows, ema_spans=()):
+        self.windows = {size: SlidingWindow(size) for size in windows}
+        self._window_list = list(self.windows.values())
+        self.spans = tuple(ema_spans)
+        # A span of n points weighs the newest value like an n-point moving average would
+        self.alphas = tuple(2.0 / (span + 1) for span in self.spans)
+        self.emas = [None] * len(self.spans)
+        self.latest = None
+
+    def add(self, value):
+        if value != value:
+            # NaN marks a missing field
+            return
+        for window in self._window_list:
+            window.add(value)
+        emas = self.emas
+        if emas:
+            self.emas = [
+                value if ema is None else ema + alpha * (value - ema) for ema, alpha in zip(emas, self.alphas)
+            ]
+        self.latest = value
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        for window in self._window_list:
+            window.extend(values)
+        emas = list(self.emas)
+        for position, alpha in enumerate(self.alphas):
+            ema, rest = emas[position], values
+            if ema is None:
+                ema, rest = values[0].item(), values[1:]
+            # Closed form of applying the EMA update once per value
+            decay = (1.0 - alpha) ** np.arange(len(rest) - 1, -1, -1)
+            emas[position] = ema * (1.0 - alpha) ** len(rest) + alpha * float(decay @ rest)
+        self.emas = emas
+        self.latest = values[-1].item()
+
+    def summary(self, size, values=None):
+        """Summarise the window of ``size`` values, or ``values`` themselves when given."""
+        if values is not None:
+            result = summarize(values)
+        else:
+            window = self.windows[size]
+            result = {
+                "count": window.count,
+                "min": window.min,
+                "max": window.max,
+                "mean": window.mean if window.count else None,
+                "stddev": window.stddev,
+            }
+        result["ema"] = dict(zip(self.spans, self.emas))
+        result["latest"] = self.latest
+        return result
+
+
+class DeviceStats:
+    """Rolling statistics for each field of one device, over several point-count windows."""
+
+    def __init__(self, windows, ema_spans=(), fields=DEFAULT_FIELDS):
+        self.windows = tuple(sorted(windows))
+        self.fields = {name: FieldStats(self.windows, ema_spans) for name in fields}
+
+    def add(self, **values):
+        fields = self.fields
+        for name, value in values.items():
+            if name in fields:
+                fields[name].add(value)
+
+    def extend(self, **columns):
+        for name, values in columns.items():
+            stats = self.fields.get(name)
+            if stats is not None:
+                stats.extend(values)
+
+    def summary(self, size, columns=None):
+        """Return ``{field: stats}`` for the window of ``size`` points in O(1).
+
+        With ``columns`` (``{field: values}``, such as a view of the device's
+        ring buffer) the statistics are computed from those values instead,
+        in O(len(values)); ``size`` is then not looked up.
+        """
+        if columns is not None:
+            return {name: stats.summary(size, columns.get(name, ())) for name, stats in self.fields.items()}
+        if size not in self.windows:
+            raise ValueError(f"no rolling statistics over {size} points; tracked windows are {self.windows}")
+        return {name: stats.summary(size) for name, stats in self.fields.items()}
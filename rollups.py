@@ -0,0 +1,287 @@
+import numpy as np
+
+from ring_buffer import DEFAULT_FIELDS
+
+# (resolution in seconds, number of buckets kept): 1 h of 1 s, 7 days of 1 min, 1 year of 1 h
+DEFAULT_LEVELS = ((1, 3600), (60, 10080), (3600, 8760))
+
+
+def parse_levels(spec):
+    """Parse ``"1:3600,60:10080"`` into ``((1, 3600), (60, 10080))``."""
+    levels = []
+    for item in spec.split(","):
+        if item.strip():
+            resolution, capacity = item.split(":")
+            levels.append((int(resolution), int(capacity)))
+    return tuple(sorted(levels)) or DEFAULT_LEVELS
+
+
+class RollupLevel:
+    """min/max/sum/count buckets at one fixed resolution.
+
+    The newest (open) bucket lives in plain Python values so that adding a
+    reading costs a handful of float operations. When a reading lands in a
+    later bucket, the open bucket is written into mirrored numpy columns,
+    which keep closed buckets contiguous for zero-copy range reads, the same
+    way ``RingBuffer`` does. Readings older than the open bucket are counted
+    in ``late`` and dropped. Timestamps and bucket starts count ``time_unit``
+    per second, while ``resolution`` is always in seconds.
+    """
+
+    def __init__(self, resolution, capacity, fields=DEFAULT_FIELDS, time_unit=1):
+        self.resolution = int(resolution)
+        self.capacity = int(capacity)
+        self.fields = tuple(fields)
+        self.width = self.resolution * time_unit
+        self.starts = np.zeros(2 * self.capacity, dtype=np.int64)
+        self._columns = {
+            name: {
+                "min": np.zeros(2 * self.capacity, dtype=np.float32),
+                "max": np.zeros(2 * self.capacity, dtype=np.float32),
+                "sum": np.zeros(2 * self.capacity, dtype=np.float64),
+                "count": np.zeros(2 * self.capacity, dtype=np.int64),
+            }
+            for name in self.fields
+        }
+        self._head = 0
+        self._size = 0
+        self._open_start = None
+        self._open = None
+        self.late = 0
+
+    def __len__(self):
+        return self._size + (self._open_start is not None)
+
+    @property
+    def oldest(self):
+        """Start of the oldest retained bucket, or None when empty."""
+        if self._size:
+            return int(self.starts[self._head + self.capacity - self._size])
+        return self._open_start
+
+    @property
+    def full(self):
+        return self._size == self.capacity
+
+    def add(self, timestamp, values):
+        """Fold one reading into its bucket."""
+        aggregates = {}
+        for name in self.fields:
+            value = values.get(name)
+            if value is not None and value == value:
+                aggregates[name] = [value, value, value, 1]
+        self._merge(timestamp - timestamp % self.width, aggregates)
+
+    def extend(self, timestamps, columns):
+        """Fold many time-ordered readings in, aggregating per bucket with numpy.
+
+        Buckets completed within the batch are written to the columns in one
+        go; only the bucket that stays open is kept in Python values.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        if not len(timestamps):
+            return
+        buckets = timestamps - timestamps % self.width
+        offsets = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+
+        per_field = {}
+        for name in self.fields:
+            if columns.get(name) is None:
+                continue
+            values = np.asarray(columns[name], dtype=np.float64)
+            valid = ~np.isnan(values)
+            per_field[name] = (
+                np.fmin.reduceat(values, offsets),
+                np.fmax.reduceat(values, offsets),
+                np.add.reduceat(np.where(valid, values, 0.0), offsets),
+                np.add.reduceat(valid.astype(np.int64), offsets),
+            )
+
+        ends = np.append(offsets[1:], len(timestamps))
+        run_buckets = buckets[offsets]
+        if np.any(run_buckets[1:] < run_buckets[:-1]):
+            # Out of order: fold run by run so late readings are counted and dropped
+            for index, offset in enumerate(offsets):
+                self._merge(int(run_buckets[index]), self._aggregates(per_field, index), int(ends[index] - offset))
+            return
+
+        index = 0
+        if self._open_start is not None:
+            index = int(np.searchsorted(run_buckets, self._open_start))
+            if index:
+                self.late += int(ends[index - 1])
+            if index < len(offsets) and run_buckets[index] == self._open_start:
+                self._merge(self._open_start, self._aggregates(per_field, index))
+                index += 1
+        last = len(offsets) - 1
+        if index > last:
+            return
+        self._close()
+        if index < last:
+            closed = slice(index, last)
+            self._write(
+                run_buckets[closed], {name: [values[closed] for values in arrays] for name, arrays in per_field.items()}
+            )
+        self._open_start = int(run_buckets[last])
+        self._open = self._aggregates(per_field, last)
+
+    @staticmethod
+    def _aggregates(per_field, index):
+        aggregates = {}
+        for name, (mins, maxs, sums, counts) in per_field.items():
+            if counts[index]:
+                aggregates[name] = [float(mins[index]), float(maxs[index]), float(sums[index]), int(counts[index])]
+        return aggregates
+
+    def _write(self, starts, per_field):
+        """Write complete buckets, oldest first, into the mirrored columns in one go."""
+        keep = min(len(starts), self.capacity)
+        positions = (self._head + np.arange(keep)) % self.capacity
+        mirrors = positions + self.capacity
+        self.starts[positions] = self.starts[mirrors] = starts[-keep:]
+        for name, column in self._columns.items():
+            if name in per_field:
+                aggregates = [values[-keep:] for values in per_field[name]]
+            else:
+                aggregates = (np.nan, np.nan, 0.0, 0)
+            for key, values in zip(("min", "max", "sum", "count"), aggregates):
+                column[key][positions] = column[key][mirrors] = values
+        self._head = (self._head + keep) % self.capacity
+        self._size = min(self.capacity, self._size + keep)
+
+    def _merge(self, bucket, aggregates, readings=1):
+        if self._open_start is not None and bucket < self._open_start:
+            self.late += readings
+            return
+        if bucket != self._open_start:
+            self._close()
+            self._open_start = bucket
+            self._open = {}
+        for name, (low, high, total, count) in aggregates.items():
+            current = self._open.get(name)
+            if current is None:
+                self._open[name] = [low, high, total, count]
+            else:
+                if low < current[0]:
+                    current[0] = low
+                if high > current[1]:
+                    current[1] = high
+                current[2] += total
+                current[3] += count
+
+    def _close(self):
+        if self._open_start is None:
+            return
+        head = self._head
+        mirror = head + self.capacity
+        self.starts[head] = self.starts[mirror] = self._open_start
+        for name, column in self._columns.items():
+            low, high, total, count = self._open.get(name, (np.nan, np.nan, 0.0, 0))
+            column["min"][head] = column["min"][mirror] = low
+            column["max"][head] = column["max"][mirror] = high
+            column["sum"][head] = column["sum"][mirror] = total
+            column["count"][head] = column["count"][mirror] = count
+        self._head = (head + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+
+    def range(self, field, start=None, end=None):
+        """Return copies of bucket starts and mean/min/max/count for buckets in ``[start, end)``."""
+        lo = self._head + self.capacity - self._size
+        hi = self._head + self.capacity
+        starts = self.starts[lo:hi]
+        left = 0 if start is None else int(np.searchsorted(starts, start - start % self.width, side="left"))
+        right = len(starts) if end is None else int(np.searchsorted(starts, end, side="left"))
+        right = max(left, right)
+        column = self._columns[field]
+
+        counts = column["count"][lo + left:lo + right]
+        series = {
+            "timestamps": starts[left:right].copy(),
+            "min": column["min"][lo + left:lo + right].astype(np.float64),
+            "max": column["max"][lo + left:lo + right].astype(np.float64),
+            "count": counts.copy(),
+        }
+        with np.errstate(invalid="ignore", divide="ignore"):
+            series["mean"] = column["sum"][lo + left:lo + right] / counts
+
+        open_start = self._open_start
+        if open_start is not None and (start is None or open_start + self.width > start) and (end is None or open_start < end):
+            low, high, total, count = self._open.get(field, (np.nan, np.nan, 0.0, 0))
+            series["timestamps"] = np.append(series["timestamps"], open_start)
+            series["min"] = np.append(series["min"], low)
+            series["max"] = np.append(series["max"], high)
+            series["count"] = np.append(series["count"], count)
+            series["mean"] = np.append(series["mean"], total / count if count else np.nan)
+        return series
+
+
+class DeviceRollups:
+    """Rollup levels for one device, from finest to coarsest resolution."""
+
+    def __init__(self, levels=DEFAULT_LEVELS, fields=DEFAULT_FIELDS, time_unit=1):
+        self.levels = [RollupLevel(resolution, capacity, fields, time_unit) for resolution, capacity in sorted(levels)]
+
+    def add(self, timestamp, **values):
+        for level in self.levels:
+            level.add(timestamp, values)
+
+    def extend(self, timestamps, **columns):
+        for level in self.levels:
+            level.extend(timestamps, columns)
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets downsampling.
+
+    Returns the indices of at most ``threshold`` points that preserve the
+    visual shape of ``(x, y)``. The first and last points are always kept
+    and NaN values are never selected over real ones. The inner loop works
+    on plain Python floats: buckets hold only a few points each, which makes
+    per-bucket numpy calls far slower than scalar arithmetic.
+    """
+    length = len(x)
+    if threshold >= length:
+        return np.arange(length)
+    if threshold < 3:
+        return np.array([0, length - 1][:max(threshold, 0)], dtype=np.int64)
+
+    xs = np.asarray(x, dtype=np.float64).tolist()
+    ys = np.asarray(y, dtype=np.float64).tolist()
+    every = (length - 2) / (threshold - 2)
+    selected = [0]
+    previous = 0
+
+    for bucket in range(threshold - 2):
+        lo = int(bucket * every) + 1
+        hi = int((bucket + 1) * every) + 1
+        next_hi = min(int((bucket + 2) * every) + 1, length)
+
+        # Average of the next bucket is the third corner of the triangle
+        next_x = next_y = 0.0
+        count = 0
+        for index in range(hi, next_hi):
+            value = ys[index]
+            if value == value:
+                next_x += xs[index]
+                next_y += value
+                count += 1
+        if count:
+            next_x /= count
+            next_y /= count
+        else:
+            next_x, next_y = xs[length - 1], ys[length - 1]
+
+        prev_x, prev_y = xs[previous], ys[previous]
+        best_area = -1.0
+        choice = lo
+        for index in range(lo, hi):
+            area = abs((prev_x - next_x) * (ys[index] - prev_y) - (prev_x - xs[index]) * (next_y - prev_y))
+            if area > best_area:
+                best_area = area
+                choice = index
+        selected.append(choice)
+        previous = choice
+
+    selected.append(length - 1)
+    return np.array(selected, dtype=np.int64)
@@ -0,0 +1,167 @@
+import os
+import struct
+from multiprocessing import shared_memory
+
+MAGIC = b"IOTDHT02"
+# magic, generation, capacity, slot size, write sequence
+HEADER = struct.Struct("<8sqqqq")
+WRITE_SEQ_OFFSET = 8 + 8 * 3
+HEADER_SIZE = 64
+# slot sequence (commit marker), payload length
+SLOT_HEADER = struct.Struct("<qi4x")
+SEQ = struct.Struct("<q")
+
+# Raw MQTT message stored in a slot: receive time (epoch ns), QoS, topic length
+RECORD = struct.Struct("<qBH")
+
+
+def encode_record(topic, payload, qos=0, received_at=0):
+    """Pack a raw MQTT message for the shared log."""
+    topic_bytes = topic.encode()
+    return RECORD.pack(received_at, qos, len(topic_bytes)) + topic_bytes + bytes(payload)
+
+
+def decode_record(data):
+    """Inverse of encode_record: return ``(topic, payload, qos, received_at)``."""
+    received_at, qos, topic_length = RECORD.unpack_from(data)
+    start = RECORD.size
+    topic = data[start:start + topic_length].decode(errors="replace")
+    return topic, data[start + topic_length:], qos, received_at
+
+
+def _attach(name):
+    """Attach to an existing segment without letting this process unlink it on exit."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers attached segments with the resource tracker
+        segment = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+
+            resource_tracker.unregister(segment._name, "shared_memory")
+        except Exception:
+            pass
+        return segment
+
+
+class SharedMessageLog:
+    """Single-writer, multi-reader ring of byte records in shared memory.
+
+    The ingest process is the only writer. Each slot begins with the
+    sequence number of the record it holds, which the writer sets to -1
+    while the slot is being rewritten and to the new sequence once it is
+    complete. Readers copy a slot and re-check its sequence afterwards, so
+    they never take a lock and simply skip records that were overwritten
+    while they were behind. Records longer than the slot are truncated.
+    """
+
+    def __init__(self, segment, owner):
+        self._segment = segment
+        self._buf = segment.buf
+        self.owner = owner
+        magic, self.generation, self.capacity, self.slot_size, self._seq = HEADER.unpack_from(self._buf)
+        if magic != MAGIC:
+            raise ValueError(f"shared memory segment {segment.name!r} is not a message log")
+        self.truncated = 0
+
+    @classmethod
+    def create(cls, name, capacity, slot_size):
+        """Create (or replace) the named log. Called by the ingest process."""
+        try:
+            stale = _attach(name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        size = HEADER_SIZE + capacity * slot_size
+        segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        generation = int.from_bytes(os.urandom(8), "little") >> 1
+        HEADER.pack_into(segment.buf, 0, MAGIC, generation, capacity, slot_size, 0)
+        for index in range(capacity):
+            SLOT_HEADER.pack_into(segment.buf, HEADER_SIZE + index * slot_size, 0, 0)
+        return cls(segment, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to the named log as a reader. Raises FileNotFoundError if absent."""
+        return cls(_attach(name), owner=False)
+
+    @property
+    def head(self):
+        """Sequence number of the newest complete record (0 if none)."""
+        return SEQ.unpack_from(self._buf, WRITE_SEQ_OFFSET)[0]
+
+    def append(self, data):
+        """Write one record and return its sequence number. Writer only."""
+        seq = self._seq + 1
+        offset = HEADER_SIZE + (seq % self.capacity) * self.slot_size
+        room = self.slot_size - SLOT_HEADER.size
+        if len(data) > room:
+            data = data[:room]
+            self.truncated += 1
+
+        SEQ.pack_into(self._buf, offset, -1)
+        start = offset + SLOT_HEADER.size
+        self._buf[start:start + len(data)] = data
+        SLOT_HEADER.pack_into(self._buf, offset, seq, len(data))
+        SEQ.pack_into(self._buf, WRITE_SEQ_OFFSET, seq)
+        self._seq = seq
+        return seq
+
+    def extend(self, records):
+        """Write many records and return the sequence number of the first. Writer only.
+
+        The write sequence readers poll is published once, after the last record.
+        """
+        buf = self._buf
+        room = self.slot_size - SLOT_HEADER.size
+        first = seq = self._seq + 1
+        for data in records:
+            offset = HEADER_SIZE + (seq % self.capacity) * self.slot_size
+            if len(data) > room:
+                data = data[:room]
+                self.truncated += 1
+            SEQ.pack_into(buf, offset, -1)
+            start = offset + SLOT_HEADER.size
+            buf[start:start + len(data)] = data
+            SLOT_HEADER.pack_into(buf, offset, seq, len(data))
+            seq += 1
+        if seq > first:
+            self._seq = seq - 1
+            SEQ.pack_into(buf, WRITE_SEQ_OFFSET, self._seq)
+        return first
+
+    def read_since(self, cursor, limit=1024):
+        """Return ``(records, cursor)`` for up to ``limit`` records after ``cursor``.
+
+        ``records`` is a list of ``(seq, bytes)``. Records overwritten before
+        they could be read are skipped; the returned cursor always advances
+        past them.
+        """
+        head = self.head
+        if head <= cursor:
+            return [], cursor
+        first = max(cursor + 1, head - self.capacity + 1)
+        last = min(head, first + limit - 1)
+        records = []
+        for seq in range(first, last + 1):
+            offset = HEADER_SIZE + (seq % self.capacity) * self.slot_size
+            slot_seq, length = SLOT_HEADER.unpack_from(self._buf, offset)
+            if slot_seq != seq:
+                continue
+            start = offset + SLOT_HEADER.size
+            data = bytes(self._buf[start:start + length])
+            if SEQ.unpack_from(self._buf, offset)[0] == seq:
+                records.append((seq, data))
+        return records, last
+
+    def close(self):
+        """Detach, and remove the segment if this process created it."""
+        self._buf = None
+        self._segment.close()
+        if self.owner:
+            try:
+                self._segment.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,43 @@
+import time
+
+import numpy as np
+import pytest
+
+import mqtt_client
+from device_store import DeviceStore
+from ring_buffer import NS_PER_S
+from tsdb import SegmentStore
+
+
+def test_warm_from_history_restores_statistics(tmp_path, monkeypatch):
+    fields = mqtt_client.device_store.fields
+    writer = SegmentStore(str(tmp_path), fields=fields, flush_interval_s=0.01)
+    writer.start()
+    start = time.time_ns()
+    temperatures = [20.0 + index % 7 for index in range(150)]
+    for index, temperature in enumerate(temperatures):
+        writer.append("node-1", start + index * NS_PER_S, temperature=temperature, humidity=40.0 + index % 3)
+    writer.close()
+
+    monkeypatch.setattr(mqtt_client, "history_store", SegmentStore(str(tmp_path), fields=fields, readonly=True))
+    monkeypatch.setattr(
+        mqtt_client,
+        "device_store",
+        DeviceStore(
+            mqtt_client.MAX_DATA_POINTS,
+            fields=fields,
+            stats_windows=mqtt_client.STATS_ROLLING_WINDOWS,
+            ema_spans=mqtt_client.STATS_EMA_SPANS,
+        ),
+    )
+
+    assert mqtt_client.warm_from_history() == len(temperatures)
+    for window in mqtt_client.STATS_WINDOWS:
+        expected = np.array(temperatures[-window:])
+        stats = mqtt_client.get_stats(window, device_id="node-1")["fields"]["temperature"]
+        assert stats["count"] == len(expected)
+        assert stats["min"] == expected.min()
+        assert stats["max"] == expected.max()
+        assert stats["mean"] == pytest.approx(expected.mean())
+        assert stats["stddev"] == pytest.approx(expected.std(ddof=1))
+        assert stats["latest"] == temperatures[-1]
@@ -0,0 +1,353 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from ring_buffer import DEFAULT_FIELDS, NS_PER_S
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".seg"
+# Present once a store's timestamps are epoch nanoseconds; older stores hold epoch seconds
+TIME_UNIT_FILE = "TIME_UNIT"
+# Timestamps beyond this cannot be epoch seconds (it is the year 33658)
+MAX_EPOCH_S = 10**12
+
+
+def record_dtype(fields=DEFAULT_FIELDS):
+    """Fixed-size on-disk record: int64 epoch-nanosecond timestamp followed by float32 fields."""
+    return np.dtype([("timestamp", "<i8")] + [(name, "<f4") for name in fields])
+
+
+class Segment:
+    """One append-only file of fixed-size records, named after its first timestamp."""
+
+    __slots__ = ("path", "first_ts", "last_ts", "count")
+
+    def __init__(self, path, first_ts, last_ts, count):
+        self.path = path
+        self.first_ts = first_ts
+        self.last_ts = last_ts
+        self.count = count
+
+
+class SegmentStore:
+    """Durable append-only time-series store with memory-mapped reads.
+
+    Each device gets a directory of segment files. A segment holds at most
+    ``segment_records`` fixed-size records in timestamp order; when it is
+    full, writes rotate to a new file. The in-memory time index (first/last
+    timestamp and record count per segment) is rebuilt from the files on
+    start-up, so there is no separate index file to corrupt.
+
+    ``append`` only enqueues. A writer thread drains the queue in batches,
+    so the MQTT network thread never touches the disk. The same thread drops
+    segments older than the retention period.
+
+    A ``readonly`` store never writes and re-reads the index from disk on
+    every query, so other processes can read what the writer process stores.
+    A writable store converts the timestamps of a store written before they
+    were epoch nanoseconds when it opens it.
+    """
+
+    def __init__(
+        self,
+        directory,
+        fields=DEFAULT_FIELDS,
+        segment_records=1_000_000,
+        retention_s=None,
+        flush_interval_s=0.5,
+        compact_interval_s=300,
+        readonly=False,
+    ):
+        self.directory = directory
+        self.fields = tuple(fields)
+        self.dtype = record_dtype(self.fields)
+        self.segment_records = int(segment_records)
+        self.retention_s = retention_s
+        self.flush_interval_s = flush_interval_s
+        self.compact_interval_s = compact_interval_s
+        self.readonly = readonly
+
+        self._queue = queue.SimpleQueue()
+        self._index = {}
+        self._index_lock = threading.Lock()
+        self._files = {}
+        self._thread = None
+        self._stopping = threading.Event()
+
+        os.makedirs(directory, exist_ok=True)
+        if not readonly:
+            self._migrate_to_nanoseconds()
+        self._load_index()
+
+    # -- index -------------------------------------------------------------
+
+    def _device_dir(self, device_id):
+        return os.path.join(self.directory, quote(device_id, safe=""))
+
+    def _load_index(self):
+        index = {}
+        for entry in sorted(os.listdir(self.directory)):
+            device_dir = os.path.join(self.directory, entry)
+            if not os.path.isdir(device_dir):
+                continue
+            segments = self._load_device(device_dir)
+            if segments:
+                index[unquote(entry)] = segments
+        with self._index_lock:
+            self._index = index
+
+    def _load_device(self, device_dir):
+        segments = []
+        for name in sorted(os.listdir(device_dir)):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            try:
+                segment = self._open_segment(os.path.join(device_dir, name))
+            except FileNotFoundError:
+                continue
+            if segment is not None:
+                segments.append(segment)
+        return segments
+
+    def _open_segment(self, path):
+        """Build the index entry for an existing file, dropping any torn trailing record."""
+        size = os.path.getsize(path)
+        count = size // self.dtype.itemsize
+        if size % self.dtype.itemsize and not self.readonly:
+            with open(path, "r+b") as handle:
+                handle.truncate(count * self.dtype.itemsize)
+        if not count:
+            if not self.readonly:
+                os.remove(path)
+            return None
+        records = np.memmap(path, dtype=self.dtype, mode="r", shape=(count,))
+        segment = Segment(path, int(records["timestamp"][0]), int(records["timestamp"][-1]), count)
+        del records
+        return segment
+
+    def _migrate_to_nanoseconds(self):
+        """Rescale epoch-second timestamps to nanoseconds in place, once per store."""
+        marker = os.path.join(self.directory, TIME_UNIT_FILE)
+        if os.path.exists(marker):
+            return
+        converted = 0
+        for entry in os.listdir(self.directory):
+            device_dir = os.path.join(self.directory, entry)
+            if not os.path.isdir(device_dir):
+                continue
+            for name in os.listdir(device_dir):
+                if not name.endswith(SEGMENT_SUFFIX):
+                    continue
+                path = os.path.join(device_dir, name)
+                count = os.path.getsize(path) // self.dtype.itemsize
+                if not count:
+                    continue
+                records = np.memmap(path, dtype=self.dtype, mode="r+", shape=(count,))
+                # Checked per file, so a conversion interrupted half-way resumes safely
+                if records["timestamp"][0] < MAX_EPOCH_S:
+                    records["timestamp"] *= NS_PER_S
+                    records.flush()
+                    converted += count
+                first_ts = int(records["timestamp"][0])
+                del records
+                os.replace(path, os.path.join(device_dir, f"{first_ts:020d}{SEGMENT_SUFFIX}"))
+        with open(marker, "w") as handle:
+            handle.write("ns\n")
+        if converted:
+            logger.info("✓ Converted %d stored readings in %s to nanosecond timestamps", converted, self.directory)
+
+    def devices(self):
+        """Return the IDs of all devices with stored history."""
+        if self.readonly:
+            self._load_index()
+        with self._index_lock:
+            return sorted(self._index)
+
+    def _segments(self, device_id):
+        if self.readonly:
+            device_dir = self._device_dir(device_id)
+            return self._load_device(device_dir) if os.path.isdir(device_dir) else []
+        with self._index_lock:
+            return [
+                Segment(segment.path, segment.first_ts, segment.last_ts, segment.count)
+                for segment in self._index.get(device_id, [])
+            ]
+
+    # -- writes ------------------------------------------------------------
+
+    def start(self):
+        """Start the background writer thread."""
+        if self._thread is None and not self.readonly:
+            self._thread = threading.Thread(target=self._run, name="tsdb-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def append(self, device_id, timestamp, **values):
+        """Queue one reading for durable storage. Never blocks on disk I/O."""
+        if self.readonly:
+            raise RuntimeError("cannot append to a read-only segment store")
+        self._queue.put((device_id, timestamp, values))
+
+    def close(self):
+        """Flush queued readings and stop the writer thread."""
+        if self._thread is not None and not self._stopping.is_set():
+            self._stopping.set()
+            self._queue.put(None)
+            self._thread.join()
+        for handle in self._files.values():
+            handle.close()
+        self._files.clear()
+
+    def _run(self):
+        next_compaction = time.monotonic() + self.compact_interval_s
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval_s)]
+            except queue.Empty:
+                batch = []
+            try:
+                while True:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            stop = None in batch
+            readings = [item for item in batch if item is not None]
+            if readings:
+                try:
+                    self._write_batch(readings)
+                except OSError:
+                    logger.exception("✗ Failed to persist %d readings", len(readings))
+
+            if stop:
+                return
+            if time.monotonic() >= next_compaction:
+                try:
+                    self.compact()
+                except OSError:
+                    logger.exception("✗ Segment compaction failed")
+                next_compaction = time.monotonic() + self.compact_interval_s
+
+    def _write_batch(self, readings):
+        by_device = {}
+        for device_id, timestamp, values in readings:
+            by_device.setdefault(device_id, []).append((timestamp, values))
+
+        for device_id, rows in by_device.items():
+            records = np.empty(len(rows), dtype=self.dtype)
+            records["timestamp"] = [timestamp for timestamp, _ in rows]
+            for name in self.fields:
+                records[name] = [values.get(name, np.nan) for _, values in rows]
+            self._write_records(device_id, records)
+
+    def _write_records(self, device_id, records):
+        offset = 0
+        while offset < len(records):
+            segment = self._active_segment(device_id, int(records["timestamp"][offset]))
+            take = min(self.segment_records - segment.count, len(records) - offset)
+            chunk = records[offset:offset + take]
+            handle = self._files[device_id]
+            handle.write(chunk.tobytes())
+            handle.flush()
+            with self._index_lock:
+                segment.count += take
+                segment.last_ts = int(chunk["timestamp"][-1])
+            offset += take
+
+    def _active_segment(self, device_id, first_ts):
+        """Return a segment with free space, rotating to a new file when full."""
+        with self._index_lock:
+            segments = self._index.setdefault(device_id, [])
+            segment = segments[-1] if segments else None
+        if segment is not None and segment.count < self.segment_records:
+            if device_id not in self._files:
+                self._files[device_id] = open(segment.path, "ab")
+            return segment
+
+        device_dir = self._device_dir(device_id)
+        os.makedirs(device_dir, exist_ok=True)
+        path = os.path.join(device_dir, f"{first_ts:020d}{SEGMENT_SUFFIX}")
+        if device_id in self._files:
+            self._files.pop(device_id).close()
+        self._files[device_id] = open(path, "ab")
+        segment = Segment(path, first_ts, first_ts, 0)
+        with self._index_lock:
+            segments.append(segment)
+        return segment
+
+    # -- maintenance -------------------------------------------------------
+
+    def compact(self, now=None):
+        """Drop closed segments whose newest reading is older than the retention period.
+
+        ``now`` is in epoch seconds, like ``retention_s``. Segments only close
+        when full, and a restart appends to the last one, so there are no
+        small segments to merge.
+        """
+        if not self.retention_s:
+            return
+        now = time.time() if now is None else now
+        cutoff = int((now - self.retention_s) * NS_PER_S)
+        for device_id in self.devices():
+            with self._index_lock:
+                closed = list(self._index.get(device_id, []))[:-1]
+            expired = [segment for segment in closed if segment.last_ts < cutoff]
+            if not expired:
+                continue
+            for segment in expired:
+                os.remove(segment.path)
+            with self._index_lock:
+                self._index[device_id] = [segment for segment in self._index[device_id] if segment not in expired]
+
+    # -- reads -------------------------------------------------------------
+
+    def iter_range(self, device_id, start=None, end=None):
+        """Yield zero-copy memory-mapped record slices with ``start <= timestamp < end``."""
+        for segment in self._segments(device_id):
+            if start is not None and segment.last_ts < start:
+                continue
+            if end is not None and segment.first_ts >= end:
+                break
+            try:
+                records = np.memmap(segment.path, dtype=self.dtype, mode="r", shape=(segment.count,))
+            except FileNotFoundError:
+                # Merged or expired by compaction after the index snapshot
+                continue
+            stamps = records["timestamp"]
+            lo = 0 if start is None else int(np.searchsorted(stamps, start, side="left"))
+            hi = segment.count if end is None else int(np.searchsorted(stamps, end, side="left"))
+            if hi > lo:
+                yield records[lo:hi]
+
+    def query(self, device_id, start=None, end=None):
+        """Return matching records as one array (copied only when spanning segments)."""
+        chunks = list(self.iter_range(device_id, start, end))
+        if not chunks:
+            return np.empty(0, dtype=self.dtype)
+        if len(chunks) == 1:
+            return chunks[0]
+        return np.concatenate(chunks)
+
+    def tail(self, device_id, count):
+        """Return up to the last ``count`` records of a device."""
+        chunks = []
+        remaining = count
+        for segment in reversed(self._segments(device_id)):
+            if remaining <= 0:
+                break
+            try:
+                records = np.memmap(segment.path, dtype=self.dtype, mode="r", shape=(segment.count,))
+            except FileNotFoundError:
+                continue
+            chunks.append(records[max(0, segment.count - remaining):])
+            remaining -= len(chunks[-1])
+        if not chunks:
+            return np.empty(0, dtype=self.dtype)
+        return np.concatenate(chunks[::-1])
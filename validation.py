@@ -0,0 +1,150 @@
+import math
+import threading
+from collections import deque
+
+from cache import LRUCache
+from metrics import Counter
+from ring_buffer import NS_PER_S
+
+REJECTED_MESSAGES = Counter(
+    "mqtt_rejected_messages_total", "Sensor messages dropped at ingest instead of stored", ("reason",)
+)
+
+# Why a sensor message was rejected
+REASONS = ("json", "not_object", "missing", "type", "range", "duplicate")
+
+
+def parse_limits(spec):
+    """Parse ``"temperature:-40:80,humidity:0:100"`` into ``{"temperature": (-40.0, 80.0), ...}``."""
+    limits = {}
+    for item in spec.split(","):
+        if item.strip():
+            name, low, high = item.rsplit(":", 2)
+            limits[name.strip()] = (float(low), float(high))
+    return limits
+
+
+class ReadingSchema:
+    """Type and range checks for the reading fields of a decoded payload.
+
+    Every field must be a JSON number (booleans are not) within its
+    ``limits``. A missing field is stored as NaN, which the buffers and
+    statistics treat as no value; a payload with none of the fields is
+    rejected. Fields without limits only need to be numbers.
+    """
+
+    def __init__(self, fields, limits=None):
+        limits = limits or {}
+        self.fields = tuple(fields)
+        self._checks = tuple((name, *limits.get(name, (-math.inf, math.inf))) for name in self.fields)
+
+    def validate(self, payload):
+        """Return ``(values, None)`` with one float per field, or ``(None, reason)``."""
+        if type(payload) is not dict:
+            return None, "not_object"
+        values = []
+        present = False
+        for name, low, high in self._checks:
+            value = payload.get(name)
+            if value is None:
+                values.append(math.nan)
+                continue
+            kind = type(value)
+            if kind is not float and kind is not int:
+                return None, "type"
+            # Also false for NaN
+            if not low <= value <= high:
+                return None, "range"
+            values.append(float(value))
+            present = True
+        if not present:
+            return None, "missing"
+        return values, None
+
+
+class DuplicateFilter:
+    """Recognise redelivered messages by their device sequence number or payload hash.
+
+    Keys seen in the last ``window_s`` seconds are remembered in a bounded
+    LRU of ``size`` entries, so the cost per message is constant and old
+    keys age out on their own. A message is keyed by its device's counter
+    when it carries one, and otherwise by a hash of the raw payload when the
+    payload carries the device's send time. Payloads with neither are never
+    treated as duplicates, because a sensor repeating the same reading is
+    normal. A counter only matches when the payload hash matches too, so a
+    device that reboots and starts counting again is not mistaken for a
+    redelivery.
+    """
+
+    def __init__(self, size, window_s, name="dedup"):
+        self.window_ns = int(window_s * NS_PER_S)
+        self._seen = LRUCache(size, name=name) if size > 0 else None
+
+    def seen(self, device_id, counter, stamped, raw_payload, received_at):
+        """Record the message and return True if it was already seen within the window.
+
+        ``counter`` is the device's sequence number or None, ``stamped``
+        whether the payload carries a send time, ``received_at`` epoch ns.
+        """
+        if self._seen is None:
+            return False
+        digest = hash(raw_payload)
+        if type(counter) is int:
+            key = (device_id, counter)
+        elif stamped:
+            key = (device_id, digest)
+        else:
+            return False
+        entry = self._seen.get(key)
+        if entry is not None and entry[1] == digest and received_at - entry[0] <= self.window_ns:
+            return True
+        self._seen.put(key, (received_at, digest))
+        return False
+
+    def clear(self):
+        if self._seen is not None:
+            self._seen.clear()
+
+
+class RejectSampler:
+    """Count rejected messages by reason and keep a bounded sample of them.
+
+    The first of every ``every`` rejections per reason is kept, with its
+    payload cut to ``preview_bytes``, among the newest ``size`` samples;
+    the others are only counted.
+    """
+
+    def __init__(self, size=50, every=10, preview_bytes=200):
+        self.every = max(1, int(every))
+        self.preview_bytes = preview_bytes
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(REASONS, 0)
+        self._counters = {reason: REJECTED_MESSAGES.labels(reason) for reason in REASONS}
+
+    def reject(self, reason, topic, raw_payload, received_at):
+        """Count one rejection; return the sample if this one was kept, else None."""
+        count = self._counts[reason]
+        self._counts[reason] = count + 1
+        self._counters[reason].inc()
+        if count % self.every:
+            return None
+        sample = {
+            "reason": reason,
+            "topic": topic,
+            "timestamp": received_at,
+            "payload": bytes(raw_payload[:self.preview_bytes]).decode(errors="replace"),
+        }
+        with self._lock:
+            self._samples.append(sample)
+        return sample
+
+    def counts(self):
+        return dict(self._counts)
+
+    def samples(self, limit=None):
+        """Return kept samples, newest first."""
+        with self._lock:
+            samples = list(self._samples)
+        samples.reverse()
+        return samples[:limit] if limit else samples